@@ -0,0 +1,178 @@
+# app/bm25.py
+"""
+Lexical (BM25) index over the same chunks as the vector store.
+
+Dense bge-m3 vectors are weak on exact terms — law names, party acronyms,
+paragraph numbers ("§ 219a"), compound nouns ("Bürgergeld"). This index is
+rebuilt at the end of every ingestion sync from the collection itself, so the
+chunk ids line up with the dense index and the two rankings can be fused (RRF).
+
+Persisted as embeddings/chromadb/bm25.json.gz, tagged with the index version.
+"""
+import gzip
+import json
+import math
+import re
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+BM25_NAME = "bm25.json.gz"
+RRF_K = 60   # standard reciprocal-rank-fusion constant
+
+# § references are kept as one token: "§ 219a" → "§219a"; numbers keep their separators
+_TOKEN_RE = re.compile(r"§+\s*\d+[a-z]?|\d+(?:[.,]\d+)*|[^\W\d_]+(?:-[^\W\d_]+)*", re.UNICODE)
+
+_STOPWORDS = frozenset("""
+aber alle allem allen aller alles als also am an ander andere anderem anderen anderer anderes
+auch auf aus bei bin bis bist da damit dann das dass dein deine dem den der des dessen dich die
+dies diese diesem diesen dieser dieses dir doch dort du durch ein eine einem einen einer eines
+er es etwas euch euer für gegen hat hatte hier hin ich ihm ihn ihnen ihr ihre im in ist ja jede
+jedem jeden jeder jedes kann kein keine können man mehr mein mich mir mit muss nach nicht nichts
+noch nun nur ob oder ohne sehr sein seine sich sie sind so soll sollen sondern um und uns unser
+unter viel vom von vor war waren warum was weil welche wenn wer werden wie wieder will wir wird
+wo wurde zu zum zur über sagt steht gibt the and of
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    out = []
+    for m in _TOKEN_RE.finditer(text.lower()):
+        tok = re.sub(r"\s+", "", m.group(0))
+        if tok in _STOPWORDS or (len(tok) < 2 and not tok.isdigit()):
+            continue
+        out.append(tok)
+    return out
+
+
+def is_lexical_query(query: str) -> bool:
+    """
+    Keyword-style query that BM25 answers on its own: quoted, very short, or
+    made only of exact terms (numbers, § references, ALL-CAPS acronyms).
+    """
+    q = query.strip()
+    if len(q) > 1 and q[0] == q[-1] == '"':
+        return True
+    words = q.split()
+    if not words:
+        return False
+    if len(tokenize(q)) <= 2 and len(words) <= 3:
+        return True
+    return all(any(c.isdigit() for c in w) or "§" in w or (w.isupper() and len(w) >= 2) for w in words)
+
+
+class BM25Index:
+    def __init__(self, ids: List[str], documents: List[str], metadatas: List[Dict],
+                 postings: Dict[str, Tuple[np.ndarray, np.ndarray]], doc_len: np.ndarray,
+                 version: str = "", k1: float = 1.5, b: float = 0.75):
+        self.ids = ids
+        self.documents = documents
+        self.metadatas = metadatas
+        self.postings = postings
+        self.doc_len = doc_len
+        self.avgdl = float(doc_len.mean()) if len(doc_len) else 0.0
+        self.version = version
+        self.k1 = k1
+        self.b = b
+
+    # ---------- build / persist ----------
+    @classmethod
+    def build(cls, ids: List[str], documents: List[str], metadatas: List[Dict], version: str = "") -> "BM25Index":
+        raw: Dict[str, Dict[int, int]] = {}
+        doc_len = np.zeros(len(ids), dtype=np.float32)
+        for i, text in enumerate(documents):
+            toks = tokenize(text or "")
+            doc_len[i] = len(toks)
+            for t in toks:
+                d = raw.setdefault(t, {})
+                d[i] = d.get(i, 0) + 1
+        postings = {
+            t: (np.fromiter(d.keys(), dtype=np.int32, count=len(d)),
+                np.fromiter(d.values(), dtype=np.float32, count=len(d)))
+            for t, d in raw.items()
+        }
+        metas = [{k: (m or {}).get(k, d) for k, d in (("source", "Unknown"), ("page", "?"), ("start_index", None))}
+                 for m in metadatas]
+        return cls(list(ids), list(documents), metas, postings, doc_len, version)
+
+    def save(self, persist_dir: Path) -> None:
+        data = {
+            "version": self.version,
+            "ids": self.ids,
+            "documents": self.documents,
+            "metadatas": self.metadatas,
+            "doc_len": self.doc_len.tolist(),
+            "postings": {t: [d.tolist(), f.tolist()] for t, (d, f) in self.postings.items()},
+        }
+        p = Path(persist_dir) / BM25_NAME
+        tmp = p.with_suffix(".tmp")
+        with gzip.open(tmp, "wt", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        tmp.replace(p)
+
+    @classmethod
+    def load(cls, persist_dir: Path) -> Optional["BM25Index"]:
+        p = Path(persist_dir) / BM25_NAME
+        try:
+            with gzip.open(p, "rt", encoding="utf-8") as f:
+                data = json.load(f)
+        except (FileNotFoundError, OSError, json.JSONDecodeError):
+            return None
+        postings = {
+            t: (np.asarray(d, dtype=np.int32), np.asarray(tf, dtype=np.float32))
+            for t, (d, tf) in data["postings"].items()
+        }
+        return cls(data["ids"], data["documents"], data["metadatas"], postings,
+                   np.asarray(data["doc_len"], dtype=np.float32), data.get("version", ""))
+
+    # ---------- search ----------
+    def scores(self, query: str) -> np.ndarray:
+        n = len(self.ids)
+        out = np.zeros(n, dtype=np.float32)
+        if not n:
+            return out
+        norm = self.k1 * (1 - self.b + self.b * self.doc_len / max(self.avgdl, 1e-9))
+        for t in set(tokenize(query)):
+            post = self.postings.get(t)
+            if post is None:
+                continue
+            docs, tf = post
+            df = len(docs)
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            out[docs] += idf * tf * (self.k1 + 1) / (tf + norm[docs])
+        return out
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        s = self.scores(query)
+        if not len(s):
+            return []
+        top = np.argsort(-s)[:k]
+        return [(int(i), float(s[i])) for i in top if s[i] > 0]
+
+
+def rrf(rankings: List[List[str]], k: int = RRF_K) -> Dict[str, float]:
+    """Reciprocal rank fusion of several ranked id lists."""
+    fused: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, cid in enumerate(ranking, 1):
+            fused[cid] = fused.get(cid, 0.0) + 1.0 / (k + rank)
+    return fused
+
+
+def build_from_collection(collection, persist_dir: Path, version: str) -> BM25Index:
+    t0 = time.perf_counter()
+    data = collection.get(include=["documents", "metadatas"])
+    idx = BM25Index.build(data["ids"], data["documents"], data["metadatas"], version)
+    idx.save(persist_dir)
+    print(f"BM25 index built: {len(idx.ids)} chunks, {len(idx.postings)} terms in {time.perf_counter() - t0:.1f}s")
+    return idx
+
+
+def ensure_bm25(collection, persist_dir: Path, version: str) -> BM25Index:
+    """Load the persisted index, rebuilding it if missing or built for another index version."""
+    idx = BM25Index.load(persist_dir)
+    if idx is None or idx.version != version:
+        idx = build_from_collection(collection, persist_dir, version)
+    return idx
@@ -0,0 +1,237 @@
+# app/cache.py
+"""
+In-process caches used by RAGPipeline.
+
+LRUCache: bounded key → value cache with hit/miss counters and an optional
+Redis second level (shared across workers). RAGPipeline keeps one for query
+embeddings and one for retrieval results; the latter is keyed on the index
+version and cleared whenever the index is re-synced.
+
+SemanticCache: previous answers looked up by query-embedding similarity
+(cosine ≥ threshold), so "Was sagt die AfD zur Migration?" and "Was sagt die
+AfD zum Thema Migration" share one generation. Entries are scoped to
+(index_version, chat_model) — a re-index or model swap never serves stale
+answers — and expire after a TTL; the least recently used entries are
+evicted once max_entries is reached.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+import numpy as np
+
+EMBED_CACHE_MAX     = int(os.getenv("EMBED_CACHE_MAX", "2048"))
+RETRIEVAL_CACHE_MAX = int(os.getenv("RETRIEVAL_CACHE_MAX", "512"))
+RETRIEVAL_CACHE_TTL = int(os.getenv("RETRIEVAL_CACHE_TTL", "3600"))   # seconds, 0 = no expiry
+CACHE_REDIS         = os.getenv("RAG_CACHE_REDIS", "0") == "1"        # share caches via Redis
+
+SEMANTIC_CACHE_ENABLED   = os.getenv("SEMANTIC_CACHE", "1") != "0"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_TTL       = int(os.getenv("SEMANTIC_CACHE_TTL", str(60 * 60 * 24)))  # seconds
+SEMANTIC_CACHE_MAX       = int(os.getenv("SEMANTIC_CACHE_MAX", "1000"))             # entries per scope
+_MAX_SCOPES = 4
+
+
+def _redis_client():
+    if not CACHE_REDIS:
+        return None
+    try:
+        import redis
+        return redis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+    except Exception:
+        return None
+
+
+_MISSING = object()
+
+
+class LRUCache:
+    def __init__(self, name: str, maxsize: int, ttl: int = 0, redis_client=None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._rc = redis_client
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()   # key → (ts, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _redis_key(self, key: Hashable) -> str:
+        raw = json.dumps(key, ensure_ascii=False, default=str)
+        return f"ragcache:{self.name}:" + hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is not _MISSING and (not self.ttl or time.time() - item[0] <= self.ttl):
+                self._data.move_to_end(key)
+                self.hits += 1
+                return item[1]
+            if item is not _MISSING:
+                del self._data[key]   # expired
+
+        # second level: Redis (optional, best effort)
+        if self._rc is not None:
+            try:
+                raw = self._rc.get(self._redis_key(key))
+                if raw:
+                    value = json.loads(raw)
+                    self._store(key, value)
+                    with self._lock:
+                        self.hits += 1
+                    return value
+            except Exception:
+                pass
+
+        with self._lock:
+            self.misses += 1
+        return default
+
+    def _store(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._data[key] = (time.time(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """value must be JSON-serializable if Redis backing is enabled."""
+        self._store(key, value)
+        if self._rc is not None:
+            try:
+                payload = json.dumps(value, ensure_ascii=False)
+                if self.ttl:
+                    self._rc.setex(self._redis_key(key), self.ttl, payload)
+                else:
+                    self._rc.set(self._redis_key(key), payload)
+            except Exception:
+                pass
+
+    def clear(self) -> None:
+        """Drop the in-process entries (Redis entries are keyed so they can't go stale)."""
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+def _unit(v) -> np.ndarray:
+    v = np.asarray(v, dtype=np.float32)
+    n = np.linalg.norm(v)
+    return v / n if n else v
+
+
+class _Scope:
+    """Entries of one (index_version, chat_model) scope + a lazily rebuilt matrix.
+
+    The matrix is rebuilt only when entries are added, evicted or expired; ids maps its rows
+    back to entry ids, whatever the current LRU order.
+    """
+
+    def __init__(self):
+        self.entries: "OrderedDict[int, Dict]" = OrderedDict()
+        self._ids: list = []
+        self._matrix: Optional[np.ndarray] = None
+
+    def matrix(self):
+        if self._matrix is None:
+            self._ids = list(self.entries)
+            self._matrix = (
+                np.stack([self.entries[i]["emb"] for i in self._ids])
+                if self._ids else np.zeros((0, 0), dtype=np.float32)
+            )
+        return self._ids, self._matrix
+
+    def invalidate(self):
+        self._matrix = None
+
+
+class SemanticCache:
+    def __init__(
+        self,
+        threshold: float = SEMANTIC_CACHE_THRESHOLD,
+        ttl: int = SEMANTIC_CACHE_TTL,
+        max_entries: int = SEMANTIC_CACHE_MAX,
+    ):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._scopes: "OrderedDict[Hashable, _Scope]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, q_emb, scope: Hashable) -> Optional[Dict]:
+        """Return {"query", "response", "chunks", "similarity"} of the best match, or None."""
+        q = _unit(q_emb)
+        now = time.time()
+        with self._lock:
+            sc = self._scopes.get(scope)
+            if sc is not None:
+                self._expire(sc, now)
+                ids, m = sc.matrix()
+                if ids:
+                    sims = m @ q
+                    best = int(np.argmax(sims))
+                    if sims[best] >= self.threshold:
+                        eid = ids[best]
+                        # LRU touch; the matrix rows follow the snapshot in ids, so order changes don't rebuild it
+                        sc.entries.move_to_end(eid)
+                        self.hits += 1
+                        e = sc.entries[eid]
+                        return {"query": e["query"], "response": e["response"],
+                                "chunks": e["chunks"], "similarity": float(sims[best])}
+            self.misses += 1
+            return None
+
+    def put(self, q_emb, scope: Hashable, query: str, response: str, chunks) -> None:
+        with self._lock:
+            sc = self._scopes.setdefault(scope, _Scope())
+            self._scopes.move_to_end(scope)
+            while len(self._scopes) > _MAX_SCOPES:
+                self._scopes.popitem(last=False)   # e.g. answers for a superseded index
+            # coalesced requests all store the answer they shared: keep one entry
+            for eid in [i for i, e in sc.entries.items() if e["query"] == query]:
+                del sc.entries[eid]
+            self._next_id += 1
+            sc.entries[self._next_id] = {
+                "emb": _unit(q_emb), "query": query, "response": response,
+                "chunks": chunks, "ts": time.time(),
+            }
+            while len(sc.entries) > self.max_entries:
+                sc.entries.popitem(last=False)   # least recently used
+            sc.invalidate()
+
+    def _expire(self, sc: _Scope, now: float) -> None:
+        dead = [i for i, e in sc.entries.items() if now - e["ts"] > self.ttl]
+        for i in dead:
+            del sc.entries[i]
+        if dead:
+            sc.invalidate()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._scopes.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": sum(len(s.entries) for s in self._scopes.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
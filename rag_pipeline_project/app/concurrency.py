@@ -0,0 +1,83 @@
+# app/concurrency.py
+"""
+Keeps blocking work off the FastAPI event loop.
+
+• WORKER_POOL: thread pool for Chroma queries / embedding calls (RAG_WORKER_THREADS)
+• LIMITER:     caps concurrent RAG requests (RAG_MAX_CONCURRENCY); everything
+               above that waits in a visible queue (RAG_MAX_QUEUE, 0 = unbounded)
+"""
+import asyncio
+import contextvars
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+
+WORKER_THREADS  = int(os.getenv("RAG_WORKER_THREADS", "8"))
+MAX_CONCURRENCY = int(os.getenv("RAG_MAX_CONCURRENCY", "4"))
+MAX_QUEUE       = int(os.getenv("RAG_MAX_QUEUE", "64"))
+
+WORKER_POOL = ThreadPoolExecutor(max_workers=WORKER_THREADS, thread_name_prefix="rag-worker")
+
+
+async def run_in_pool(fn, *args, **kwargs):
+    """Run a blocking callable on WORKER_POOL and await its result."""
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()   # keeps the request's metrics trace attached
+    return await loop.run_in_executor(WORKER_POOL, partial(ctx.run, fn, *args, **kwargs))
+
+
+class QueueFull(Exception):
+    """Raised when the wait queue is already at MAX_QUEUE."""
+
+
+class ConcurrencyLimiter:
+    def __init__(self, max_concurrency: int = MAX_CONCURRENCY, max_queue: int = MAX_QUEUE):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self._sem: asyncio.Semaphore | None = None   # created lazily on the running loop
+        self.in_flight = 0
+        self.waiting = 0
+        self.completed = 0
+        self.rejected = 0
+        self._wait_total = 0.0
+
+    @asynccontextmanager
+    async def slot(self):
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.max_concurrency)
+        if self.max_queue and self.waiting >= self.max_queue and self._sem.locked():
+            self.rejected += 1
+            raise QueueFull(f"{self.waiting} requests already waiting")
+
+        t0 = time.perf_counter()
+        self.waiting += 1
+        try:
+            await self._sem.acquire()
+        finally:
+            self.waiting -= 1
+        self._wait_total += time.perf_counter() - t0
+
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            self._sem.release()
+
+    def stats(self) -> dict:
+        started = self.completed + self.in_flight
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.waiting,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_wait_s": round(self._wait_total / started, 4) if started else 0.0,
+        }
+
+
+LIMITER = ConcurrencyLimiter()
@@ -0,0 +1,210 @@
+# app/context.py
+"""
+Prompt context budgeting: token counting + packing retrieved chunks and
+history into a fixed token budget.
+
+Token counting (RAG_TOKENIZER):
+  • path to a Hugging Face tokenizer.json (e.g. the Llama 3.1 one) — exact
+    counts via the `tokenizers` package, if it is installed
+  • "approx" (default) — local approximation of the Llama 3 BPE on German
+    text (~4 chars per word piece, digits in groups of 3, punctuation = 1)
+Counts are memoized per text, so re-retrieved chunks are free.
+
+pack_context():
+  1. merges chunks from the same page that overlap (the splitter uses
+     chunk_overlap=120, so neighbours repeat text) or touch
+  2. if fixed prompt + history + chunks exceed the budget, drops the
+     oldest history turns first (with history_slack some extra, so the
+     next turns fit without cutting again — keeps the prompt prefix, and
+     with it Ollama's KV cache, stable); the newest keep_turns are never
+     dropped, a follow-up always sees the exchange it follows up on
+  3. then drops the lowest-ranked chunks; the best chunk is truncated
+     rather than dropped
+"""
+import math
+import os
+import re
+from functools import lru_cache
+from typing import Callable, Dict, List, NamedTuple, Optional, Union
+
+from .metrics import Histogram, Counter
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("RAG_PROMPT_BUDGET", "3500"))   # llama3.1 in Ollama: num_ctx 4096 by default
+TOKENIZER = os.getenv("RAG_TOKENIZER", "approx")
+
+PROMPT_TOKENS = Histogram("rag_prompt_tokens", "Prompt size after context packing", (),
+                          buckets=(256, 512, 1024, 1536, 2048, 3072, 4096, 6144, 8192, 16384))
+CONTEXT_TRIMS = Counter("rag_context_trimmed_total", "Items removed to fit the prompt budget", ("kind",))
+
+_PIECE_RE = re.compile(r"\d+|[^\W\d_]+|[^\w\s]", re.UNICODE)
+
+
+def approx_tokens(text: str) -> int:
+    n = 0
+    for m in _PIECE_RE.finditer(text):
+        p = m.group(0)
+        if p[0].isdigit():
+            n += math.ceil(len(p) / 3)
+        elif p[0].isalpha():
+            n += max(1, math.ceil(len(p) / 4))
+        else:
+            n += 1
+    return n
+
+
+def _load_counter() -> Callable[[str], int]:
+    if TOKENIZER and TOKENIZER != "approx":
+        try:
+            from tokenizers import Tokenizer
+            tok = Tokenizer.from_file(TOKENIZER)
+            print(f"Token counting with {TOKENIZER}")
+            return lambda text: len(tok.encode(text, add_special_tokens=False).ids)
+        except Exception as e:   # optional dependency / missing file: fall back, don't fail requests
+            print(f"Tokenizer {TOKENIZER!r} unavailable ({e}); using approximation")
+    return approx_tokens
+
+
+_counter: Optional[Callable[[str], int]] = None
+
+
+@lru_cache(maxsize=8192)
+def count_tokens(text: str) -> int:
+    global _counter
+    if _counter is None:
+        _counter = _load_counter()
+    return _counter(text)
+
+
+# ─── chunk merging ───────────────────────────────────────────
+def _text(c: Dict) -> str:
+    return c.get("_full_content", c.get("content", ""))
+
+
+def _overlap(a: str, b: str, min_len: int = 20, max_len: int = 400) -> int:
+    """Length of the longest suffix of a that is a prefix of b (0 if < min_len)."""
+    head = b[:min_len]
+    if len(head) < min_len:
+        return 0
+    i = a.find(head, max(0, len(a) - max_len))
+    while i != -1:   # earliest match = longest overlap
+        if b.startswith(a[i:]):
+            return len(a) - i
+        i = a.find(head, i + 1)
+    return 0
+
+
+def _try_merge(a: Dict, b: Dict) -> Optional[str]:
+    """Merged text if b continues a (same page, overlapping or adjacent), else None."""
+    ta, tb = _text(a), _text(b)
+    sa, sb = a.get("_start"), b.get("_start")
+    if sa is not None and sb is not None:
+        end_a = sa + len(ta)
+        if sb >= sa and sb <= end_a + 1:   # overlap or touching
+            return ta + tb[max(0, end_a - sb):]
+        return None
+    if tb in ta:
+        return ta
+    n = _overlap(ta, tb)
+    return ta + tb[n:] if n else None
+
+
+def merge_chunks(chunks: List[Dict]) -> List[Dict]:
+    """
+    Merge overlapping/adjacent chunks of the same source page. The merged
+    chunk keeps the best-ranked member's position, id and score.
+    """
+    out: List[Dict] = []
+    for c in chunks:
+        merged = False
+        for i, o in enumerate(out):
+            if (o["source"], o["page"]) != (c["source"], c["page"]):
+                continue
+            first, second = (o, c) if (o.get("_start") or 0) <= (c.get("_start") or 0) else (c, o)
+            text = _try_merge(first, second) or _try_merge(second, first)
+            if text is not None:
+                starts = [x for x in (o.get("_start"), c.get("_start")) if x is not None]
+                out[i] = dict(o, _full_content=text, _start=min(starts) if starts else None)
+                merged = True
+                break
+        if not merged:
+            out.append(dict(c))
+    if len(out) < len(chunks):
+        CONTEXT_TRIMS.inc(len(chunks) - len(out), kind="merged_chunk")
+    return out
+
+
+# ─── history ─────────────────────────────────────────────────
+_TURN_RE = re.compile(r"^(?:User|Assistant): ", re.MULTILINE)
+
+
+def split_turns(history: str) -> List[str]:
+    """'User: …\\nAssistant: …' (endpoints.format_history) → one string per turn."""
+    if not history:
+        return []
+    starts = [m.start() for m in _TURN_RE.finditer(history)] or [0]
+    if starts[0] != 0:
+        starts.insert(0, 0)
+    return [history[a:b].rstrip("\n") for a, b in zip(starts, starts[1:] + [len(history)])]
+
+
+# ─── packing ─────────────────────────────────────────────────
+class PackedContext(NamedTuple):
+    chunks: List[Dict]    # merged + trimmed, in rank order
+    history: str
+    tokens: int           # fixed + history + chunks
+    dropped_turns: int
+    dropped_chunks: int
+
+
+def pack_context(
+    chunks: List[Dict],
+    history: Union[str, List[str]],
+    *,
+    fixed_tokens: int,
+    format_chunk: Callable[[Dict], str],
+    budget: int = PROMPT_TOKEN_BUDGET,
+    history_slack: int = 0,
+    keep_turns: int = 0,
+) -> PackedContext:
+    """
+    fixed_tokens: the prompt without history and context (system prompt,
+    instructions, query). format_chunk renders one chunk as it will appear
+    in the prompt, so headers are counted too. history is the formatted
+    history string, or a list of units that are dropped whole (chat mode
+    passes one string per exchange). The last keep_turns units always stay;
+    chunks are cut instead.
+    """
+    chunks = merge_chunks(chunks)
+    sep = 2   # "\n\n" between blocks, roughly
+    chunk_tok = [count_tokens(format_chunk(c)) + sep for c in chunks]
+    turns = split_turns(history) if isinstance(history, str) else list(history)
+    turn_tok = [count_tokens(t) + 1 for t in turns]
+
+    total = fixed_tokens + sum(turn_tok) + sum(chunk_tok)
+    dropped_turns = 0
+    target = budget - history_slack if total > budget else budget
+    while total > target and len(turns) > keep_turns:   # 1) history first, oldest turn first
+        turns.pop(0)
+        total -= turn_tok.pop(0)
+        dropped_turns += 1
+
+    dropped_chunks = 0
+    while total > budget and len(chunks) > 1:   # 2) then the weakest chunks
+        chunks.pop()
+        total -= chunk_tok.pop()
+        dropped_chunks += 1
+
+    if total > budget and chunks:            # 3) best chunk alone is still too big: cut it
+        room = max(0, budget - (total - chunk_tok[0]))
+        text = _text(chunks[0])
+        keep = int(len(text) * room / max(chunk_tok[0], 1))
+        chunks[0] = dict(chunks[0], _full_content=text[:keep].rstrip() + " …")
+        total = total - chunk_tok[0] + count_tokens(format_chunk(chunks[0])) + sep
+        CONTEXT_TRIMS.inc(kind="truncated_chunk")
+
+    if dropped_turns:
+        CONTEXT_TRIMS.inc(dropped_turns, kind="history_turn")
+    if dropped_chunks:
+        CONTEXT_TRIMS.inc(dropped_chunks, kind="chunk")
+    PROMPT_TOKENS.observe(total)
+    return PackedContext(chunks, "\n".join(turns), total, dropped_turns, dropped_chunks)
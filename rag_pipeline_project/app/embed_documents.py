@@ -1,79 +1,80 @@
 """
-Embeds all PDFs under documents/sources/ into a Chroma DB.
-
-• Uses Ollama embedding model "bge-m3"
-• Writes to embeddings/chromadb/
-• Skips work if the DB already exists
+Embeds all PDFs under documents/sources/ into the vector store (Chroma by default,
+see RAG_VECTOR_BACKEND).
+
+• Same code path as RAGPipeline (app/ingest.py): identical chunking, metadata
+  and collection settings ("hnsw:space": "cosine", source = filename)
+• Incremental: only new/changed PDFs are embedded, removed ones are deleted
+• Resumable: an interrupted run continues from the last finished document /
+  embedding batch instead of starting over
+• Prints throughput and per-stage timings (parse, split, embed, write)
+
+Usage (from rag_pipeline_project/):
+    python -m app.embed_documents                 # sync index with documents/sources
+    python -m app.embed_documents --rebuild       # wipe and re-embed everything
+    python -m app.embed_documents --batch-size 64 --concurrency 8 --workers 4
 """
 
-import os
-from pathlib import Path
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_community.vectorstores import Chroma
-# If you installed langchain-ollama ≥0.3
-# from langchain_ollama import OllamaEmbeddings
-# else (community back-compat)
-#from langchain_community.embeddings import OllamaEmbeddings
-from langchain_ollama import OllamaEmbeddings
-
-# ── Config ──────────────────────────────────────────────────────────
-DOCUMENTS_PATH = Path("documents/sources")
-PERSIST_DIR    = Path("embeddings/chromadb")
-COLLECTION_NAME = "de_politics"
-EMBED_MODEL    = "bge-m3"  # Ollama embedding model
-CHUNK_SIZE     = 800
-CHUNK_OVERLAP  = 120
-OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://host.docker.internal:11434")
+import argparse
+import time
+
+from .ingest import EMBED_BATCH_SIZE, EMBED_CONCURRENCY
+from .pdf_loader import PARSE_WORKERS
+from .rag_pipeline import (
+    RAGPipeline,
+    DEFAULT_SOURCE_DIR,
+    DEFAULT_PERSIST_DIR,
+    DEFAULT_COLLECTION_NAME,
+    DEFAULT_EMBED_MODEL,
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_CHUNK_OVERLAP,
+)
+from .utils import _abs
+
+# ── Config (kept for scripts that import these names) ──────────────
+DOCUMENTS_PATH  = _abs(DEFAULT_SOURCE_DIR)
+PERSIST_DIR     = _abs(DEFAULT_PERSIST_DIR)
+COLLECTION_NAME = DEFAULT_COLLECTION_NAME
+EMBED_MODEL     = DEFAULT_EMBED_MODEL
+CHUNK_SIZE      = DEFAULT_CHUNK_SIZE
+CHUNK_OVERLAP   = DEFAULT_CHUNK_OVERLAP
 # ────────────────────────────────────────────────────────────────────
 
 
-def chroma_exists() -> bool:
-    """True if a Chroma index already lives at PERSIST_DIR."""
-    return PERSIST_DIR.exists() and any(PERSIST_DIR.iterdir())
-
-
-def load_documents(folder: Path):
-    docs = []
-    for pdf in folder.glob("*.pdf"):
-        docs.extend(PyPDFLoader(str(pdf)).load())
-    return docs
-
-
-def split_documents(docs):
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Sync the Chroma index with the source PDFs.")
+    ap.add_argument("--source-dir", default=DEFAULT_SOURCE_DIR)
+    ap.add_argument("--persist-dir", default=DEFAULT_PERSIST_DIR)
+    ap.add_argument("--collection", default=DEFAULT_COLLECTION_NAME)
+    ap.add_argument("--embed-model", default=DEFAULT_EMBED_MODEL)
+    ap.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    ap.add_argument("--chunk-overlap", type=int, default=DEFAULT_CHUNK_OVERLAP)
+    ap.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE, help="chunks per embedding request")
+    ap.add_argument("--concurrency", type=int, default=EMBED_CONCURRENCY, help="embedding requests in flight")
+    ap.add_argument("--workers", type=int, default=PARSE_WORKERS, help="PDF parser processes")
+    ap.add_argument("--rebuild", action="store_true", help="ignore manifest/checkpoints and re-embed everything")
+    args = ap.parse_args(argv)
+
+    pipeline = RAGPipeline(
+        source_dir=args.source_dir,
+        persist_dir=args.persist_dir,
+        collection_name=args.collection,
+        embed_model=args.embed_model,
+        chunk_size=args.chunk_size,
+        chunk_overlap=args.chunk_overlap,
     )
-    return splitter.split_documents(docs)
-
 
-def build_index(chunks):
-    PERSIST_DIR.mkdir(parents=True, exist_ok=True)
-    embedder = OllamaEmbeddings(model=EMBED_MODEL, base_url=OLLAMA_BASE_URL)
-    vectordb = Chroma.from_documents(
-        documents=chunks,
-        embedding=embedder,
-        persist_directory=str(PERSIST_DIR),
-        collection_name=COLLECTION_NAME,
+    t0 = time.perf_counter()
+    manifest = pipeline.ingest(
+        force_rebuild=args.rebuild,
+        parse_workers=args.workers,
+        batch_size=args.batch_size,
+        concurrency=args.concurrency,
     )
-    vectordb.persist()
-    print(f"Stored {len(chunks)} chunks in {PERSIST_DIR}")
+    n_chunks = sum(f.get("chunks", 0) for f in manifest["files"].values())
+    print(f"Stored {n_chunks} chunks from {len(manifest['files'])} files in {_abs(args.persist_dir)} "
+          f"(index {pipeline.index_version}, {time.perf_counter() - t0:.1f}s)")
 
 
 if __name__ == "__main__":
-    if chroma_exists():
-        print(f"Vector store already present at {PERSIST_DIR} — nothing to do.")
-    else:
-        print("Loading PDFs…")
-        raw_docs = load_documents(DOCUMENTS_PATH)
-        
-        # Normalize source to just filename
-        for doc in raw_docs:
-            doc.metadata["source"] = Path(doc.metadata.get("source", "")).name
-
-        print("Splitting into chunks…")
-        chunks = split_documents(raw_docs)
-
-        print("Embedding + saving to Chroma…")
-        build_index(chunks)
-
+    main()
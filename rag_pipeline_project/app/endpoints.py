@@ -1,34 +1,68 @@
 # app/endpoints.py
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse, FileResponse
+from pydantic import BaseModel, Field
 from typing import List, Dict, Optional
-import os, json, redis
+import json, time
 
-from .rag_pipeline import run_rag_pipeline, MEMORY_EXCHANGES
-from .utils import load_system_prompt
+from .rag_pipeline import (
+    arun_rag_pipeline, run_rag_pipeline_stream, MEMORY_EXCHANGES, _GLOBAL_PIPELINE, RAGPipeline,
+    BATCH_MAX_QUERIES, BATCH_CONCURRENCY, MAX_FETCH_K,
+)
+from .mi_graph import get_mi_graph
+from .concurrency import LIMITER, QueueFull, run_in_pool
+from .metrics import timed, trace, track_request, add_collector, render as render_metrics
+from .lifecycle import READINESS
+from .sessions import build_session_store
+from .ollama_http import OllamaUnavailable, BREAKER
+from .page_render import PageRenderer, PageNotFound, PAGE_DPI, PAGE_MAX_AGE, PAGE_REQUESTS, etag_matches
+from .utils import load_system_prompt, _abs
 
 router = APIRouter()
 
 # ──────────────────────────────────────────────────────────────
-# Redis client (set REDIS_URL in .env or environment)
+# Session history (SESSION_STORE=redis|memory, REDIS_URL in .env or environment)
 # e.g., REDIS_URL=redis://localhost:6379/0
 # ──────────────────────────────────────────────────────────────
-REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
-r = redis.from_url(REDIS_URL)
+SESSIONS = build_session_store()
 
-def _hist_key(session_id: str) -> str:
-    return f"hist:{session_id}"
+async def aclose_redis() -> None:
+    await SESSIONS.aclose()
 
-def get_history(session_id: str) -> List[Dict[str, str]]:
-    raw = r.get(_hist_key(session_id))
-    return json.loads(raw) if raw else []
+def _stored(turns: List[Dict]) -> List[Dict]:
+    # "dropped" is derived from the stored context length, never stored per turn
+    return [{k: v for k, v in t.items() if k != "dropped"} for t in turns]
 
-def set_history(session_id: str, history: List[Dict[str, str]]) -> None:
-    # keep for 24h; adjust if you want
-    r.setex(_hist_key(session_id), 60 * 60 * 24, json.dumps(history, ensure_ascii=False))
+def _context_len(history: List[Dict]) -> Optional[int]:
+    n = len(chat_turns(history))
+    return n if n < len(history) else None
+
+@timed("history_load")
+def get_history(session_id: str) -> List[Dict]:
+    return SESSIONS.load(session_id)
+
+@timed("history_write")
+def set_history(session_id: str, history: List[Dict]) -> None:
+    """Overwrite the whole history (the request path only appends, see asave_turn)."""
+    SESSIONS.append(session_id, _stored(history), active=_context_len(history),
+                    max_items=MEMORY_EXCHANGES * 2, replace=True)
 
 def clear_history(session_id: str) -> None:
-    r.delete(_hist_key(session_id))
+    SESSIONS.clear(session_id)
+
+# async twins for the request path (never block the event loop on Redis)
+@timed("history_load")
+async def aget_history(session_id: str) -> List[Dict]:
+    return await SESSIONS.aload(session_id)
+
+@timed("history_write")
+async def asave_turn(session_id: str, history: List[Dict]) -> None:
+    """Persist the exchange append_turn() just added: one round trip, whatever the history length."""
+    await SESSIONS.aappend(session_id, _stored(history[-2:]), active=_context_len(history),
+                           max_items=MEMORY_EXCHANGES * 2)
+
+async def aclear_history(session_id: str) -> None:
+    await SESSIONS.aclear(session_id)
 
 # ──────────────────────────────────────────────────────────────
 # Pydantic models
@@ -36,6 +70,10 @@ def clear_history(session_id: str) -> None:
 class QueryRequest(BaseModel):
     session_id: str
     query: str
+    timings: bool = False   # return a per-stage breakdown (ms) with the answer
+    # MMR overrides for this request (default: RAG_MMR_LAMBDA / RAG_FETCH_K); /mi/generate ignores them
+    lambda_mult: Optional[float] = Field(None, ge=0.0, le=1.0)
+    fetch_k: Optional[int] = Field(None, ge=1, le=MAX_FETCH_K)
 
 class ChunkDetail(BaseModel):
     chunk_id: int
@@ -48,64 +86,316 @@ class RAGResponse(BaseModel):
     response: str
     chunks: List[ChunkDetail]
     history: List[Dict[str, str]]
+    timings: Optional[Dict[str, float]] = None
+
+class MIResponse(RAGResponse):
+    stance: str
+    stance_confidence: Optional[float] = None
 
 class SessionResetRequest(BaseModel):
     session_id: str
 
+class BatchRequest(BaseModel):
+    queries: List[str]
+    concurrency: Optional[int] = None   # generations in flight, at most RAG_BATCH_CONCURRENCY
+    lambda_mult: Optional[float] = Field(None, ge=0.0, le=1.0)
+    fetch_k: Optional[int] = Field(None, ge=1, le=MAX_FETCH_K)
+
 SYSTEM_PROMPT = load_system_prompt()
 
+# rendered source pages for the UI's Quellen viewer (disk cache, see page_render.py)
+PAGES = PageRenderer(_abs(_GLOBAL_PIPELINE.source_dir))
+
 def format_history(turns: List[Dict[str, str]]) -> str:
     return "\n".join(f"{t['role'].capitalize()}: {t['text']}" for t in turns)
 
+def history_lines(turns: List[Dict[str, str]]) -> List[str]:
+    # one entry per turn (MI graph prompt format)
+    return [f"{t['role'].capitalize()}: {t['text']}" for t in turns]
+
+def chat_turns(history: List[Dict]) -> List[Dict]:
+    # turns still in the model's context (chat mode drops old ones for good, see append_turn)
+    return [t for t in history if not t.get("dropped")]
+
+def public_history(history: List[Dict]) -> List[Dict[str, str]]:
+    return [{"role": t["role"], "text": t["text"]} for t in history]
+
+def append_turn(history: List[Dict], query: str, answer: str,
+                rag_result: Optional[Dict] = None) -> List[Dict]:
+    """
+    Append one exchange and trim to the last N exchanges.
+    In chat mode rag_result carries "history_kept" (earlier turns the budget
+    left in the prompt; the rest are marked dropped so later turns don't
+    bring them back and break the prefix Ollama has cached). Turns are
+    stored as text only, without the context they were answered from.
+    """
+    rag_result = rag_result or {}
+    kept = rag_result.get("history_kept")
+    if kept is not None:
+        active = chat_turns(history)
+        for t in active[:len(active) - kept]:
+            t["dropped"] = True
+    history.append({"role": "user", "text": query})
+    history.append({"role": "assistant", "text": answer})
+    max_items = MEMORY_EXCHANGES * 2
+    return history[-max_items:]
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
 # ──────────────────────────────────────────────────────────────
 # POST /generate   ► main chat endpoint (unchanged contract)
 # ──────────────────────────────────────────────────────────────
 @router.post("/generate", response_model=RAGResponse)
 async def generate_answer(request: QueryRequest):
     try:
-        # 1) Load history from Redis
-        history = get_history(request.session_id)
-
-        # 2) Run RAG (returns {"response": str, "chunks": [...]})
-        rag_result = run_rag_pipeline(
-            user_query         = request.query,
-            force_rebuild      = False,
-            history_prompt_str = format_history(history),
-            system_prompt_str  = SYSTEM_PROMPT,
-        )
+        with track_request("generate"), trace() as timings:
+            async with LIMITER.slot():
+                # 1) Load history from Redis
+                history = await aget_history(request.session_id)
+
+                # 2) Run RAG (returns {"response": str, "chunks": [...]})
+                rag_result = await arun_rag_pipeline(
+                    user_query         = request.query,
+                    force_rebuild      = False,
+                    history_prompt_str = format_history(history),
+                    history_turns      = chat_turns(history),
+                    system_prompt_str  = SYSTEM_PROMPT,
+                    lambda_mult        = request.lambda_mult,
+                    fetch_k            = request.fetch_k,
+                )
+
+                rag_answer = rag_result["response"]
+                retrieved_chunks = rag_result["chunks"]
+                PAGES.prerender(retrieved_chunks)
+
+                # 3) Update & trim history (keep last N exchanges)
+                history = append_turn(history, request.query, rag_answer, rag_result)
+                await asave_turn(request.session_id, history)
+
+        return RAGResponse(response=rag_answer, chunks=retrieved_chunks, history=public_history(history),
+                           timings=timings if request.timings else None)
+
+    except QueueFull as e:
+        raise HTTPException(status_code=503, detail=f"Server busy: {e}")
+    except OllamaUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# ──────────────────────────────────────────────────────────────
+# POST /generate/stream   ► same contract, delivered as Server-Sent Events
+#   event: chunks  → {"chunks": [...]}            (right after retrieval)
+#   event: token   → {"text": "..."}              (repeated)
+#   event: done    → {"response": "...", "history": [...]}  (+ "timings" if requested)
+#   event: error   → {"detail": "..."}
+# ──────────────────────────────────────────────────────────────
+@router.post("/generate/stream")
+async def generate_answer_stream(request: QueryRequest):
+    async def events():
+        t0 = time.perf_counter()
+        try:
+            with track_request("generate_stream"), trace() as timings:
+                async with LIMITER.slot():
+                    history = await aget_history(request.session_id)
+                    stream = run_rag_pipeline_stream(
+                        user_query         = request.query,
+                        force_rebuild      = False,
+                        history_prompt_str = format_history(history),
+                        history_turns      = chat_turns(history),
+                        system_prompt_str  = SYSTEM_PROMPT,
+                        lambda_mult        = request.lambda_mult,
+                        fetch_k            = request.fetch_k,
+                    )
+                    # each step blocks on Chroma/Ollama, so pull it on the worker pool
+                    while (ev := await run_in_pool(next, stream, None)) is not None:
+                        if ev["type"] == "chunks":
+                            PAGES.prerender(ev["chunks"])   # renders while the answer streams
+                            yield _sse("chunks", {"chunks": ev["chunks"]})
+                        elif ev["type"] == "token":
+                            yield _sse("token", {"text": ev["text"]})
+                        elif ev["type"] == "done":
+                            history = append_turn(history, request.query, ev["response"], ev)
+                            await asave_turn(request.session_id, history)
+                            done = {"response": ev["response"], "history": public_history(history)}
+                            if request.timings:
+                                done["timings"] = dict(timings, total=round((time.perf_counter() - t0) * 1000, 3))
+                            yield _sse("done", done)
+        except Exception as e:
+            yield _sse("error", {"detail": str(e)})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
-        rag_answer = rag_result["response"]
-        retrieved_chunks = rag_result["chunks"]
+# ──────────────────────────────────────────────────────────────
+# POST /generate/batch   ► many independent questions (no session/history),
+#   e.g. a list of claims to check against the programmes. Newline-delimited
+#   JSON, one line per item as soon as it is answered (any order):
+#     {"index": 3, "query": "...", "response": "...", "chunks": [...]}
+#     {"index": 5, "query": "...", "error": "..."}
+#   and a last line {"done": true, "items": n, "errors": m, "elapsed_s": ...}.
+#   All queries are embedded in one Ollama call and retrieved with one Chroma
+#   query; the batch holds one limiter slot and runs up to `concurrency`
+#   generations.
+# ──────────────────────────────────────────────────────────────
+@router.post("/generate/batch")
+async def generate_batch(request: BatchRequest):
+    if not request.queries:
+        raise HTTPException(status_code=422, detail="queries must not be empty")
+    if len(request.queries) > BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=413, detail=f"at most {BATCH_MAX_QUERIES} queries per batch")
+    concurrency = max(1, min(request.concurrency or BATCH_CONCURRENCY, BATCH_CONCURRENCY))
+
+    async def lines():
+        t0 = time.perf_counter()
+        n = errors = 0
+        try:
+            with track_request("generate_batch"):
+                async with LIMITER.slot():
+                    async for item in _GLOBAL_PIPELINE.agenerate_batch(
+                        request.queries, system_prompt_str=SYSTEM_PROMPT, concurrency=concurrency,
+                        lambda_mult=request.lambda_mult, fetch_k=request.fetch_k,
+                    ):
+                        n += 1
+                        errors += "error" in item
+                        yield json.dumps(item, ensure_ascii=False) + "\n"
+        except Exception as e:
+            yield json.dumps({"error": str(e)}, ensure_ascii=False) + "\n"
+            return
+        yield json.dumps({"done": True, "items": n, "errors": errors,
+                          "elapsed_s": round(time.perf_counter() - t0, 3)}) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
-        # 3) Update & trim history (keep last N exchanges)
-        history.append({"role": "user",      "text": request.query})
-        history.append({"role": "assistant", "text": rag_answer})
-        max_items = MEMORY_EXCHANGES * 2
-        history = history[-max_items:]
-        set_history(request.session_id, history)
+# ──────────────────────────────────────────────────────────────
+# POST /mi/generate   ► Motivational-Interviewing graph (stance → branch prompt),
+#                       same session history, pipeline and Ollama pool as /generate
+# ──────────────────────────────────────────────────────────────
+@router.post("/mi/generate", response_model=MIResponse)
+async def mi_generate_answer(request: QueryRequest):
+    try:
+        with track_request("mi_generate"), trace() as timings:
+            async with LIMITER.slot():
+                history = await aget_history(request.session_id)
 
-        return RAGResponse(response=rag_answer, chunks=retrieved_chunks, history=history)
+                state = await get_mi_graph().ainvoke(request.query, history_lines(history))
+                answer = state.get("response", "")
+                PAGES.prerender(state.get("chunks", []))
 
+                history = append_turn(history, request.query, answer)
+                await asave_turn(request.session_id, history)
+
+        return MIResponse(
+            response=answer,
+            chunks=RAGPipeline._public_chunks(state.get("chunks", [])),
+            history=public_history(history),
+            stance=state.get("user_stance", "neutral"),
+            stance_confidence=state.get("stance_confidence"),
+            timings=timings if request.timings else None,
+        )
+
+    except QueueFull as e:
+        raise HTTPException(status_code=503, detail=f"Server busy: {e}")
+    except OllamaUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# ──────────────────────────────────────────────────────────────
+# GET /pages/{source}/{page}?dpi=150   ► cited PDF page as an image, rendered
+#   once and served from the disk cache afterwards. ETag = (file hash, page,
+#   dpi); If-None-Match → 304. 404 for unknown files/pages, 422 for bad dpi.
+# ──────────────────────────────────────────────────────────────
+@router.get("/pages/{source}/{page}")
+async def page_image(source: str, page: int, request: Request, dpi: int = PAGE_DPI):
+    try:
+        ref = await PAGES.aget(source, page, dpi)
+    except PageNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    headers = {"ETag": ref.etag, "Cache-Control": f"public, max-age={PAGE_MAX_AGE}"}
+    if etag_matches(request.headers.get("if-none-match", ""), ref.etag):
+        PAGE_REQUESTS.inc(result="not_modified")
+        return Response(status_code=304, headers=headers)
+    try:
+        path = await PAGES.arender(ref)
+    except PageNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:   # poppler missing / broken PDF
+        raise HTTPException(status_code=500, detail=f"Page could not be rendered: {e}")
+    return FileResponse(path, media_type=PAGES.media_type, headers=headers)
+
 # ──────────────────────────────────────────────────────────────
 # POST /reset   ► clear chat memory for the tab
 # ──────────────────────────────────────────────────────────────
 @router.post("/reset")
 async def reset_session(req: SessionResetRequest):
-    clear_history(req.session_id)
+    await aclear_history(req.session_id)
     return {"status": "cleared"}
 
 # ──────────────────────────────────────────────────────────────
-# GET /health  ► simple readiness + active session count
+# GET /health  ► simple readiness + active session count + request queue + caches
 # ──────────────────────────────────────────────────────────────
 @router.get("/health")
 async def health_check():
     try:
-        n = 0
-        for _ in r.scan_iter("hist:*", count=200):
-            n += 1
+        n = await SESSIONS.acount()
     except Exception:
         n = -1
-    return {"status": "healthy", "active_sessions": n}
+    return {
+        "status": "healthy",
+        "active_sessions": n,
+        "queue": LIMITER.stats(),
+        "caches": _GLOBAL_PIPELINE.cache_stats(),
+        "ollama": BREAKER.snapshot(),
+    }
+
+# ──────────────────────────────────────────────────────────────
+# GET /ready  ► 200 once warm-up (index, models, canary query) is done and
+#               Redis answers, 503 before that — for load balancers / k8s
+# ──────────────────────────────────────────────────────────────
+@router.get("/ready")
+async def readiness_check():
+    body = READINESS.snapshot()
+    ok = body["ready"]
+    if ok:
+        try:
+            await SESSIONS.aping()
+            body["redis"] = "ok"
+        except Exception as e:
+            body["redis"] = f"unreachable: {e}"
+            ok = False
+    body["ready"] = ok
+    return JSONResponse(body, status_code=200 if ok else 503)
+
+# ──────────────────────────────────────────────────────────────
+# GET /metrics  ► Prometheus text format: stage/request latency histograms,
+#                 in-flight requests, LLM tokens/s, cache hit rates, queue
+# ──────────────────────────────────────────────────────────────
+def _cache_samples():
+    for cache, st in _GLOBAL_PIPELINE.cache_stats().items():
+        lab = {"cache": cache}
+        yield "rag_cache_hits_total", "counter", "Cache hits", lab, st["hits"]
+        yield "rag_cache_misses_total", "counter", "Cache misses", lab, st["misses"]
+        yield "rag_cache_hit_ratio", "gauge", "Cache hit rate since start", lab, st["hit_rate"]
+        yield "rag_cache_entries", "gauge", "Entries currently cached", lab, st["entries"]
+
+def _queue_samples():
+    st = LIMITER.stats()
+    yield "rag_limiter_in_flight", "gauge", "RAG requests holding a concurrency slot", {}, st["in_flight"]
+    yield "rag_limiter_queued", "gauge", "RAG requests waiting for a slot", {}, st["queued"]
+    yield "rag_limiter_rejected_total", "counter", "Requests rejected with 503 (queue full)", {}, st["rejected"]
+    yield "rag_limiter_avg_wait_seconds", "gauge", "Average wait for a slot", {}, st["avg_wait_s"]
+
+add_collector(_cache_samples)
+add_collector(_queue_samples)
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,426 @@
+# app/ingest.py
+"""
+Incremental ingestion into the vector store (Chroma or the mmap backend,
+see vector_store.py).
+
+A manifest (embeddings/chromadb/manifest.json) records, per PDF, the SHA-256
+of its content and how many chunks it produced, together with the config the
+index was built with (chunk_size, chunk_overlap, embed_model, collection).
+
+On every sync:
+  • config differs from the manifest  → wipe the collection, rebuild everything
+  • file is new or its hash changed   → (re)embed only that file
+  • file disappeared from sources     → delete its chunks
+  • everything else                   → untouched
+
+New/changed files go through a streaming pipeline: PDFs are parsed in a
+process pool (low-text pages fall back to pdfplumber / OCR, see
+pdf_loader.py), split as they arrive, embedded in batches of EMBED_BATCH_SIZE
+with up to EMBED_CONCURRENCY requests in flight to Ollama, and upserted into
+the store as each batch completes.
+
+The extracted page text of every file version is kept in
+<persist_dir>/page_text/, so a rebuild for a new chunk_size/chunk_overlap
+(or embed model) re-splits cached text instead of parsing or OCRing again.
+
+Progress is checkpointed at two levels so an interrupted cold build resumes
+instead of starting over:
+  • per document — the manifest is rewritten as soon as a file is complete
+  • per batch    — ingest_checkpoint.json records which embedding batches of
+                   a half-finished file are already in Chroma; on resume those
+                   batches are skipped (same file hash + config + batch size).
+                   Only for stores whose upserts are durable on their own
+                   (durable_upserts). The mmap store publishes on flush(),
+                   which rewrites the whole index, so for it the manifest
+                   is committed every FLUSH_INTERVAL_S and at the end of a
+                   sync instead of per document.
+
+Syncing holds an exclusive file lock (<persist_dir>/index.lock, see
+index_lock). Every uvicorn worker syncs at startup; the first one does
+the work, the others wait and then find the index up to date.
+"""
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Tuple
+
+from .pdf_loader import PAGE_TEXT_DIR, PARSE_WORKERS, iter_pdfs_parallel, prune_page_text
+
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
+
+MANIFEST_NAME = "manifest.json"
+CHECKPOINT_NAME = "ingest_checkpoint.json"
+LOCK_NAME = "index.lock"
+MANIFEST_VERSION = 2   # 2: chunk ids include the file name (one rebuild on upgrade)
+_DELETE_BATCH = 5000
+
+EMBED_BATCH_SIZE  = int(os.getenv("INGEST_EMBED_BATCH", "32"))      # chunks per Ollama call
+EMBED_CONCURRENCY = int(os.getenv("INGEST_EMBED_CONCURRENCY", "4"))  # batches in flight
+FLUSH_INTERVAL_S  = float(os.getenv("INGEST_FLUSH_S", "30"))         # non-durable stores: publish at most this often
+
+
+# ---------------- manifest ----------------------
+def file_sha256(path: Path, _bufsize: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(_bufsize):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def load_manifest(persist_dir: Path) -> Optional[Dict]:
+    p = Path(persist_dir) / MANIFEST_NAME
+    try:
+        return json.loads(p.read_text(encoding="utf-8"))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def save_manifest(persist_dir: Path, manifest: Dict) -> None:
+    _write_json(Path(persist_dir) / MANIFEST_NAME, manifest)
+
+
+def _write_json(p: Path, data: Dict) -> None:
+    p.parent.mkdir(parents=True, exist_ok=True)
+    tmp = p.with_suffix(".tmp")
+    tmp.write_text(json.dumps(data, indent=2, ensure_ascii=False), encoding="utf-8")
+    tmp.replace(p)  # atomic: a crash never leaves a half-written file
+
+
+class Checkpoint:
+    """Per-batch progress of files that are not finished yet."""
+
+    def __init__(self, persist_dir: Path, config: Dict):
+        self.path = Path(persist_dir) / CHECKPOINT_NAME
+        self.config = config
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+        except (FileNotFoundError, json.JSONDecodeError):
+            data = {}
+        self.files: Dict[str, Dict] = data.get("files", {}) if data.get("config") == config else {}
+
+    def done_offsets(self, name: str, sha256: str, batch_size: int) -> set:
+        entry = self.files.get(name)
+        if entry and entry["sha256"] == sha256 and entry["batch_size"] == batch_size:
+            return set(entry["done"])
+        return set()
+
+    def mark(self, name: str, sha256: str, batch_size: int, offset: int) -> None:
+        entry = self.files.get(name)
+        if not entry or entry["sha256"] != sha256 or entry["batch_size"] != batch_size:
+            entry = self.files[name] = {"sha256": sha256, "batch_size": batch_size, "done": []}
+        entry["done"].append(offset)
+        self.save()
+
+    def finish(self, name: str) -> None:
+        if self.files.pop(name, None) is not None:
+            self.save() if self.files else self.clear()
+
+    def save(self) -> None:
+        _write_json(self.path, {"config": self.config, "files": self.files})
+
+    def clear(self) -> None:
+        self.files = {}
+        self.path.unlink(missing_ok=True)
+
+
+def index_version(manifest: Optional[Dict]) -> str:
+    """Short, stable fingerprint of config + file hashes (changes on every re-index)."""
+    if not manifest:
+        return "empty"
+    key = json.dumps(
+        {"version": manifest.get("version"), "config": manifest.get("config"),
+         "files": {n: f["sha256"] for n, f in sorted(manifest.get("files", {}).items())}},
+        sort_keys=True,
+    )
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:12]
+
+
+def _hash_sources(source_dir: Path, previous: Dict) -> Dict[str, Dict]:
+    """name → {sha256, size, mtime}; reuses the old hash when size+mtime match."""
+    out = {}
+    for pdf in sorted(Path(source_dir).glob("*.pdf")):
+        st = pdf.stat()
+        old = previous.get(pdf.name)
+        if old and old.get("size") == st.st_size and old.get("mtime") == st.st_mtime:
+            sha = old["sha256"]
+        else:
+            sha = file_sha256(pdf)
+        out[pdf.name] = {"sha256": sha, "size": st.st_size, "mtime": st.st_mtime}
+    return out
+
+
+# ---------------- chunks ------------------------
+def chunk_ids(name: str, sha256: str, n: int) -> List[str]:
+    # deterministic ids: same file version → same ids (makes re-adds idempotent).
+    # The name is part of it: two byte-identical PDFs under different names
+    # must not overwrite each other's chunks (and "source")
+    prefix = hashlib.sha1(f"{name}\0{sha256}".encode("utf-8")).hexdigest()[:16]
+    return [f"{prefix}-{i:05d}" for i in range(n)]
+
+
+def split_pages(pages: List["Document"], name: str, splitter, sha256: str) -> List["Document"]:
+    for p in pages:
+        # store the bare filename; absolute paths differ between host and Docker
+        p.metadata["source"] = name
+        p.metadata["file_sha256"] = sha256
+    return splitter.split_documents(pages)
+
+
+def _clean_meta(meta: Dict) -> Dict:
+    # Chroma only stores str/int/float/bool values
+    return {k: v for k, v in meta.items() if isinstance(v, (str, int, float, bool))}
+
+
+class IngestProgress:
+    """Running totals, throughput and per-stage time, printed at most every `every` seconds."""
+
+    STAGES = ("parse", "split", "embed", "write")
+
+    def __init__(self, total_files: int, every: float = 2.0):
+        self.total_files = total_files
+        self.files = self.pages = self.chunks = self.skipped_chunks = 0
+        self.stage_s = {k: 0.0 for k in self.STAGES}  # summed over workers, not wall time
+        self.t0 = time.perf_counter()
+        self.every = every
+        self._last = 0.0
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.t0
+
+    def summary(self) -> str:
+        dt = max(self.elapsed(), 1e-9)
+        return (f"{self.files}/{self.total_files} files | {self.pages} pages ({self.pages / dt:.1f}/s) | "
+                f"{self.chunks} chunks ({self.chunks / dt:.1f}/s) | {dt:.1f}s")
+
+    def stage_summary(self) -> str:
+        parts = [f"{k} {v:.1f}s" for k, v in self.stage_s.items()]
+        if self.skipped_chunks:
+            parts.append(f"resumed {self.skipped_chunks} chunks from checkpoint")
+        return " | ".join(parts)
+
+    def report(self, force: bool = False) -> None:
+        now = self.elapsed()
+        if force or now - self._last >= self.every:
+            self._last = now
+            print(f"[ingest] {self.summary()}")
+
+
+def _timed_embed(embedder, texts: List[str]) -> Tuple[List[List[float]], float]:
+    t0 = time.perf_counter()
+    return embedder.embed_documents(texts), time.perf_counter() - t0
+
+
+def ingest_files(
+    files: List[Tuple[Path, str]],
+    *,
+    collection,
+    embedder,
+    splitter,
+    parse_workers: int = PARSE_WORKERS,
+    batch_size: int = EMBED_BATCH_SIZE,
+    concurrency: int = EMBED_CONCURRENCY,
+    progress: Optional[IngestProgress] = None,
+    checkpoint: Optional[Checkpoint] = None,
+    page_cache_dir: Optional[Path] = None,
+) -> Iterator[Tuple[str, int]]:
+    """
+    Parse → split → embed → write, overlapped. `files` is [(path, sha256)].
+    Yields (filename, n_chunks) once *all* chunks of a file are in the store.
+    Batches already recorded in `checkpoint` are not embedded again; page
+    text found in `page_cache_dir` is not extracted again.
+    """
+    progress = progress or IngestProgress(len(files))
+    sha_of = {Path(p).name: sha for p, sha in files}
+    outstanding: Dict[str, int] = {}   # filename → batches not yet written
+    n_chunks: Dict[str, int] = {}
+    pending: Dict = {}                 # embed future → (filename, offset, ids, texts, metas)
+
+    def finish(name: str) -> Tuple[str, int]:
+        progress.files += 1
+        if checkpoint is not None:
+            checkpoint.finish(name)
+        return name, n_chunks[name]
+
+    def drain(block_until_below: int) -> Iterator[Tuple[str, int]]:
+        while pending and len(pending) >= block_until_below:
+            done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+            for fut in done:
+                name, offset, ids, texts, metas = pending.pop(fut)
+                embeddings, embed_s = fut.result()
+                t0 = time.perf_counter()
+                collection.upsert(ids=ids, embeddings=embeddings, documents=texts, metadatas=metas)
+                progress.stage_s["write"] += time.perf_counter() - t0
+                progress.stage_s["embed"] += embed_s
+                progress.chunks += len(ids)
+                if checkpoint is not None:
+                    checkpoint.mark(name, sha_of[name], batch_size, offset)
+                outstanding[name] -= 1
+                if outstanding[name] == 0:
+                    yield finish(name)
+            progress.report()
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="embed") as embed_pool:
+        for path, pages, parse_s in iter_pdfs_parallel([p for p, _ in files], workers=parse_workers,
+                                                       cache_dir=page_cache_dir,
+                                                       sha256s=[sha for _, sha in files]):
+            name = path.name
+            sha = sha_of[name]
+            progress.stage_s["parse"] += parse_s
+
+            t0 = time.perf_counter()
+            docs = split_pages(pages, name, splitter, sha)
+            progress.stage_s["split"] += time.perf_counter() - t0
+            progress.pages += len(pages)
+
+            ids = chunk_ids(name, sha, len(docs))
+            n_chunks[name] = len(docs)
+            skip = checkpoint.done_offsets(name, sha, batch_size) if checkpoint is not None else set()
+            todo = [i for i in range(0, len(docs), batch_size) if i not in skip]
+            progress.skipped_chunks += sum(len(docs[i:i + batch_size]) for i in skip)
+            outstanding[name] = len(todo)
+            if not todo:
+                yield finish(name)
+                continue
+
+            for i in todo:
+                # backpressure: never more than `concurrency` batches in flight
+                yield from drain(concurrency)
+                batch = docs[i:i + batch_size]
+                texts = [d.page_content for d in batch]
+                fut = embed_pool.submit(_timed_embed, embedder, texts)
+                pending[fut] = (name, i, ids[i:i + batch_size], texts, [_clean_meta(d.metadata) for d in batch])
+
+        yield from drain(1)
+    progress.report(force=True)
+    print(f"[ingest] stage time: {progress.stage_summary()}")
+
+
+def _wipe(collection) -> None:
+    ids = collection.get(include=[])["ids"]
+    for i in range(0, len(ids), _DELETE_BATCH):
+        collection.delete(ids=ids[i:i + _DELETE_BATCH])
+
+
+# ---------------- sync --------------------------
+@contextmanager
+def index_lock(persist_dir: Path) -> Iterator[None]:
+    """
+    Exclusive cross-process lock on the index directory, held while syncing.
+    flock is released by the OS if the holder dies. Without fcntl (Windows)
+    there is no lock: run one process there.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    path = Path(persist_dir)
+    path.mkdir(parents=True, exist_ok=True)
+    with open(path / LOCK_NAME, "a") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            print("Index is being synced by another process — waiting")
+            t0 = time.perf_counter()
+            fcntl.flock(f, fcntl.LOCK_EX)
+            print(f"Index lock acquired after {time.perf_counter() - t0:.1f}s")
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def sync_index(collection, *, source_dir: Path, persist_dir: Path, config: Dict, splitter,
+               force_rebuild: bool = False, **ingest_opts) -> Dict:
+    """
+    Bring `collection` (a vector_store backend) in line with the PDFs in
+    source_dir. Returns the manifest that now describes the index.
+    `ingest_opts` are passed to ingest_files (parse_workers, batch_size, concurrency).
+    Callers hold index_lock(persist_dir).
+    """
+    manifest = load_manifest(persist_dir)
+    checkpoint = Checkpoint(persist_dir, config)
+
+    last_flush = time.monotonic()
+
+    def commit(force: bool = True) -> None:
+        # writes first, then the manifest that describes them. Non-durable
+        # stores rewrite everything per flush: per document would make a
+        # cold build quadratic, so they publish every FLUSH_INTERVAL_S
+        nonlocal last_flush
+        if not (force or collection.durable_upserts or time.monotonic() - last_flush >= FLUSH_INTERVAL_S):
+            return
+        collection.flush()
+        save_manifest(persist_dir, manifest)
+        last_flush = time.monotonic()
+
+    stale = (
+        force_rebuild
+        or manifest is None
+        or manifest.get("version") != MANIFEST_VERSION
+        or manifest.get("config") != config
+    )
+    if stale:
+        if collection.count():
+            reason = "forced" if force_rebuild else ("no manifest" if manifest is None else "config changed")
+            print(f"Index is stale ({reason}) — rebuilding from scratch")
+            _wipe(collection)
+        checkpoint.clear()
+        manifest = {"version": MANIFEST_VERSION, "config": config, "files": {}}
+
+    known = manifest["files"]
+    current = _hash_sources(source_dir, known)
+
+    removed = [n for n in known if n not in current]
+    changed = [n for n, f in current.items() if n not in known or known[n]["sha256"] != f["sha256"]]
+
+    if not removed and not changed:
+        # refresh size/mtime so the next start skips hashing
+        for n, f in current.items():
+            known[n].update(size=f["size"], mtime=f["mtime"])
+        commit()   # a stale index may just have been wiped
+        checkpoint.clear()
+        print(f"Using cached {collection.name} index ({len(known)} files, up to date)")
+        return manifest
+
+    for name in removed:
+        collection.delete(where={"source": name})
+        known.pop(name)
+        checkpoint.finish(name)
+        commit(force=False)
+        print(f"Removed chunks of {name}")
+
+    batch_size = ingest_opts.get("batch_size", EMBED_BATCH_SIZE)
+    for name in changed:
+        known.pop(name, None)
+        if checkpoint.done_offsets(name, current[name]["sha256"], batch_size):
+            print(f"Resuming {name} from checkpoint")
+        else:
+            # clears the old version, or leftovers of a run we can't resume
+            collection.delete(where={"source": name})
+            checkpoint.finish(name)
+    commit()
+
+    for name, n in ingest_files(
+        [(Path(source_dir) / name, current[name]["sha256"]) for name in changed],
+        collection=collection,
+        embedder=collection.embeddings,
+        splitter=splitter,
+        checkpoint=checkpoint if collection.durable_upserts else None,
+        page_cache_dir=Path(persist_dir) / PAGE_TEXT_DIR,
+        **ingest_opts,
+    ):
+        known[name] = {**current[name], "chunks": n}
+        commit(force=False)   # per-document checkpoint (time-based for non-durable stores)
+        print(f"Indexed {name}: {n} chunks")
+    commit()
+    prune_page_text(Path(persist_dir) / PAGE_TEXT_DIR, [f["sha256"] for f in known.values()])
+
+    print(f"{collection.name} index now holds {collection.count()} chunks from {len(known)} files")
+    return manifest
@@ -0,0 +1,101 @@
+# app/lifecycle.py
+"""
+Startup warm-up + readiness.
+
+Importing the app is cheap (langchain/chromadb load on first use), so the
+server listens right away. The lifespan hook then runs warm_up() in the
+background:
+  1. vector_store — open Chroma, sync check against the manifest, load BM25
+  2. models       — load the chat + embedding models in Ollama (OLLAMA_KEEP_ALIVE)
+  3. canary       — one real retrieve() end to end (embedding → Chroma → MMR)
+  4. mi_graph     — compile the MI graph, embed the stance prototypes
+GET /ready answers 503 until every step passed (GET /health stays a plain
+liveness check). A failed warm-up is retried every RAG_WARMUP_RETRY_S seconds.
+"""
+import asyncio
+import os
+import time
+from typing import Dict, Optional
+
+from .concurrency import run_in_pool
+
+WARMUP_ENABLED  = os.getenv("RAG_WARMUP", "1") != "0"
+WARMUP_RETRY_S  = float(os.getenv("RAG_WARMUP_RETRY_S", "10"))
+CANARY_QUERY    = os.getenv("RAG_CANARY_QUERY", "Was steht im Wahlprogramm zur Rente?")
+
+
+class Readiness:
+    def __init__(self):
+        self.ready = False
+        self.stage = "pending"
+        self.error: Optional[str] = None
+        self.attempts = 0
+        self.timings: Dict[str, float] = {}   # step → seconds (last attempt)
+        self.started = time.time()
+
+    def snapshot(self) -> Dict:
+        return {
+            "ready": self.ready,
+            "stage": self.stage,
+            "error": self.error,
+            "attempts": self.attempts,
+            "warmup_s": self.timings,
+            "uptime_s": round(time.time() - self.started, 1),
+        }
+
+
+READINESS = Readiness()
+
+
+async def _step(name: str, aw):
+    READINESS.stage = name
+    t0 = time.perf_counter()
+    result = await aw
+    READINESS.timings[name] = round(time.perf_counter() - t0, 3)
+    return result
+
+
+async def warm_up(pipeline=None) -> None:
+    from . import ollama_client, rag_pipeline
+    from .mi_graph import get_mi_graph
+
+    pipeline = pipeline or rag_pipeline._GLOBAL_PIPELINE
+    await _step("vector_store", run_in_pool(pipeline._ensure_vs))
+    await _step("models", ollama_client.awarm_up(pipeline.chat_model, pipeline.embed_model))
+    chunks = await _step("canary", run_in_pool(pipeline.retrieve, CANARY_QUERY))
+    if not chunks:
+        print("WARNING: warm-up canary query found no chunks — is the index empty?")
+    graph = await _step("mi_graph", run_in_pool(get_mi_graph))
+    warm = getattr(graph.stance_classifier, "warm_up", None)
+    if warm is not None:
+        await _step("stance", run_in_pool(warm))
+
+
+async def run_warm_up() -> None:
+    """warm_up() until it succeeds; flips READINESS.ready."""
+    while True:
+        READINESS.attempts += 1
+        t0 = time.perf_counter()
+        try:
+            await warm_up()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            READINESS.error = f"{READINESS.stage}: {e}"
+            print(f"Warm-up failed ({READINESS.error}); retrying in {WARMUP_RETRY_S:.0f}s")
+            await asyncio.sleep(WARMUP_RETRY_S)
+            continue
+        READINESS.ready = True
+        READINESS.stage = "done"
+        READINESS.error = None
+        print(f"Warm-up done in {time.perf_counter() - t0:.1f}s: {READINESS.timings}")
+        return
+
+
+def start_warm_up() -> Optional[asyncio.Task]:
+    """Called from the lifespan hook; with RAG_WARMUP=0 the app is ready at once (lazy init)."""
+    if not WARMUP_ENABLED:
+        READINESS.ready = True
+        READINESS.stage = "skipped"
+        return None
+    return asyncio.create_task(run_warm_up())
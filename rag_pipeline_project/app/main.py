@@ -1,10 +1,31 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
-from .endpoints import router
+from .endpoints import router, aclose_redis
+from . import ollama_client
+from .concurrency import WORKER_POOL
+from .lifecycle import start_warm_up
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # index, models, canary query and MI graph warm up in the background;
+    # the server is live at once, GET /ready flips when warm-up is done
+    warmup = start_warm_up()
+    yield
+    # shutdown: stop a warm-up still in progress, release pooled connections and worker threads
+    if warmup is not None:
+        warmup.cancel()
+    await ollama_client.aclose()
+    await aclose_redis()
+    WORKER_POOL.shutdown(wait=False)
+
 
 app = FastAPI(
     title="Misinformation RAG API",
     description="Detect misinformation in German political content using RAG + Ollama",
-    version="1.0.0" #as the project evolves
+    version="1.0.0", #as the project evolves
+    lifespan=lifespan,
 )
 
 app.include_router(router)
@@ -0,0 +1,272 @@
+# app/metrics.py
+"""
+Per-stage latency tracing + Prometheus-style metrics (text format, no extra dependency).
+
+• stage("chroma_query") times a block. The duration is observed into
+  rag_stage_seconds{stage="chroma_query"} and, if a request trace is active,
+  added to that request's timing breakdown (see trace()).
+• Traces live in a contextvar. run_in_pool copies the context, so stages that
+  run on the worker pool still land in the right request.
+• Stages nest: "retrieve" includes "embed_query", "chroma_query", "mmr", ...
+• GET /metrics renders every metric below, plus whatever the registered
+  collectors report (cache hit rates, queue depth).
+"""
+import contextvars
+import functools
+import inspect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# seconds: sub-ms cache hits up to multi-minute generations on a slow box
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+TOKEN_RATE_BUCKETS = (1, 2.5, 5, 10, 20, 30, 50, 75, 100, 200, 500)
+
+_REGISTRY: List["_Metric"] = []
+_COLLECTORS: List[Callable[[], Iterable[Tuple]]] = []
+
+
+def _esc(v) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(pairs) -> str:
+    pairs = list(pairs)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_esc(v)}"' for k, v in pairs) + "}"
+
+
+def _num(v) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self._lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def _key(self, labels: Dict) -> tuple:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def samples(self) -> List[Tuple[str, list, float]]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, n: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + n
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name, list(zip(self.labelnames, k)), v) for k, v in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, n: float = 1.0, **labels) -> None:
+        self.inc(-n, **labels)
+
+    def set(self, v: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = v
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        self._values: Dict[tuple, list] = {}   # key → [per-bucket counts..., sum, count]
+
+    def observe(self, v: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, b in enumerate(self.buckets):
+                if v <= b:
+                    row[i] += 1
+                    break
+            row[-2] += v
+            row[-1] += 1
+
+    def samples(self):
+        out = []
+        with self._lock:
+            items = [(k, list(r)) for k, r in self._values.items()]
+        for key, row in items:
+            base = list(zip(self.labelnames, key))
+            acc = 0
+            for b, n in zip(self.buckets, row):
+                acc += n
+                out.append((self.name + "_bucket", base + [("le", _num(float(b)))], acc))
+            out.append((self.name + "_bucket", base + [("le", "+Inf")], row[-1]))
+            out.append((self.name + "_sum", base, round(row[-2], 6)))
+            out.append((self.name + "_count", base, row[-1]))
+        return out
+
+
+# ─── metrics ─────────────────────────────────────────────────
+STAGE_SECONDS   = Histogram("rag_stage_seconds", "Latency of one pipeline stage", ("stage",))
+REQUEST_SECONDS = Histogram("rag_request_seconds", "End-to-end request latency", ("endpoint",))
+REQUESTS        = Counter("rag_requests_total", "Requests by endpoint and outcome", ("endpoint", "status"))
+IN_FLIGHT       = Gauge("rag_requests_in_flight", "Requests currently being served", ("endpoint",))
+LLM_TOKENS      = Counter("rag_llm_tokens_total", "Tokens processed by Ollama", ("model", "kind"))
+LLM_TOKENS_PER_S = Histogram("rag_llm_tokens_per_second", "Ollama generation speed",
+                             ("model",), buckets=TOKEN_RATE_BUCKETS)
+LLM_CACHE       = Counter("rag_llm_cache_total", "Redis LLM response cache lookups", ("result",))
+
+
+# ─── per-request trace ───────────────────────────────────────
+_TRACE: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar("rag_trace", default=None)
+_trace_lock = threading.Lock()
+
+
+@contextmanager
+def trace():
+    """Collect a {stage: ms} breakdown for everything timed inside the block."""
+    t = {}
+    token = _TRACE.set(t)
+    t0 = time.perf_counter()
+    try:
+        yield t
+    finally:
+        t["total"] = round((time.perf_counter() - t0) * 1000, 3)
+        try:
+            _TRACE.reset(token)
+        except ValueError:
+            pass   # async generator closed from another context (client went away)
+
+
+def current_trace() -> Optional[Dict[str, float]]:
+    return _TRACE.get()
+
+
+def observe_stage(name: str, seconds: float) -> None:
+    STAGE_SECONDS.observe(seconds, stage=name)
+    t = _TRACE.get()
+    if t is not None:
+        with _trace_lock:   # a request's stages can run on several pool threads
+            t[name] = round(t.get(name, 0.0) + seconds * 1000, 3)
+
+
+@contextmanager
+def stage(name: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - t0)
+
+
+def timed(name: str):
+    """Decorator form of stage() for plain and async functions."""
+    def deco(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def awrapper(*args, **kwargs):
+                with stage(name):
+                    return await fn(*args, **kwargs)
+            return awrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+@contextmanager
+def track_request(endpoint: str):
+    """In-flight gauge + latency histogram + outcome counter for one request."""
+    IN_FLIGHT.inc(endpoint=endpoint)
+    t0 = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        IN_FLIGHT.dec(endpoint=endpoint)
+        REQUEST_SECONDS.observe(time.perf_counter() - t0, endpoint=endpoint)
+        REQUESTS.inc(endpoint=endpoint, status=status)
+
+
+def record_llm(model: str, prompt_tokens: int, completion_tokens: int, gen_seconds: float) -> None:
+    """Token counters + tokens/s. gen_seconds: Ollama's eval_duration, or wall time if missing."""
+    if prompt_tokens:
+        LLM_TOKENS.inc(prompt_tokens, model=model, kind="prompt")
+    if completion_tokens:
+        LLM_TOKENS.inc(completion_tokens, model=model, kind="completion")
+        if gen_seconds > 0:
+            LLM_TOKENS_PER_S.observe(completion_tokens / gen_seconds, model=model)
+
+
+def record_llm_response(model: str, data: Dict, wall_seconds: float) -> None:
+    """record_llm() from the final Ollama JSON object (eval_* durations are in ns)."""
+    eval_ns = data.get("eval_duration") or 0
+    record_llm(
+        model,
+        int(data.get("prompt_eval_count") or 0),
+        int(data.get("eval_count") or 0),
+        eval_ns / 1e9 if eval_ns else wall_seconds,
+    )
+
+
+# ─── exposition ──────────────────────────────────────────────
+def add_collector(fn: Callable[[], Iterable[Tuple]]) -> None:
+    """
+    fn() is called on every scrape and yields (name, kind, help, labels_dict, value)
+    — for numbers that already live elsewhere (cache stats, limiter queue).
+    """
+    _COLLECTORS.append(fn)
+
+
+def render() -> str:
+    lines: List[str] = []
+    for m in _REGISTRY:
+        lines.append(f"# HELP {m.name} {m.help}")
+        lines.append(f"# TYPE {m.name} {m.kind}")
+        for name, labels, v in m.samples():
+            lines.append(f"{name}{_labels(labels)} {_num(v)}")
+
+    grouped: Dict[str, Tuple[str, str, list]] = {}
+    for fn in _COLLECTORS:
+        try:
+            for name, kind, help, labels, v in fn():
+                grouped.setdefault(name, (kind, help, []))[2].append((labels, v))
+        except Exception as e:   # a broken collector must not take /metrics down
+            print(f"metrics collector failed: {e}")
+    for name, (kind, help, rows) in grouped.items():
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, v in rows:
+            lines.append(f"{name}{_labels(sorted(labels.items()))} {_num(v)}")
+    return "\n".join(lines) + "\n"
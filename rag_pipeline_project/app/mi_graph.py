@@ -1,31 +1,77 @@
 # app/mi_graph.py
-from typing import TypedDict, Literal, List
-from langgraph.graph import StateGraph, END
-from langchain_community.llms import Ollama
-from app.rag_pipeline import RAGPipeline
+#
+#   START → embed_query ─┬─ analyze_stance ─┬─ build_context ─▶ resistant | curious | ready ─▶ END
+#                        └─ retrieve ───────┘
+#
+# The query is embedded once. Stance classification and retrieval then run
+# in parallel: the same superstep, threads for invoke(), tasks for ainvoke().
+# Both use that embedding. BM25-routed queries get none; the stance
+# classifier embeds those only if its keyword cues can't decide. Retrieval
+# runs exactly once per turn, and the branch nodes only build their prompt
+# and generate.
+#
+# By default the graph runs on the process-wide RAGPipeline (same embedder,
+# Chroma handle and caches as /generate) and talks to Ollama through
+# ollama_client (pooled connections, Redis response cache), so serving
+# /mi/generate costs no second copy of anything.
+import threading
+from typing import TypedDict, Literal, List, Dict, Any, Optional
+from . import rag_pipeline
+from .rag_pipeline import RAGPipeline
+from .ollama_client import ask_ollama, ask_ollama_async
+from .concurrency import run_in_pool
+from .metrics import timed
+from .stance import build_stance_classifier
 
 class ConversationState(TypedDict, total=False):
     query: str
     response: str
     user_stance: Literal["resistant", "curious", "ready", "neutral"]
-    chat_history: List[str]
+    stance_confidence: float
+    chat_history: List[str]    # earlier turns, "User: ..." / "Assistant: ..." lines
+    q_emb: Optional[Any]       # query embedding (None for BM25-routed queries)
+    chunks: List[Dict]         # RAGPipeline.retrieve() output
+    context: str               # chunks formatted for the prompt
 
 class MIConversationGraph:
-    def __init__(self):
-        self.llm = Ollama(model="llama3.1:8b")  # swap to qwen2.5:14b later if you want
-        self.rag = RAGPipeline()
+    def __init__(self, rag: Optional[RAGPipeline] = None, stance_classifier=None, chat_model: Optional[str] = None):
+        self.rag = rag or rag_pipeline._GLOBAL_PIPELINE
+        self.chat_model = chat_model or self.rag.chat_model   # swap to qwen2.5:14b later if you want
+        # anything with .classify(query, q_emb) -> StanceResult; default: keyword + embedding
+        # prototypes on the query embedding retrieve() reuses, llama only when unsure
+        self.stance_classifier = stance_classifier or build_stance_classifier(
+            embed_query=self.rag._embed_query,
+            embed_documents=self.rag._embedder.embed_documents,
+            llm_invoke=self.llm_invoke,
+        )
         self.graph = self._build_graph()
-    
+
+    def llm_invoke(self, prompt: str) -> str:
+        return ask_ollama(prompt, model=self.chat_model)
+
+    async def allm_invoke(self, prompt: str) -> str:
+        return await ask_ollama_async(prompt, model=self.chat_model)
+
     def _build_graph(self):
-        workflow = StateGraph(ConversationState)
-        workflow.add_node("analyze_stance", self.analyze_user_stance)
-        workflow.add_node("resistant_response", self.handle_resistance)
-        workflow.add_node("curious_response", self.provide_information)
-        workflow.add_node("ready_response", self.reinforce_understanding)
+        # imported here: langgraph costs ~1s at import and only the compiled graph needs it
+        from langgraph.graph import StateGraph, START, END
+        from langchain_core.runnables import RunnableLambda
 
-        workflow.set_entry_point("analyze_stance")
+        workflow = StateGraph(ConversationState)
+        workflow.add_node("embed_query", RunnableLambda(self.embed_query, afunc=self.aembed_query))
+        workflow.add_node("analyze_stance", RunnableLambda(self.analyze_user_stance, afunc=self.aanalyze_user_stance))
+        workflow.add_node("retrieve", RunnableLambda(self.retrieve, afunc=self.aretrieve))
+        workflow.add_node("build_context", self.build_context)
+        workflow.add_node("resistant_response", self._respond("mi_resistant_response", self.resistance_prompt))
+        workflow.add_node("curious_response", self._respond("mi_curious_response", self.information_prompt))
+        workflow.add_node("ready_response", self._respond("mi_ready_response", self.reinforcement_prompt))
+
+        workflow.add_edge(START, "embed_query")
+        workflow.add_edge("embed_query", "analyze_stance")
+        workflow.add_edge("embed_query", "retrieve")
+        workflow.add_edge(["analyze_stance", "retrieve"], "build_context")   # waits for both
         workflow.add_conditional_edges(
-            "analyze_stance",
+            "build_context",
             self.route_based_on_stance,
             {
                 "resistant": "resistant_response",
@@ -39,39 +85,67 @@ class MIConversationGraph:
         workflow.add_edge("ready_response", END)
         return workflow.compile()
 
+    # ----- nodes (parallel ones only return their own keys) -----
+    def embed_query(self, state: ConversationState):
+        # lexical-only queries never need a vector (see RAGPipeline._route)
+        if self.rag._route(state["query"]) == "bm25":
+            return {"q_emb": None}
+        return {"q_emb": self.rag._embed_query(state["query"])}
+
+    async def aembed_query(self, state: ConversationState):
+        return await run_in_pool(self.embed_query, state)
+
+    @timed("mi_analyze_stance")
     def analyze_user_stance(self, state: ConversationState):
-        prompt = f"""
-Klassifiziere die Haltung des Nutzers mit GENAU EINEM Wort.
-Nachricht: {state['query']}
+        res = self.stance_classifier.classify(state["query"], state.get("q_emb"))
+        return {"user_stance": res.stance, "stance_confidence": res.confidence}
 
-Erlaubte Kategorien:
-- resistant  (defensiv, wütend, abweisend)
-- curious    (fragt nach, offen)
-- ready      (akzeptiert, will Infos)
-- neutral    (unklar)
+    async def aanalyze_user_stance(self, state: ConversationState):
+        return await run_in_pool(self.analyze_user_stance, state)
 
-Gib NUR ein Wort zurück: resistant | curious | ready | neutral
-"""
-        stance = self.llm.invoke(prompt).strip().lower()
-        state["user_stance"] = stance if stance in {"resistant","curious","ready","neutral"} else "neutral"
-        return state
+    @timed("mi_retrieve")
+    def retrieve(self, state: ConversationState):
+        return {"chunks": self.rag.retrieve(state["query"], q_emb=state.get("q_emb"))}
+
+    async def aretrieve(self, state: ConversationState):
+        return await run_in_pool(self.retrieve, state)
+
+    def build_context(self, state: ConversationState):
+        return {"context": self._format_docs(state.get("chunks", []))}
+
+    @staticmethod
+    def _history_block(state: ConversationState) -> str:
+        turns = state.get("chat_history") or []
+        return "Bisheriges Gespräch:\n" + "\n".join(turns) + "\n\n" if turns else ""
 
     def route_based_on_stance(self, state: ConversationState):
-        return state["user_stance"]
+        return state.get("user_stance", "neutral")
 
-    def _format_docs(self, docs):
+    def _format_docs(self, chunks: List[Dict]) -> str:
         parts = []
-        for i, d in enumerate(docs, 1):
-            src = d.metadata.get("source", "Unknown")
-            page = d.metadata.get("page", "?")
-            snippet = d.page_content[:600].replace("\n", " ").strip()
-            parts.append(f"[Quelle {i} | {src} | Seite {page}]\n{snippet}")
+        for c in chunks:
+            text = c.get("_full_content", c.get("content", ""))
+            snippet = text[:600].replace("\n", " ").strip()
+            parts.append(f"[Quelle {c['chunk_id']} | {c['source']} | Seite {c['page']}]\n{snippet}")
         return "\n\n".join(parts) if parts else "Keine relevanten Dokumente gefunden."
 
-    def handle_resistance(self, state: ConversationState):
-        docs = self.rag.retrieve(state["query"])
-        ctx = self._format_docs(docs)
-        prompt = f"""
+    def _respond(self, stage_name: str, prompt_fn):
+        """Branch node: prompt from state['context'], one LLM call (sync + async)."""
+        from langchain_core.runnables import RunnableLambda
+
+        @timed(stage_name)
+        def run(state: ConversationState):
+            return {"response": self.llm_invoke(prompt_fn(state))}
+
+        @timed(stage_name)
+        async def arun(state: ConversationState):
+            return {"response": await self.allm_invoke(prompt_fn(state))}
+
+        return RunnableLambda(run, afunc=arun, name=stage_name)
+
+    # ----- prompts -----
+    def resistance_prompt(self, state: ConversationState) -> str:
+        return f"""
 Der Nutzer wirkt widerständig/defensiv. Antworte im MI-Stil:
 - Gefühle anerkennen (Reflexion)
 - Keine Debatten
@@ -79,58 +153,76 @@ Der Nutzer wirkt widerständig/defensiv. Antworte im MI-Stil:
 - Kurze, ruhige Sätze
 - Quellen am Ende (Format: [Dokument, Seite X])
 
-Nutzer: {state['query']}
+{self._history_block(state)}Nutzer: {state['query']}
 Kontext:
-{ctx}
+{state['context']}
 
 Antwort (Deutsch, MI-Stil, mit Quellen am Ende):
 """
-        state["response"] = self.llm.invoke(prompt)
-        return state
 
-    def provide_information(self, state: ConversationState):
-        docs = self.rag.retrieve(state["query"])
-        ctx = self._format_docs(docs)
-        prompt = f"""
+    def information_prompt(self, state: ConversationState) -> str:
+        return f"""
 Der Nutzer ist neugierig/offen. Antworte im MI-Stil:
 - Kurze, sachliche Infos
 - 1 offene Frage am Schluss
 - Quellen am Ende (Format: [Dokument, Seite X])
 
-Frage: {state['query']}
+{self._history_block(state)}Frage: {state['query']}
 Kontext:
-{ctx}
+{state['context']}
 
 Antwort (Deutsch, MI-Stil, mit Quellen am Ende):
 """
-        state["response"] = self.llm.invoke(prompt)
-        return state
 
-    def reinforce_understanding(self, state: ConversationState):
-        docs = self.rag.retrieve(state["query"])
-        ctx = self._format_docs(docs)
-        prompt = f"""
+    def reinforcement_prompt(self, state: ConversationState) -> str:
+        return f"""
 Der Nutzer ist bereit für Infos. Antworte im MI-Stil:
 - Klare, belegte Fakten
 - Kurze Zusammenfassung (Reflexion)
 - Autonomie betonen
 - Quellen am Ende (Format: [Dokument, Seite X])
 
-Aussage/Frage: {state['query']}
+{self._history_block(state)}Aussage/Frage: {state['query']}
 Kontext:
-{ctx}
+{state['context']}
 
 Antwort (Deutsch, MI-Stil, mit Quellen am Ende):
 """
-        state["response"] = self.llm.invoke(prompt)
-        return state
 
-    def process(self, query: str, history: List[str] | None = None):
-        initial_state: ConversationState = {
+    # ----- entry points -----
+    @staticmethod
+    def _initial_state(query: str, history: List[str] | None) -> ConversationState:
+        return {
             "query": query,
             "response": "",
             "user_stance": "neutral",
             "chat_history": history or [],
         }
-        result = self.graph.invoke(initial_state)
-        return result.get("response", "")
+
+    @timed("mi_process")
+    def invoke(self, query: str, history: List[str] | None = None) -> ConversationState:
+        """Run one turn; returns the final state (response, stance, chunks, ...)."""
+        return self.graph.invoke(self._initial_state(query, history))
+
+    @timed("mi_process")
+    async def ainvoke(self, query: str, history: List[str] | None = None) -> ConversationState:
+        """Async invoke(): blocking work goes to the worker pool, the LLM call is awaited."""
+        return await self.graph.ainvoke(self._initial_state(query, history))
+
+    def process(self, query: str, history: List[str] | None = None):
+        return self.invoke(query, history).get("response", "")
+
+    async def aprocess(self, query: str, history: List[str] | None = None):
+        return (await self.ainvoke(query, history)).get("response", "")
+
+
+# --- process-wide instance (compiled once, shared by all /mi/generate requests) ---
+_MI_GRAPH: Optional[MIConversationGraph] = None
+_MI_LOCK = threading.Lock()
+
+def get_mi_graph() -> MIConversationGraph:
+    global _MI_GRAPH
+    with _MI_LOCK:
+        if _MI_GRAPH is None:
+            _MI_GRAPH = MIConversationGraph()
+        return _MI_GRAPH
@@ -1,61 +1,256 @@
 # app/ollama_client.py
-import os, hashlib, json
-import requests
+import os, hashlib, json, time
+from typing import Dict, Iterator, List, Union
 
-# --- Endpoints (work both in Docker and on host) ---
-_BASE = (
-    os.getenv("OLLAMA_BASE_URL")
-    or os.getenv("OLLAMA_HOST")
-    or "http://host.docker.internal:11434"
-).rstrip("/")
+from . import ollama_http
+from .ollama_http import OLLAMA_BASE as _BASE, EMBED_TIMEOUT, OllamaError
+from .metrics import LLM_CACHE, stage, observe_stage, record_llm_response
+from .singleflight import SingleFlight
 
+# --- Endpoints (work both in Docker and on host; all calls go through ollama_http's pool) ---
 OLLAMA_URL = f"{_BASE}/api/generate"   # e.g., http://host.docker.internal:11434/api/generate
+OLLAMA_CHAT_URL = f"{_BASE}/api/chat"
+
+# A prompt is either one string (/api/generate) or a list of chat messages
+# [{"role": "system" | "user" | "assistant", "content": ...}] (/api/chat).
+# With messages Ollama can reuse its KV cache for the unchanged prefix
+# (system prompt, earlier turns) and only prefills what is new.
+Prompt = Union[str, List[Dict[str, str]]]
 
 # Optional Redis cache (default to host Redis when running inside Docker)
 try:
     import redis
+    import redis.asyncio
     _REDIS_URL = os.getenv("REDIS_URL", "redis://host.docker.internal:6379/0")
     _rc = redis.from_url(_REDIS_URL)
+    _arc = redis.asyncio.from_url(_REDIS_URL)
 except Exception:
     _rc = None  # cache disabled if not available
+    _arc = None
 
 DEFAULT_MODEL = os.getenv("OLLAMA_MODEL", "llama3.1:8b")
 CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", "3600"))  # seconds
+# How long Ollama keeps a model loaded after a request (e.g. "30m", "-1" = forever).
+# Unset = Ollama's own default (5m); then the warm-up load can expire before traffic arrives.
+KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE")
+
+# identical prompts in flight at the same time share one generation (see singleflight)
+_LLM_FLIGHT = SingleFlight("llm")
+
+async def aclose() -> None:
+    """Close the pooled HTTP clients (call from app shutdown)."""
+    await ollama_http.aclose()
+
+def _request(model: str, prompt: Prompt, stream: bool) -> tuple:
+    """(path, payload) for a prompt string or a message list."""
+    if isinstance(prompt, str):
+        url, payload = "/api/generate", {"model": model, "prompt": prompt, "stream": stream}
+    else:
+        url, payload = "/api/chat", {"model": model, "messages": prompt, "stream": stream}
+    if KEEP_ALIVE:
+        payload["keep_alive"] = KEEP_ALIVE   # an unloaded model loses its KV cache too
+    return url, payload
+
+def _text(part: dict) -> str:
+    # /api/generate → "response", /api/chat → "message": {"content"}
+    if "message" in part:
+        return (part.get("message") or {}).get("content", "")
+    return part.get("response", "")
+
+async def awarm_up(chat_model: str | None = None, embed_model: str | None = None) -> dict:
+    """
+    Load the models into Ollama's memory before the first user request.
+    A generate call with an empty prompt just loads the model; the embed
+    model gets one tiny input. Returns {model: seconds}.
+    """
+    out = {}
+    for model, path, body in (
+        (chat_model, "/api/generate", {"prompt": "", "stream": False}),
+        (embed_model, "/api/embed", {"input": "warm-up"}),
+    ):
+        if not model:
+            continue
+        if KEEP_ALIVE:
+            body["keep_alive"] = KEEP_ALIVE
+        t0 = time.perf_counter()
+        try:
+            await ollama_http.apost(path, {"model": model, **body})
+        except OllamaError as e:
+            raise RuntimeError(f"Ollama warm-up of {model} failed: {e}") from e
+        out[model] = round(time.perf_counter() - t0, 3)
+    return out
 
-def _cache_key(model: str, prompt: str) -> str:
+def _cache_key(model: str, prompt: Prompt) -> str:
+    if not isinstance(prompt, str):
+        prompt = "chat||" + json.dumps(prompt, ensure_ascii=False, sort_keys=True)
     h = hashlib.sha1()
     h.update(model.encode("utf-8"))
     h.update(b"||")
     h.update(prompt.encode("utf-8"))
     return "llmresp:" + h.hexdigest()
 
-def ask_ollama(prompt: str, model: str | None = None) -> str:
+def ask_ollama(prompt: Prompt, model: str | None = None) -> str:
     model = model or DEFAULT_MODEL
+    ck = _cache_key(model, prompt)
 
     # 1) cache
     if _rc is not None:
         try:
-            ck = _cache_key(model, prompt)
             cached = _rc.get(ck)
             if cached:
+                LLM_CACHE.inc(result="hit")
                 return json.loads(cached.decode("utf-8"))["response"]
         except Exception:
             pass
+    LLM_CACHE.inc(result="miss")
+
+    # 2) call Ollama — or wait for the identical call already running
+    return _LLM_FLIGHT.do(ck, _generate, model, prompt, ck)
 
-    # 2) call Ollama
-    payload = {"model": model, "prompt": prompt, "stream": False}
-    try:
-        resp = requests.post(OLLAMA_URL, json=payload, timeout=120)
-        resp.raise_for_status()
-        out = resp.json().get("response", "").strip()
-    except requests.RequestException as e:
-        raise RuntimeError(f"Ollama request failed: {e}") from e
+def _generate(model: str, prompt: Prompt, ck: str) -> str:
+    path, payload = _request(model, prompt, stream=False)
+    t0 = time.perf_counter()
+    with stage("llm_generate"):
+        data = ollama_http.post(path, payload)
+    record_llm_response(model, data, time.perf_counter() - t0)
+    out = _text(data).strip()
 
     # 3) store
     if _rc is not None:
         try:
-            _rc.setex(_cache_key(model, prompt), CACHE_TTL, json.dumps({"response": out}, ensure_ascii=False))
+            _rc.setex(ck, CACHE_TTL, json.dumps({"response": out}, ensure_ascii=False))
+        except Exception:
+            pass
+
+    return out
+
+
+async def ask_ollama_async(prompt: Prompt, model: str | None = None) -> str:
+    """Non-blocking ask_ollama: pooled httpx connection + async Redis cache."""
+    model = model or DEFAULT_MODEL
+    ck = _cache_key(model, prompt)
+
+    # 1) cache
+    if _arc is not None:
+        try:
+            cached = await _arc.get(ck)
+            if cached:
+                LLM_CACHE.inc(result="hit")
+                return json.loads(cached.decode("utf-8"))["response"]
+        except Exception:
+            pass
+    LLM_CACHE.inc(result="miss")
+
+    # 2) call Ollama — or wait for the identical call already running
+    return await _LLM_FLIGHT.ado(ck, _agenerate, model, prompt, ck)
+
+async def _agenerate(model: str, prompt: Prompt, ck: str) -> str:
+    path, payload = _request(model, prompt, stream=False)
+    t0 = time.perf_counter()
+    with stage("llm_generate"):
+        data = await ollama_http.apost(path, payload)
+    record_llm_response(model, data, time.perf_counter() - t0)
+    out = _text(data).strip()
+
+    # 3) store
+    if _arc is not None:
+        try:
+            await _arc.setex(ck, CACHE_TTL, json.dumps({"response": out}, ensure_ascii=False))
         except Exception:
             pass
 
     return out
+
+def stream_ollama(prompt: Prompt, model: str | None = None) -> Iterator[str]:
+    """
+    Incremental variant of ask_ollama: yields response pieces as Ollama emits
+    them. A cache hit is yielded as a single piece; a completed stream is
+    written to the same cache key ask_ollama uses.
+    """
+    model = model or DEFAULT_MODEL
+    ck = _cache_key(model, prompt)
+
+    # 1) cache
+    if _rc is not None:
+        try:
+            cached = _rc.get(ck)
+            if cached:
+                LLM_CACHE.inc(result="hit")
+                yield json.loads(cached.decode("utf-8"))["response"]
+                return
+        except Exception:
+            pass
+    LLM_CACHE.inc(result="miss")
+
+    # 2) call Ollama — concurrent identical streams share one generation and
+    #    each replays its pieces from the start
+    yield from _LLM_FLIGHT.stream(ck, _generate_stream, model, prompt, ck)
+
+def _generate_stream(model: str, prompt: Prompt, ck: str) -> Iterator[str]:
+    # newline-delimited JSON, one object per piece
+    path, payload = _request(model, prompt, stream=True)
+    pieces = []
+    # timed by hand so time-to-first-token is recorded too
+    t0 = time.perf_counter()
+    first = None
+    for part in ollama_http.stream(path, payload):
+        if part.get("error"):
+            raise OllamaError(f"Ollama stream failed: {part['error']}")
+        piece = _text(part)
+        if piece:
+            if first is None:
+                first = time.perf_counter() - t0
+                observe_stage("llm_first_token", first)
+            pieces.append(piece)
+            yield piece
+        if part.get("done"):
+            wall = time.perf_counter() - t0
+            observe_stage("llm_generate", wall)
+            record_llm_response(model, part, wall - (first or 0.0))
+            break
+
+    # 3) store
+    if _rc is not None:
+        try:
+            out = "".join(pieces).strip()
+            _rc.setex(ck, CACHE_TTL, json.dumps({"response": out}, ensure_ascii=False))
+        except Exception:
+            pass
+
+
+class OllamaEmbedder:
+    """
+    Embeddings over the shared pool (retries, breaker) — stands in for
+    langchain_ollama.OllamaEmbeddings wherever Chroma/ingest/retrieval need
+    embed_documents / embed_query. Same /api/embed endpoint, so vectors are
+    identical and existing indexes stay valid.
+    """
+
+    def __init__(self, model: str, base_url: str = _BASE, timeout: float = EMBED_TIMEOUT):
+        self.model = model
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def _body(self, texts: List[str]) -> Dict:
+        body = {"model": self.model, "input": texts}
+        if KEEP_ALIVE:
+            body["keep_alive"] = KEEP_ALIVE
+        return body
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        data = ollama_http.post("/api/embed", self._body(list(texts)), timeout=self.timeout, base=self.base_url)
+        return data["embeddings"]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        data = await ollama_http.apost("/api/embed", self._body(list(texts)), timeout=self.timeout, base=self.base_url)
+        return data["embeddings"]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
@@ -0,0 +1,271 @@
+# app/ollama_http.py
+"""
+Shared HTTP layer for every Ollama call (generation, embeddings, warm-up).
+
+• Pooled connections: one httpx.Client shared by all threads, one
+  httpx.AsyncClient per event loop (dropped once its loop is closed). Calls reuse keep-alive connections
+  instead of opening a new TCP connection each time.
+• Timeouts: OLLAMA_CONNECT_TIMEOUT to connect. After that, the read timeout
+  depends on the call:
+    - generation: OLLAMA_READ_TIMEOUT for the whole answer
+    - embeddings: OLLAMA_EMBED_TIMEOUT
+    - streams: OLLAMA_STREAM_TIMEOUT between two pieces, so a stalled
+      model is noticed in seconds, not after two minutes
+• Retries: connection errors and 5xx are retried OLLAMA_RETRIES times, with
+  exponential backoff and full jitter. Streams are only retried before the
+  first byte.
+• Circuit breaker: after OLLAMA_BREAKER_THRESHOLD calls in a row failed
+  (retries exhausted), every call fails at once with OllamaUnavailable for
+  OLLAMA_BREAKER_COOLDOWN seconds. Then a single probe call decides whether
+  the breaker closes again.
+"""
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from typing import Dict, Iterator, Optional
+
+import httpx
+
+from .metrics import Counter, Gauge
+
+OLLAMA_BASE = (
+    os.getenv("OLLAMA_BASE_URL")
+    or os.getenv("OLLAMA_HOST")
+    or "http://host.docker.internal:11434"
+).rstrip("/")
+
+HTTP_MAX_CONNECTIONS = int(os.getenv("OLLAMA_MAX_CONNECTIONS", "16"))
+CONNECT_TIMEOUT   = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "3"))
+READ_TIMEOUT      = float(os.getenv("OLLAMA_READ_TIMEOUT", "120"))    # non-streamed generation
+EMBED_TIMEOUT     = float(os.getenv("OLLAMA_EMBED_TIMEOUT", "60"))    # one embedding batch
+STREAM_TIMEOUT    = float(os.getenv("OLLAMA_STREAM_TIMEOUT", "30"))   # gap between streamed pieces
+RETRIES           = int(os.getenv("OLLAMA_RETRIES", "2"))
+BACKOFF_BASE      = float(os.getenv("OLLAMA_BACKOFF_BASE", "0.25"))   # seconds, doubled per attempt
+BACKOFF_MAX       = float(os.getenv("OLLAMA_BACKOFF_MAX", "4"))
+BREAKER_THRESHOLD = int(os.getenv("OLLAMA_BREAKER_THRESHOLD", "5"))
+BREAKER_COOLDOWN  = float(os.getenv("OLLAMA_BREAKER_COOLDOWN", "15"))
+
+OLLAMA_RETRIES = Counter("rag_ollama_retries_total", "Ollama calls retried", ("endpoint",))
+OLLAMA_ERRORS  = Counter("rag_ollama_errors_total", "Ollama calls that failed after retries", ("endpoint", "kind"))
+BREAKER_OPEN   = Gauge("rag_ollama_breaker_open", "1 while the Ollama circuit breaker is open")
+
+# idle keep-alive connections closed by the server show up as protocol/read errors
+_RETRY_EXC = (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError, httpx.ReadError)
+_RETRY_STATUS = (500, 502, 503, 504)
+
+
+class OllamaError(RuntimeError):
+    pass
+
+
+class OllamaUnavailable(OllamaError):
+    """Circuit breaker is open: Ollama failed repeatedly, not even trying."""
+
+
+# ─── circuit breaker ─────────────────────────────────────────
+class CircuitBreaker:
+    def __init__(self, threshold: int = BREAKER_THRESHOLD, cooldown: float = BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probe_at: Optional[float] = None   # a half-open probe is in flight since then
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "open" if time.monotonic() - self.opened_at < self.cooldown else "half_open"
+
+    def before(self) -> None:
+        """Raise OllamaUnavailable while open; after the cooldown let exactly one probe through."""
+        if self.threshold <= 0:
+            return
+        with self._lock:
+            if self.opened_at is None:
+                return
+            now = time.monotonic()
+            left = self.cooldown - (now - self.opened_at)
+            # a probe that never reported back (cancelled request) expires after one cooldown
+            probing = self._probe_at is not None and now - self._probe_at < self.cooldown
+            if left > 0 or probing:
+                raise OllamaUnavailable(
+                    f"Ollama unavailable ({self.failures} failed calls in a row), "
+                    f"retrying in {max(left, 0):.0f}s")
+            self._probe_at = now
+
+    def success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probe_at = None
+        BREAKER_OPEN.set(0)
+
+    def failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self._probe_at = None
+            if self.threshold > 0 and self.failures >= self.threshold:
+                if self.opened_at is None:
+                    print(f"Ollama circuit breaker open after {self.failures} failures")
+                self.opened_at = time.monotonic()   # (re)start the cooldown
+                BREAKER_OPEN.set(1)
+
+    def snapshot(self) -> Dict:
+        return {"state": self.state, "consecutive_failures": self.failures}
+
+
+BREAKER = CircuitBreaker()
+
+
+# ─── pooled clients ──────────────────────────────────────────
+def _new_client(cls):
+    return cls(
+        # pool=None: under bursts wait for a free connection instead of failing
+        timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT, pool=None),
+        limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS,
+                            max_keepalive_connections=HTTP_MAX_CONNECTIONS),
+    )
+
+_http: Optional[httpx.Client] = None
+_http_lock = threading.Lock()
+# connections belong to the loop that opened them: one client per loop.
+# The pool's transports reference their loop, so a weak-keyed dict would
+# never let go; clients of closed loops are dropped on the next lookup
+# instead (asyncio.run per call in tests, benchmarks, sync wrappers)
+_async_http: Dict[asyncio.AbstractEventLoop, httpx.AsyncClient] = {}
+_async_http_lock = threading.Lock()
+
+def client() -> httpx.Client:
+    global _http
+    if _http is None or _http.is_closed:
+        with _http_lock:
+            if _http is None or _http.is_closed:
+                _http = _new_client(httpx.Client)
+    return _http
+
+def async_client() -> httpx.AsyncClient:
+    loop = asyncio.get_running_loop()
+    c = _async_http.get(loop)
+    if c is None or c.is_closed:
+        with _async_http_lock:
+            for old in [l for l in _async_http if l.is_closed()]:
+                # its loop is gone, so no aclose(); dropping the last reference
+                # closes the sockets (and frees the loop) on collection
+                del _async_http[old]
+            c = _async_http[loop] = _new_client(httpx.AsyncClient)
+    return c
+
+async def aclose() -> None:
+    """Close the pooled clients (call from app shutdown)."""
+    global _http
+    loop = asyncio.get_running_loop()
+    with _async_http_lock:
+        clients = list(_async_http.items())
+        _async_http.clear()
+    for other, c in clients:
+        if other is loop:
+            await c.aclose()
+        elif other.is_running():   # e.g. a loop in another thread: close it there
+            asyncio.run_coroutine_threadsafe(c.aclose(), other)
+    if _http is not None:
+        _http.close()
+        _http = None
+
+
+# ─── retry helpers ───────────────────────────────────────────
+def _backoff(attempt: int) -> float:
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+def _timeout(read: float) -> httpx.Timeout:
+    return httpx.Timeout(read, connect=CONNECT_TIMEOUT, pool=None)
+
+def _endpoint(path: str) -> str:
+    return path.rsplit("/", 1)[-1]   # "generate", "chat", "embed"
+
+def _retryable(exc: Exception, attempt: int) -> bool:
+    if attempt >= RETRIES:
+        return False
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code in _RETRY_STATUS
+    return isinstance(exc, _RETRY_EXC)
+
+def _fail(path: str, exc: Exception) -> OllamaError:
+    """Count the failure; 4xx means Ollama is up (bad model name, ...), so it doesn't trip the breaker."""
+    client_error = isinstance(exc, httpx.HTTPStatusError) and exc.response.status_code < 500
+    if client_error:
+        BREAKER.success()
+    else:
+        BREAKER.failure()
+    kind = "status" if isinstance(exc, httpx.HTTPStatusError) else type(exc).__name__
+    OLLAMA_ERRORS.inc(endpoint=_endpoint(path), kind=kind)
+    detail = exc
+    if isinstance(exc, httpx.HTTPStatusError):
+        detail = f"{exc.response.status_code} {exc.response.text[:200]}"
+    return OllamaError(f"Ollama request failed: {detail}")
+
+
+# ─── requests ────────────────────────────────────────────────
+def post(path: str, body: Dict, timeout: float = READ_TIMEOUT, base: str = OLLAMA_BASE) -> Dict:
+    BREAKER.before()
+    attempt = 0
+    while True:
+        try:
+            resp = client().post(base + path, json=body, timeout=_timeout(timeout))
+            resp.raise_for_status()
+            data = resp.json()
+        except httpx.HTTPError as e:
+            if _retryable(e, attempt):
+                OLLAMA_RETRIES.inc(endpoint=_endpoint(path))
+                time.sleep(_backoff(attempt))
+                attempt += 1
+                continue
+            raise _fail(path, e) from e
+        BREAKER.success()
+        return data
+
+async def apost(path: str, body: Dict, timeout: float = READ_TIMEOUT, base: str = OLLAMA_BASE) -> Dict:
+    BREAKER.before()
+    attempt = 0
+    while True:
+        try:
+            resp = await async_client().post(base + path, json=body, timeout=_timeout(timeout))
+            resp.raise_for_status()
+            data = resp.json()
+        except httpx.HTTPError as e:
+            if _retryable(e, attempt):
+                OLLAMA_RETRIES.inc(endpoint=_endpoint(path))
+                await asyncio.sleep(_backoff(attempt))
+                attempt += 1
+                continue
+            raise _fail(path, e) from e
+        BREAKER.success()
+        return data
+
+def stream(path: str, body: Dict, timeout: float = STREAM_TIMEOUT, base: str = OLLAMA_BASE) -> Iterator[Dict]:
+    """NDJSON objects as Ollama sends them. Retried only until the response headers arrive."""
+    BREAKER.before()
+    attempt = 0
+    while True:
+        try:
+            with client().stream("POST", base + path, json=body, timeout=_timeout(timeout)) as resp:
+                if resp.status_code >= 400:
+                    resp.read()
+                resp.raise_for_status()
+                BREAKER.success()
+                attempt = None   # committed: no retries once pieces may have been yielded
+                for line in resp.iter_lines():
+                    if line:
+                        yield json.loads(line)
+                return
+        except httpx.HTTPError as e:
+            if attempt is not None and _retryable(e, attempt):
+                OLLAMA_RETRIES.inc(endpoint=_endpoint(path))
+                time.sleep(_backoff(attempt))
+                attempt += 1
+                continue
+            raise _fail(path, e) from e
@@ -0,0 +1,230 @@
+# app/page_render.py
+"""
+Rendered PDF pages for the Quellen viewer (GET /pages/{source}/{page}).
+
+The Streamlit UI used to rasterize the cited page with pdf2image/poppler on
+every rerun, i.e. on every chat message. Now the API renders a page once and
+keeps the image on disk under PAGE_CACHE_DIR, keyed by (file SHA-256, page,
+dpi): an updated PDF gets new images, and an unchanged page is never
+rendered twice, across restarts and workers.
+
+• ETag is that key, so a client's If-None-Match is answered with a 304
+  before anything is rendered or read from disk
+• rendering runs on its own small thread pool (PAGE_RENDER_WORKERS; poppler
+  is a subprocess, the thread just waits) so it never blocks RAG work on
+  WORKER_POOL; concurrent requests for the same page share one render
+• prerender(chunks): after an answer, the cited pages are rendered in the
+  background, so opening a source in the viewer is instant
+• the cache is trimmed to PAGE_CACHE_MAX_MB, least recently served first;
+  its size is tracked per render, the directory is only scanned when that
+  estimate crosses the limit (or every _RESCAN_EVERY renders, to pick up
+  other workers' files)
+
+Page numbers are 1-based PDF page indices, as pdf2image's first_page.
+"""
+import asyncio
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from .ingest import file_sha256
+from .metrics import Counter, timed
+from .singleflight import SingleFlight
+from .utils import _abs
+
+PAGE_CACHE_DIR      = os.getenv("PAGE_CACHE_DIR", "embeddings/pages")
+PAGE_DPI            = int(os.getenv("PAGE_DPI", "150"))
+PAGE_MIN_DPI        = 36
+PAGE_MAX_DPI        = int(os.getenv("PAGE_MAX_DPI", "300"))
+PAGE_FORMAT         = os.getenv("PAGE_FORMAT", "png")                 # png | jpeg
+PAGE_RENDER_WORKERS = int(os.getenv("PAGE_RENDER_WORKERS", "2"))
+PAGE_PRERENDER      = os.getenv("PAGE_PRERENDER", "1") != "0"        # render cited pages after each answer
+PAGE_CACHE_MAX_MB   = int(os.getenv("PAGE_CACHE_MAX_MB", "512"))
+PAGE_MAX_AGE        = int(os.getenv("PAGE_MAX_AGE", "86400"))          # Cache-Control max-age, seconds
+
+_TRIM_TO      = 0.9    # a trim goes down to this share of the limit, not just under it
+_RESCAN_EVERY = 256    # renders between full rescans of the cache size
+
+_FORMATS = {"png": ("PNG", "image/png"), "jpeg": ("JPEG", "image/jpeg")}
+
+PAGE_REQUESTS = Counter("rag_page_requests_total", "Page image requests", ("result",))   # not_modified | hit | rendered
+PAGE_PRERENDERS = Counter("rag_page_prerenders_total", "Cited pages rendered in the background", ("result",))
+
+_RENDER_POOL = ThreadPoolExecutor(max_workers=PAGE_RENDER_WORKERS, thread_name_prefix="page-render")
+
+
+class PageNotFound(LookupError):
+    """Unknown source file or page out of range."""
+
+
+class PageRef(NamedTuple):
+    pdf: Path
+    sha256: str
+    page: int
+    dpi: int
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.sha256[:16]}-{self.page}-{self.dpi}-{PAGE_FORMAT}"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """If-None-Match check (RFC 9110 weak comparison): a list of ETags, W/ prefixes ignored, * matches all."""
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*":
+            return True
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+
+def cited_pages(chunks: Iterable[Dict]) -> List[Tuple[str, int]]:
+    """(source, page) of every chunk, de-duplicated, in rank order — the page the viewer shows."""
+    out: List[Tuple[str, int]] = []
+    for c in chunks:
+        try:
+            page = int(c.get("page") or 1)
+        except (TypeError, ValueError):
+            continue
+        key = (Path(str(c.get("source", ""))).name, page)
+        if key[0] and key not in out:
+            out.append(key)
+    return out
+
+
+class PageRenderer:
+    def __init__(self, source_dir: Path, cache_dir: Path = _abs(PAGE_CACHE_DIR)):
+        if PAGE_FORMAT not in _FORMATS:
+            raise ValueError(f"PAGE_FORMAT must be one of {tuple(_FORMATS)}, got {PAGE_FORMAT!r}")
+        self.source_dir = Path(source_dir)
+        self.cache_dir = Path(cache_dir)
+        self.media_type = _FORMATS[PAGE_FORMAT][1]
+        self._flight = SingleFlight("page_render")
+        self._lock = threading.Lock()
+        self._files: Dict[str, Tuple[Tuple[int, int], str, int]] = {}   # name → ((size, mtime), sha256, pages)
+        self._cache_bytes: Optional[int] = None   # estimate, None until the first scan
+        self._renders = 0
+        self._trim_lock = threading.Lock()
+
+    # ----- lookup -----
+    def _file_info(self, pdf: Path) -> Tuple[str, int]:
+        """(sha256, page count), recomputed only when size/mtime change."""
+        st = pdf.stat()
+        stamp = (st.st_size, st.st_mtime_ns)
+        with self._lock:
+            hit = self._files.get(pdf.name)
+        if hit is not None and hit[0] == stamp:
+            return hit[1], hit[2]
+        from pypdf import PdfReader
+        sha, pages = file_sha256(pdf), len(PdfReader(str(pdf)).pages)
+        with self._lock:
+            self._files[pdf.name] = (stamp, sha, pages)
+        return sha, pages
+
+    def locate(self, source: str, page: int, dpi: int = PAGE_DPI) -> PageRef:
+        """Raises PageNotFound (unknown file / page) or ValueError (dpi out of range)."""
+        if not PAGE_MIN_DPI <= dpi <= PAGE_MAX_DPI:
+            raise ValueError(f"dpi must be within [{PAGE_MIN_DPI}, {PAGE_MAX_DPI}], got {dpi}")
+        # bare file names only: nothing outside source_dir is reachable
+        if Path(source).name != source or not source.lower().endswith(".pdf"):
+            raise PageNotFound(f"unknown source {source!r}")
+        pdf = self.source_dir / source
+        if not pdf.is_file():
+            raise PageNotFound(f"unknown source {source!r}")
+        sha, pages = self._file_info(pdf)
+        if not 1 <= page <= pages:
+            raise PageNotFound(f"{source} has {pages} pages, no page {page}")
+        return PageRef(pdf, sha, page, dpi)
+
+    def cache_path(self, ref: PageRef) -> Path:
+        return self.cache_dir / ref.sha256[:16] / f"p{ref.page:04d}-{ref.dpi}.{PAGE_FORMAT}"
+
+    # ----- rendering -----
+    def render(self, ref: PageRef) -> Tuple[Path, bool]:
+        """(image path, rendered now?) — from the disk cache if possible."""
+        path = self.cache_path(ref)
+        if path.exists():
+            try:
+                os.utime(path)   # recently served pages survive trimming
+            except OSError:
+                pass
+            return path, False
+        return self._flight.do(path, self._render, ref, path), True
+
+    @timed("page_render")
+    def _render(self, ref: PageRef, path: Path) -> Path:
+        from pdf2image import convert_from_path   # needs poppler (pdftoppm) installed
+        images = convert_from_path(str(ref.pdf), dpi=ref.dpi, first_page=ref.page, last_page=ref.page)
+        if not images:
+            raise PageNotFound(f"{ref.pdf.name}: page {ref.page} did not render")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        images[0].save(tmp, format=_FORMATS[PAGE_FORMAT][0])
+        tmp.replace(path)   # atomic: other workers never serve half an image
+        self._account(path.stat().st_size)
+        return path
+
+    def _account(self, added: int) -> None:
+        """Add a new image to the size estimate; scan and trim only when needed."""
+        with self._lock:
+            self._renders += 1
+            rescan = self._cache_bytes is None or self._renders % _RESCAN_EVERY == 0
+            if not rescan:
+                self._cache_bytes += added
+                if self._cache_bytes <= PAGE_CACHE_MAX_MB * 1024 * 1024:
+                    return
+        self._trim()
+
+    def _trim(self) -> None:
+        if not self._trim_lock.acquire(blocking=False):
+            return   # another render is already trimming
+        try:
+            files = [(p.stat(), p) for p in self.cache_dir.glob(f"*/*.{PAGE_FORMAT}")]
+            total, limit = sum(st.st_size for st, _ in files), PAGE_CACHE_MAX_MB * 1024 * 1024
+            if total > limit:
+                for st, p in sorted(files, key=lambda x: x[0].st_mtime):
+                    if total <= limit * _TRIM_TO:
+                        break
+                    p.unlink(missing_ok=True)
+                    total -= st.st_size
+            with self._lock:
+                self._cache_bytes = total
+        finally:
+            self._trim_lock.release()
+
+    async def aget(self, source: str, page: int, dpi: int = PAGE_DPI) -> PageRef:
+        return await self._run(self.locate, source, page, dpi)
+
+    async def arender(self, ref: PageRef) -> Path:
+        path, rendered = await self._run(self.render, ref)
+        PAGE_REQUESTS.inc(result="rendered" if rendered else "hit")
+        return path
+
+    @staticmethod
+    async def _run(fn, *args):
+        loop = asyncio.get_running_loop()
+        ctx = contextvars.copy_context()   # page_render stage lands in the request trace
+        return await loop.run_in_executor(_RENDER_POOL, partial(ctx.run, fn, *args))
+
+    # ----- background -----
+    def prerender(self, chunks: Iterable[Dict], dpi: int = PAGE_DPI) -> None:
+        """Queue the pages cited by an answer; never raises, never blocks."""
+        if not PAGE_PRERENDER:
+            return
+        for source, page in cited_pages(chunks):
+            _RENDER_POOL.submit(self._prerender_one, source, page, dpi)
+
+    def _prerender_one(self, source: str, page: int, dpi: int) -> None:
+        try:
+            _, rendered = self.render(self.locate(source, page, dpi))
+            PAGE_PRERENDERS.inc(result="rendered" if rendered else "cached")
+        except Exception as e:   # missing poppler, bad page: the viewer reports it when asked
+            PAGE_PRERENDERS.inc(result="failed")
+            print(f"Pre-render of {source} p.{page} failed: {e}")
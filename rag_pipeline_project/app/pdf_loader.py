@@ -1,9 +1,215 @@
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_core.documents import Document
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import lru_cache
 from pathlib import Path
-from typing import List
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, Optional, Tuple
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import time
 
-def load_pdfs_from_folder(folder_path: str) -> List[Document]:
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
+
+# Parsing is CPU-bound (pypdf), so it runs in processes, not threads
+PARSE_WORKERS = int(os.getenv("INGEST_PARSE_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# Pages whose text layer is missing or garbled (scans, flyers with outlined or
+# oddly encoded fonts) are extracted again, page by page: pdfplumber first,
+# then OCR (tesseract via pdf2image) if the page is still poor. Both are
+# optional; without them such pages keep their pypdf text.
+PDF_MIN_PAGE_CHARS  = int(os.getenv("PDF_MIN_PAGE_CHARS", "80"))       # fewer non-space chars = low text
+PDF_MIN_CLEAN_RATIO = float(os.getenv("PDF_MIN_CLEAN_RATIO", "0.85"))  # letters/digits/punctuation share
+PDF_OCR             = os.getenv("PDF_OCR", "1") != "0"
+PDF_OCR_LANG        = os.getenv("PDF_OCR_LANG", "deu")
+PDF_OCR_DPI         = int(os.getenv("PDF_OCR_DPI", "300"))
+
+# Extracted page text is cached per file version (sha256) under
+# <persist_dir>/page_text/, so re-chunking never parses or OCRs a PDF again
+PAGE_TEXT_DIR = "page_text"
+_PAGE_TEXT_VERSION = 1
+_PUNCT = set(".,;:!?()[]{}\"'„“”‚‘’«»‹›§%&/+-–—…€$°*#=<>@_|")
+
+# ---------------- page quality ------------------
+def _clean_chars(text: str) -> int:
+    return sum(1 for c in text if c.isalnum() or c in _PUNCT)
+
+def needs_fallback(text: str) -> bool:
+    """True for pages with (almost) no text layer or a garbled one."""
+    chars = sum(1 for c in text if not c.isspace())
+    if chars < PDF_MIN_PAGE_CHARS or "(cid:" in text:
+        return True
+    return _clean_chars(text) / chars < PDF_MIN_CLEAN_RATIO
+
+def _better(candidate: str, current: str) -> bool:
+    if not candidate.strip():
+        return False
+    if needs_fallback(current) != needs_fallback(candidate):
+        return needs_fallback(current)
+    return _clean_chars(candidate) > _clean_chars(current)
+
+# ---------------- fallbacks ---------------------
+@lru_cache(maxsize=1)
+def _ocr_available() -> bool:
+    if not PDF_OCR:
+        return False
+    try:
+        import pytesseract  # noqa: F401
+        import pdf2image    # noqa: F401
+    except ImportError:
+        return False
+    return shutil.which("tesseract") is not None and shutil.which("pdftoppm") is not None
+
+def extraction_config() -> Dict:
+    """
+    The configured extraction settings; part of the index config. Only
+    settings, never what this machine has installed: the embed_documents CLI
+    on a host without tesseract and the API container with it share one
+    index and must agree on its config.
+    """
+    return {"v": _PAGE_TEXT_VERSION, "min_chars": PDF_MIN_PAGE_CHARS, "min_clean": PDF_MIN_CLEAN_RATIO,
+            "ocr": [PDF_OCR_LANG, PDF_OCR_DPI] if PDF_OCR else None}
+
+@lru_cache(maxsize=1)
+def extraction_signature() -> str:
+    """Short fingerprint of how pages are extracted here (settings + OCR available); the page-text cache key."""
+    cfg = dict(extraction_config(), ocr=extraction_config()["ocr"] if _ocr_available() else None)
+    return hashlib.sha1(json.dumps(cfg, sort_keys=True).encode("utf-8")).hexdigest()[:10]
+
+def _pdfplumber_pages(pdf_file: Path, pages: List[int]) -> Dict[int, str]:
+    try:
+        import pdfplumber
+    except ImportError:
+        return {}
+    out = {}
+    try:
+        with pdfplumber.open(str(pdf_file)) as pdf:
+            for i in pages:
+                out[i] = pdf.pages[i].extract_text() or ""
+    except Exception as e:   # broken page tree etc.: keep what pypdf gave us
+        print(f"pdfplumber failed on {pdf_file.name}: {e}")
+    return out
+
+def _ocr_page(pdf_file: Path, i: int) -> str:
+    import pytesseract
+    from pdf2image import convert_from_path
+    images = convert_from_path(str(pdf_file), dpi=PDF_OCR_DPI, first_page=i + 1, last_page=i + 1)
+    return pytesseract.image_to_string(images[0], lang=PDF_OCR_LANG) if images else ""
+
+def repair_pages(pdf_file: Path, documents: List["Document"]) -> Dict[str, int]:
+    """
+    Re-extract low-text pages in place (metadata["extraction"] records how).
+    Returns {method: pages} for the pages that were replaced.
+    """
+    low = [i for i, d in enumerate(documents) if needs_fallback(d.page_content)]
+    if not low:
+        return {}
+    used: Dict[str, int] = {}
+    plumber = _pdfplumber_pages(pdf_file, low)
+    for i in low:
+        doc = documents[i]
+        best, method = doc.page_content, None
+        if _better(plumber.get(i, ""), best):
+            best, method = plumber[i], "pdfplumber"
+        if needs_fallback(best) and _ocr_available():
+            try:
+                text = _ocr_page(pdf_file, i)
+            except Exception as e:
+                print(f"OCR failed on {pdf_file.name} p.{i + 1}: {e}")
+                text = ""
+            if _better(text, best):
+                best, method = text, "ocr"
+        if method is not None:
+            doc.page_content = best
+            doc.metadata["extraction"] = method
+            used[method] = used.get(method, 0) + 1
+    return used
+
+# ---------------- page-text cache ---------------
+def page_text_path(cache_dir: Path, sha256: str) -> Path:
+    return Path(cache_dir) / f"{sha256[:32]}-{extraction_signature()}.json.gz"
+
+def _read_page_text(path: Path) -> Optional[List["Document"]]:
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            pages = json.load(f)["pages"]
+    except (FileNotFoundError, OSError, ValueError, KeyError):
+        return None
+    from langchain_core.documents import Document
+    return [Document(page_content=p["text"], metadata=p["metadata"]) for p in pages]
+
+def _write_page_text(path: Path, documents: List["Document"]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with gzip.open(tmp, "wt", encoding="utf-8") as f:
+        json.dump({"pages": [{"text": d.page_content, "metadata": d.metadata} for d in documents]},
+                  f, ensure_ascii=False, default=str)
+    tmp.replace(path)   # atomic: parallel parsers never read half a file
+
+def prune_page_text(cache_dir: Path, keep_sha256: Iterable[str]) -> None:
+    """
+    Drop cached text of file versions that left the index. Entries of other
+    signatures are kept: a host without OCR and a container with it share
+    this directory.
+    """
+    keep = {sha[:32] for sha in keep_sha256}
+    for p in Path(cache_dir).glob("*.json.gz"):
+        if p.name.split("-", 1)[0] not in keep:
+            p.unlink(missing_ok=True)
+
+# ---------------- loading -----------------------
+def load_pdf(pdf_file: str | Path, cache_dir: Optional[Path] = None,
+             sha256: Optional[str] = None) -> List["Document"]:
+    """
+    Load a single PDF, one Document per page. With cache_dir + sha256 the
+    page text comes from (and goes to) the page-text cache.
+    """
+    pdf_file = Path(pdf_file)
+    cached = cache_dir is not None and sha256 is not None
+    if cached:
+        documents = _read_page_text(page_text_path(cache_dir, sha256))
+        if documents is not None:
+            print(f"Loaded {len(documents)} pages from {pdf_file.name} (page-text cache)")
+            return documents
+
+    from langchain_community.document_loaders import PyPDFLoader   # heavy; only parsers need it
+    documents = PyPDFLoader(str(pdf_file)).load()
+    used = repair_pages(pdf_file, documents)
+    if cached:
+        _write_page_text(page_text_path(cache_dir, sha256), documents)
+    extra = "".join(f", {n} via {m}" for m, n in used.items())
+    print(f"Loaded {len(documents)} pages from {pdf_file.name}{extra}")
+    return documents
+
+def _load_pdf_timed(pdf_file: str | Path, cache_dir: Optional[Path] = None,
+                    sha256: Optional[str] = None) -> Tuple[List["Document"], float]:
+    t0 = time.perf_counter()
+    return load_pdf(pdf_file, cache_dir, sha256), time.perf_counter() - t0
+
+def iter_pdfs_parallel(
+    pdf_files: Iterable[str | Path], workers: int = PARSE_WORKERS,
+    cache_dir: Optional[Path] = None, sha256s: Optional[List[str]] = None,
+) -> Iterator[Tuple[Path, List["Document"], float]]:
+    """
+    Parse PDFs in a process pool and yield (path, pages, parse_seconds) as each
+    one finishes, so callers can start splitting/embedding before the slowest
+    file is done. Page fallbacks (pdfplumber / OCR) run in the same worker
+    process as their file. sha256s (same order as pdf_files) enable the
+    page-text cache in cache_dir.
+    """
+    pdf_files = [Path(p) for p in pdf_files]
+    shas = list(sha256s) if sha256s is not None else [None] * len(pdf_files)
+    if workers <= 1 or len(pdf_files) <= 1:
+        for p, sha in zip(pdf_files, shas):
+            yield (p, *_load_pdf_timed(p, cache_dir, sha))
+        return
+    with ProcessPoolExecutor(max_workers=min(workers, len(pdf_files))) as pool:
+        futures = {pool.submit(_load_pdf_timed, str(p), cache_dir, sha): p for p, sha in zip(pdf_files, shas)}
+        for fut in as_completed(futures):
+            yield (futures[fut], *fut.result())
+
+def load_pdfs_from_folder(folder_path: str) -> List["Document"]:
     """
     Load all PDFs in the folder and return a list of their full texts.
     """
@@ -11,13 +217,10 @@ def load_pdfs_from_folder(folder_path: str) -> List[Document]:
     print(f"[DEBUG] Looking for PDFs in: {folder}")
 
     all_docs = []
-    pdf_files = list(folder.glob("*.pdf"))
+    pdf_files = sorted(folder.glob("*.pdf"))
     print(f"[DEBUG] Found {len(pdf_files)} PDFs: {[f.name for f in pdf_files]}")
 
-    for pdf_file in pdf_files:
-        loader = PyPDFLoader(str(pdf_file))
-        documents = loader.load()
-        print(f"Loaded {len(documents)} pages from {pdf_file.name}")
-        all_docs.extend(documents)
+    for _, pages, _ in iter_pdfs_parallel(pdf_files):
+        all_docs.extend(pages)
 
     return all_docs
@@ -1,18 +1,35 @@
 # rag_pipeline_project/app/rag_pipeline.py
 
 import os
-import math
+import asyncio
+import contextvars
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import Optional, List, Tuple, Dict
-
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_ollama import OllamaEmbeddings
-from langchain_community.vectorstores import Chroma
-from langchain_core.documents import Document
+from typing import TYPE_CHECKING, Optional, List, Dict, Iterator, AsyncIterator, Tuple
+
+import numpy as np
+
+from .ingest import index_lock, sync_index, index_version as _index_version
+from .pdf_loader import extraction_config
+from .bm25 import BM25Index, ensure_bm25, is_lexical_query, rrf
+from .ollama_client import ask_ollama, ask_ollama_async, stream_ollama, OllamaEmbedder
+from .concurrency import run_in_pool
+from .metrics import stage, timed
+from .singleflight import SingleFlight, normalize_query
+from .context import PROMPT_TOKEN_BUDGET, count_tokens, pack_context, split_turns
+from .cache import (
+    LRUCache, SemanticCache, SEMANTIC_CACHE_ENABLED,
+    EMBED_CACHE_MAX, RETRIEVAL_CACHE_MAX, RETRIEVAL_CACHE_TTL, _redis_client,
+)
+from .utils import load_system_prompt, _abs
+from .vector_store import VECTOR_BACKEND, VECTOR_BACKENDS, backend_config, build_vector_backend
 
-from .pdf_loader import load_pdfs_from_folder
-from .ollama_client import ask_ollama
-from .utils import load_system_prompt, is_chroma_cache_present
+# langchain / chromadb take seconds to import; they are pulled in on first use
+# (index open, first embedding) so importing the app stays fast
+if TYPE_CHECKING:
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
 
 # ---------- Environment / networking ----------
 # Inside Docker, "localhost" means the container. Use host.docker.internal to reach the host’s services.
@@ -36,17 +53,104 @@ DEFAULT_CHUNK_SIZE       = 800
 DEFAULT_CHUNK_OVERLAP    = 120
 DEFAULT_RETRIEVE_K       = 4
 DEFAULT_SCORE_THRESHOLD: Optional[float] = None  # e.g., 0.35
+# "vector" (Chroma, MMR), "bm25" (lexical only, no embedding call) or
+# "hybrid" (both, fused with reciprocal rank fusion; keyword-style queries go BM25-only)
+DEFAULT_RETRIEVAL_MODE  = os.getenv("RAG_RETRIEVAL_MODE", "vector")
+RETRIEVAL_MODES = ("vector", "bm25", "hybrid")
 
 MEMORY_EXCHANGES = DEFAULT_MEMORY_EXCHANGES  # imported by endpoints.py
 
+# "generate" (/api/generate with one flat prompt string) or "chat" (/api/chat,
+# stable message prefix → Ollama KV cache reuse across turns)
+DEFAULT_LLM_API = os.getenv("RAG_LLM_API", "generate")
+LLM_APIS = ("chat", "generate")
+
+# MMR (per-request overrides: retrieve(..., lambda_mult=, fetch_k=))
+DEFAULT_FETCH_K     = int(os.getenv("RAG_FETCH_K", "40"))           # candidate pool
+DEFAULT_LAMBDA_MULT = float(os.getenv("RAG_MMR_LAMBDA", "0.5"))     # relevance (→1) vs diversity (→0)
+MAX_FETCH_K         = int(os.getenv("RAG_MAX_FETCH_K", "500"))
+CANDIDATE_CACHE_MAX = int(os.getenv("CANDIDATE_CACHE_MAX", "64"))   # cached candidate pools (fetch_k × dim floats each)
+
+# batch API (generate_batch / POST /generate/batch)
+BATCH_MAX_QUERIES = int(os.getenv("RAG_BATCH_MAX", "256"))          # queries per request / per embedding call
+BATCH_CONCURRENCY = int(os.getenv("RAG_BATCH_CONCURRENCY", "4"))    # LLM generations in flight per batch
+
+CITATION_RULE = "WICHTIG: Zitiere Quellen am ENDE deiner Antwort im Format: [Dokumentname, Seite X]"
+
 # ---------------- Helpers ----------------------
-def _cosine(a, b):
-    # a,b are lists of floats
-    da = math.sqrt(sum(x*x for x in a))
-    db = math.sqrt(sum(x*x for x in b))
-    if da == 0 or db == 0:
-        return 0.0
-    return sum(x*y for x, y in zip(a, b)) / (da * db)
+def _cosine_scores(q: np.ndarray, m: np.ndarray) -> np.ndarray:
+    # cosine of one query vector against every row of m, in one shot
+    if m.size == 0:
+        return np.zeros(0, dtype=np.float32)
+    qn = np.linalg.norm(q)
+    mn = np.linalg.norm(m, axis=1)
+    denom = np.where(mn * qn == 0, 1.0, mn * qn)
+    return (m @ q) / denom
+
+def _unit_rows(m: np.ndarray) -> np.ndarray:
+    # rows scaled to length 1 (zero rows stay zero), so dot products are cosines
+    norms = np.linalg.norm(m, axis=1, keepdims=True)
+    return m / np.where(norms == 0, 1.0, norms)
+
+def _cand_prefix(cand: Dict, n: int) -> Dict:
+    # the n nearest of a (nearest-first) candidate pool
+    if n >= len(cand["ids"]):
+        return cand
+    return {"ids": cand["ids"][:n], "documents": cand["documents"][:n],
+            "metadatas": cand["metadatas"][:n], "unit": cand["unit"][:n], "n": n}
+
+_MMR_TIE_EPS = 1e-6   # float32 noise: near-duplicate chunks score "equal" within this
+
+def _mmr_select(unit: np.ndarray, scores: np.ndarray, k: int, lambda_mult: float) -> List[int]:
+    """
+    Greedy maximal marginal relevance over unit-normalized candidate rows.
+    scores: cosine of each candidate to the query. Each pick is one
+    matrix-vector product that updates every candidate's max similarity to
+    the chosen set, so a pick costs O(fetch_k · dim) in NumPy, no Python loop
+    over candidates. Candidates within _MMR_TIE_EPS of the best MMR score
+    count as a tie and the nearest one (lowest index) wins, so duplicate
+    chunks are picked in a stable order. Same objective as langchain's
+    maximal_marginal_relevance; on such ties its pick can differ (it
+    compares the float noise).
+    """
+    n = len(scores)
+    k = min(k, n)
+    if k <= 0:
+        return []
+    picked = [int(np.flatnonzero(scores >= scores.max() - _MMR_TIE_EPS)[0])]
+    redundancy = unit @ unit[picked[0]]          # max cosine to anything picked so far
+    taken = np.zeros(n, dtype=bool)
+    taken[picked[0]] = True
+    while len(picked) < k:
+        mmr = lambda_mult * scores - (1.0 - lambda_mult) * redundancy
+        mmr[taken] = -np.inf
+        j = int(np.flatnonzero(mmr >= mmr.max() - _MMR_TIE_EPS)[0])
+        picked.append(j)
+        taken[j] = True
+        np.maximum(redundancy, unit @ unit[j], out=redundancy)
+    return picked
+
+def _history_messages(history_turns: List[Dict]) -> List[List[Dict]]:
+    """Stored turns ({"role", "text"}) → chat messages, one list per exchange."""
+    out: List[List[Dict]] = []
+    for t in history_turns:
+        role = "assistant" if t.get("role") == "assistant" else "user"
+        # text only: a turn's retrieved context is resent with that turn alone,
+        # otherwise two or three turns of context crowd all history out of the budget
+        msg = {"role": role, "content": t.get("text", "")}
+        if role == "user" or not out:
+            out.append([msg])
+        else:
+            out[-1].append(msg)
+    return out
+
+def _turns_from_str(history_prompt_str: str) -> List[Dict]:
+    # "User: …\nAssistant: …" (endpoints.format_history) → stored-turn dicts
+    turns = []
+    for t in split_turns(history_prompt_str):
+        role, _, text = t.partition(": ")
+        turns.append({"role": role.lower(), "text": text})
+    return turns
 
 # ─── Class wrapper so LangGraph / endpoints can import it ─────────────
 class RAGPipeline:
@@ -61,7 +165,17 @@ class RAGPipeline:
         chunk_overlap: int = DEFAULT_CHUNK_OVERLAP,
         retrieve_k: int = DEFAULT_RETRIEVE_K,
         score_threshold: Optional[float] = DEFAULT_SCORE_THRESHOLD,
+        retrieval_mode: str = DEFAULT_RETRIEVAL_MODE,
+        prompt_budget: int = PROMPT_TOKEN_BUDGET,
+        llm_api: str = DEFAULT_LLM_API,
+        vector_backend: str = VECTOR_BACKEND,
     ):
+        if retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"retrieval_mode must be one of {RETRIEVAL_MODES}, got {retrieval_mode!r}")
+        if llm_api not in LLM_APIS:
+            raise ValueError(f"llm_api must be one of {LLM_APIS}, got {llm_api!r}")
+        if vector_backend not in VECTOR_BACKENDS:
+            raise ValueError(f"vector_backend must be one of {VECTOR_BACKENDS}, got {vector_backend!r}")
         self.source_dir = source_dir
         self.persist_dir = persist_dir
         self.collection_name = collection_name
@@ -71,161 +185,770 @@ class RAGPipeline:
         self.chunk_overlap = chunk_overlap
         self.retrieve_k = retrieve_k
         self.score_threshold = score_threshold
+        self.retrieval_mode = retrieval_mode
+        self.prompt_budget = prompt_budget   # max prompt tokens (system prompt + history + context)
+        self.llm_api = llm_api
+        self.vector_backend = vector_backend   # chroma | mmap (see vector_store.py)
 
         # MMR knobs
-        self.fetch_k = 40         # candidate pool
-        self.lambda_mult = 0.5    # relevance (→1) vs diversity (→0)
+        self.fetch_k = DEFAULT_FETCH_K           # candidate pool
+        self.lambda_mult = DEFAULT_LAMBDA_MULT   # relevance (→1) vs diversity (→0)
         self.use_mmr = True
 
-        self._vectorstore: Optional[Chroma] = None
-        self._embedder = OllamaEmbeddings(model=self.embed_model, base_url=OLLAMA_BASE_URL)
+        self._vectorstore = None   # vector_store backend, opened on first use
+        self._manifest: Optional[Dict] = None
+        self._bm25: Optional[BM25Index] = None
+        self._vs_lock = threading.Lock()
+        self.semantic_cache: Optional[SemanticCache] = SemanticCache() if SEMANTIC_CACHE_ENABLED else None
+        # repeated queries / retries skip Ollama (embedding) and Chroma (MMR)
+        rc = _redis_client()
+        self._embed_cache = LRUCache("qemb", EMBED_CACHE_MAX, redis_client=rc)
+        self._retrieval_cache = LRUCache("retrieval", RETRIEVAL_CACHE_MAX, ttl=RETRIEVAL_CACHE_TTL, redis_client=rc)
+        # Chroma candidate pools (unit vectors, in process only): other k / lambda_mult / smaller fetch_k reuse them
+        self._candidate_cache = LRUCache("candidates", CANDIDATE_CACHE_MAX, ttl=RETRIEVAL_CACHE_TTL)
+        self._embedder_inst: Optional[OllamaEmbedder] = None
+        # concurrent identical queries (news-event bursts) share one embedding / one retrieval
+        self._embed_flight = SingleFlight("embed")
+        self._retrieval_flight = SingleFlight("retrieval")
+
+    @property
+    def _embedder(self) -> OllamaEmbedder:
+        if self._embedder_inst is None:
+            # pooled connections + retries/breaker, shared with generation (see ollama_http)
+            self._embedder_inst = OllamaEmbedder(self.embed_model, base_url=OLLAMA_BASE_URL)
+        return self._embedder_inst
 
     # ------- vector store -------
-    def _build_or_load_vectorstore(self, force_rebuild: bool = False) -> Chroma:
-        if not force_rebuild and is_chroma_cache_present(self.persist_dir):
-            print("Using cached ChromaDB index")
-            return Chroma(
-                persist_directory=self.persist_dir,
-                embedding_function=self._embedder,
-                collection_name=self.collection_name,
-            )
-
-        print("(Re)building ChromaDB index …")
-        docs = load_pdfs_from_folder(self.source_dir)
-
-        splitter = RecursiveCharacterTextSplitter(
+    def index_config(self) -> Dict:
+        """Everything that changes chunk text or vectors; a mismatch forces a rebuild."""
+        return {
+            "chunk_size": self.chunk_size,
+            "chunk_overlap": self.chunk_overlap,
+            "embed_model": self.embed_model,
+            "collection_name": self.collection_name,
+            "pdf_extraction": extraction_config(),   # fallback/OCR settings change chunk text
+            **backend_config(self.vector_backend),   # empty for Chroma: existing manifests stay valid
+        }
+
+    def _splitter(self) -> "RecursiveCharacterTextSplitter":
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+        return RecursiveCharacterTextSplitter(
             chunk_size=self.chunk_size,
             chunk_overlap=self.chunk_overlap,
+            add_start_index=True,   # lets prompt packing merge overlapping neighbours exactly
         )
-        split_docs = splitter.split_documents(docs)
-
-        vectorstore = Chroma.from_documents(
-            documents=split_docs,
-            embedding=self._embedder,
-            persist_directory=self.persist_dir,
-            collection_name=self.collection_name,
-            collection_metadata={"hnsw:space": "cosine"},
-        )
-        print(f"New ChromaDB index saved with {len(split_docs)} chunks")
+
+    @timed("index_sync")
+    def _build_or_load_vectorstore(self, force_rebuild: bool = False, **ingest_opts):
+        # one process at a time: N uvicorn workers start together, the first
+        # syncs, the rest wait for it and find nothing left to do
+        with index_lock(_abs(self.persist_dir)):
+            vectorstore = build_vector_backend(
+                self.vector_backend, _abs(self.persist_dir), self.collection_name, self._embedder,
+            )
+            # Embeds only new/changed PDFs, drops removed ones, rebuilds on config change
+            self._manifest = sync_index(
+                vectorstore,
+                source_dir=_abs(self.source_dir),
+                persist_dir=_abs(self.persist_dir),
+                config=self.index_config(),
+                splitter=self._splitter(),
+                force_rebuild=force_rebuild,
+                **ingest_opts,
+            )
+            # lexical index over the same chunk ids, rebuilt whenever the index version moves
+            self._bm25 = ensure_bm25(vectorstore, _abs(self.persist_dir), self.index_version)
+        # keys carry index_version too, but don't keep dead entries around
+        self._retrieval_cache.clear()
+        self._candidate_cache.clear()
         return vectorstore
 
-    def _ensure_vs(self, force_rebuild: bool = False) -> Chroma:
-        if self._vectorstore is None or force_rebuild:
-            self._vectorstore = self._build_or_load_vectorstore(force_rebuild)
-        return self._vectorstore
+    def _ensure_vs(self, force_rebuild: bool = False):
+        with self._vs_lock:
+            if self._vectorstore is None or force_rebuild:
+                self._vectorstore = self._build_or_load_vectorstore(force_rebuild)
+            return self._vectorstore
+
+    def ingest(self, force_rebuild: bool = False, **ingest_opts) -> Dict:
+        """
+        Sync the index with source_dir now (used by the embed_documents CLI).
+        ingest_opts: parse_workers, batch_size, concurrency (see ingest.ingest_files).
+        Returns the manifest.
+        """
+        with self._vs_lock:
+            self._vectorstore = self._build_or_load_vectorstore(force_rebuild, **ingest_opts)
+        return self._manifest
+
+    @property
+    def index_version(self) -> str:
+        """Fingerprint of the loaded index (config + file hashes)."""
+        return _index_version(self._manifest)
+
+    def cache_stats(self) -> Dict:
+        stats = {
+            "query_embeddings": self._embed_cache.stats(),
+            "retrieval": self._retrieval_cache.stats(),
+            "candidates": self._candidate_cache.stats(),
+        }
+        if self.semantic_cache is not None:
+            stats["semantic_answers"] = self.semantic_cache.stats()
+        return stats
 
     # ------- retrieval -------
-    def _similarity_with_scores(
-        self, vs: Chroma, query: str, k: int
-    ) -> List[Tuple[Document, float]]:
-        results = vs.similarity_search_with_relevance_scores(query, k=k)
-        if self.score_threshold is not None:
-            results = [(d, s) for (d, s) in results if s >= self.score_threshold]
-        return results
-
-    def _mmr_retrieve(self, vs: Chroma, query: str, k: int) -> List[Document]:
-        retriever = vs.as_retriever(
-            search_type="mmr",
-            search_kwargs={"k": k, "fetch_k": self.fetch_k, "lambda_mult": self.lambda_mult},
+    @timed("embed_query")
+    def _embed_query(self, query: str) -> np.ndarray:
+        key = (self.embed_model, normalize_query(query))
+        emb = self._embed_cache.get(key)
+        if emb is None:
+            emb = self._embed_flight.do(key, self._embed_uncached, key, query)
+        return np.asarray(emb, dtype=np.float32)
+
+    def _embed_uncached(self, key: tuple, query: str) -> List[float]:
+        emb = list(self._embedder.embed_query(query))
+        self._embed_cache.put(key, emb)
+        return emb
+
+    def _route(self, query: str) -> str:
+        """Which retriever serves this query: vector | bm25 | hybrid."""
+        if self.retrieval_mode == "hybrid" and is_lexical_query(query):
+            return "bm25"
+        return self.retrieval_mode
+
+    def _mmr_params(self, lambda_mult: Optional[float], fetch_k: Optional[int], k: int) -> Tuple[float, int]:
+        """Per-request MMR overrides → effective (lambda_mult, fetch_k)."""
+        lam = self.lambda_mult if lambda_mult is None else float(lambda_mult)
+        fk = self.fetch_k if fetch_k is None else int(fetch_k)
+        if not 0.0 <= lam <= 1.0:
+            raise ValueError(f"lambda_mult must be within [0, 1], got {lam}")
+        if not 1 <= fk <= MAX_FETCH_K:
+            raise ValueError(f"fetch_k must be within [1, {MAX_FETCH_K}], got {fk}")
+        return lam, max(fk, k)   # MMR needs at least k candidates
+
+    def _retrieval_key(self, query: str, k: int, route: str, mmr: Tuple[float, int]) -> tuple:
+        lam, fk = mmr
+        return (self.index_version, route, normalize_query(query), k, self.use_mmr, fk,
+                lam, self.score_threshold)
+
+    def _candidate_n(self, route: str, k: int, fetch_k: int) -> int:
+        return fetch_k if (self.use_mmr or route == "hybrid") else k
+
+    def _candidates(self, vs, query: str, q_emb: np.ndarray, n: int) -> Dict:
+        return self._candidates_batch(vs, [query], [q_emb], n)[0]
+
+    def _candidates_batch(self, vs, queries: List[str], q_embs: List[np.ndarray], n: int) -> List[Dict]:
+        """
+        The n nearest chunks per query, with their stored vectors (unit-normalized),
+        from the candidate cache or one vector-store query for all misses. A cached pool
+        of at least n candidates serves any smaller n too (results are
+        nearest-first, so a prefix is exact) — per-request lambda_mult/fetch_k
+        overrides re-rank without going back to the store.
+        """
+        out: List[Optional[Dict]] = [None] * len(queries)
+        miss = []
+        for i, q in enumerate(queries):
+            hit = self._candidate_cache.get((self.index_version, normalize_query(q)))
+            # fewer ids than asked for = the whole collection, enough for any n
+            if hit is not None and (hit["n"] >= n or len(hit["ids"]) < hit["n"]):
+                out[i] = _cand_prefix(hit, n)
+            else:
+                miss.append(i)
+        if miss:
+            fetched = self._query_candidates_batch(vs, [q_embs[i] for i in miss], n)
+            for i, cand in zip(miss, fetched):
+                self._candidate_cache.put((self.index_version, normalize_query(queries[i])), cand)
+                out[i] = cand
+        return out
+
+    @timed("chroma_query")
+    def _query_candidates_batch(self, vs, q_embs: List[np.ndarray], n: int) -> List[Dict]:
+        """
+        Pull the n nearest chunks *with their stored vectors* straight from the
+        vector store (one query call for all query vectors), so
+        nothing has to be re-embedded for scoring.
+        """
+        n_avail = min(n, vs.count())
+        if n_avail <= 0:
+            return [{"ids": [], "documents": [], "metadatas": [], "n": n,
+                     "unit": np.zeros((0, q.shape[0]), dtype=np.float32)} for q in q_embs]
+        res = vs.query(
+            query_embeddings=[q.tolist() for q in q_embs],
+            n_results=n_avail,
+            include=["documents", "metadatas", "embeddings"],
         )
-        return retriever.invoke(query)
-
-    def retrieve(self, query: str, *, k: Optional[int] = None, force_rebuild: bool = False) -> List[Dict]:
+        return [
+            {
+                "ids": res["ids"][j],
+                "documents": res["documents"][j],
+                "metadatas": res["metadatas"][j],
+                "unit": _unit_rows(np.asarray(res["embeddings"][j], dtype=np.float32)),
+                "n": n,
+            }
+            for j in range(len(q_embs))
+        ]
+
+    def _similarity_with_scores(self, cand: Dict, scores: np.ndarray, k: int) -> List[int]:
+        order = [int(i) for i in np.argsort(-scores)[:k]]
+        if self.score_threshold is not None:
+            order = [i for i in order if scores[i] >= self.score_threshold]
+        return order
+
+    @timed("mmr")
+    def _mmr_retrieve(self, cand: Dict, scores: np.ndarray, k: int, lambda_mult: float) -> List[int]:
+        return _mmr_select(cand["unit"], scores, k, lambda_mult)
+
+    @timed("bm25")
+    def _bm25_retrieve(self, query: str, k: int) -> List[Dict]:
+        # no embedding call at all; score = BM25 relative to the best hit (top = 1.0)
+        idx = self._bm25
+        hits = idx.search(query, k)
+        top = hits[0][1] if hits else 1.0
+        return [
+            self._format_chunk(i, idx.documents[j], idx.metadatas[j], s / top)
+            for i, (j, s) in enumerate(hits, 1)
+        ]
+
+    def _hybrid_retrieve(self, vs, query: str, q_emb: np.ndarray, k: int, cand: Dict,
+                         scores: np.ndarray) -> List[Dict]:
+        """Fuse the dense and the BM25 ranking (RRF); score = cosine similarity to the query."""
+        dense = [cand["ids"][i] for i in np.argsort(-scores)]
+        with stage("bm25"):
+            lexical = [self._bm25.ids[j] for j, _ in self._bm25.search(query, cand["n"])]
+        fused = rrf([dense, lexical])
+        top_ids = sorted(fused, key=fused.get, reverse=True)[:k]
+
+        rows = {cid: (cand["documents"][i], cand["metadatas"][i], float(scores[i]))
+                for i, cid in enumerate(cand["ids"])}
+        missing = [cid for cid in top_ids if cid not in rows]
+        if missing:
+            # BM25-only hits: one batched lookup of their stored vectors
+            got = vs.get(ids=missing, include=["documents", "metadatas", "embeddings"])
+            extra = _cosine_scores(q_emb, np.asarray(got["embeddings"], dtype=np.float32))
+            for cid, doc, meta, sc in zip(got["ids"], got["documents"], got["metadatas"], extra):
+                rows[cid] = (doc, meta, float(sc))
+        return [self._format_chunk(i, *rows[cid]) for i, cid in enumerate(top_ids, 1) if cid in rows]
+
+    @staticmethod
+    def _format_chunk(i: int, text: str, meta: Dict, score: float) -> Dict:
+        src = (meta or {}).get("source", "Unknown")
+        try:
+            source_name = Path(src).name
+        except Exception:
+            source_name = src
+        return {
+            "chunk_id": i,
+            "score": float(score),
+            "source": source_name,
+            "page": (meta or {}).get("page", "?"),
+            "content": text[:300] + "..." if len(text) > 300 else text,
+            "_full_content": text,
+            "_start": (meta or {}).get("start_index"),   # char offset in the page, for chunk merging
+        }
+
+    @timed("retrieve")
+    def retrieve(
+        self,
+        query: str,
+        *,
+        k: Optional[int] = None,
+        force_rebuild: bool = False,
+        q_emb: Optional[np.ndarray] = None,
+        lambda_mult: Optional[float] = None,
+        fetch_k: Optional[int] = None,
+    ) -> List[Dict]:
+        """
+        Top-k chunks for the query. lambda_mult / fetch_k override the
+        pipeline's MMR settings for this call only.
+        """
         vs = self._ensure_vs(force_rebuild)
         k = k or self.retrieve_k
-    
-    # Get documents
+        mmr = self._mmr_params(lambda_mult, fetch_k, k)
+
+        route = self._route(query)
+        key = self._retrieval_key(query, k, route, mmr)
+        chunks = self._retrieval_cache.get(key)
+        if chunks is None:
+            # an identical query already being retrieved: wait for its result
+            chunks = self._retrieval_flight.do(key, self._retrieve_uncached, vs, query, k, route, key, q_emb, mmr)
+
+        # hand out copies so callers can't mutate cached (or shared) entries
+        return [dict(c) for c in chunks]
+
+    def _retrieve_uncached(self, vs, query: str, k: int, route: str, key: tuple,
+                           q_emb: Optional[np.ndarray], mmr: Tuple[float, int]) -> List[Dict]:
+        if route == "bm25":
+            chunks = self._bm25_retrieve(query, k)
+            self._retrieval_cache.put(key, chunks)
+            return chunks
+
+        # Embed the query exactly once (or reuse the caller's); MMR and scoring both use it
+        if q_emb is None:
+            q_emb = self._embed_query(query)
+        cand = self._candidates(vs, query, q_emb, self._candidate_n(route, k, mmr[1]))
+        chunks = self._rank(vs, query, q_emb, k, route, cand, mmr[0])
+        self._retrieval_cache.put(key, chunks)
+        return chunks
+
+    def _rank(self, vs, query: str, q_emb: np.ndarray, k: int, route: str, cand: Dict,
+              lambda_mult: float) -> List[Dict]:
+        """Candidates → the k chunks handed out (MMR, plain similarity or RRF with BM25)."""
+        # candidate rows are unit vectors: cosine = one matrix-vector product
+        scores = cand["unit"] @ _unit_rows(q_emb[None, :])[0]
+        if route == "hybrid":
+            return self._hybrid_retrieve(vs, query, q_emb, k, cand, scores)
+
         if self.use_mmr:
-            docs = self._mmr_retrieve(vs, query, k)
+            picked = self._mmr_retrieve(cand, scores, k, lambda_mult)
         else:
-            docs = [d for (d, _) in self._similarity_with_scores(vs, query, k)]
-    
-        # Format into chunks with scores
-        q_emb = self._embedder.embed_query(query)
-        chunks = []
-        for i, d in enumerate(docs, 1):
-            src = d.metadata.get("source", "Unknown")
-            try:
-                source_name = Path(src).name
-            except Exception:
-                source_name = src
-        
-            d_emb = self._embedder.embed_query(d.page_content[:2000])
-            score = _cosine(q_emb, d_emb)
-        
-            chunks.append({
-                "chunk_id": i,
-                "score": float(score),
-                "source": source_name,
-                "page": d.metadata.get("page", "?"),
-                "content": d.page_content[:300] + "..." if len(d.page_content) > 300 else d.page_content,
-                "_full_content": d.page_content
-            })
-    
-        return chunks
+            picked = self._similarity_with_scores(cand, scores, k)
+
+        # score = the cosine similarity MMR/similarity actually ranked on
+        return [
+            self._format_chunk(i, cand["documents"][idx], cand["metadatas"][idx], scores[idx])
+            for i, idx in enumerate(picked, 1)
+        ]
+
+    # ------- batches -------
+    def _embed_batch(self, queries: List[str]) -> List[Optional[np.ndarray]]:
+        """
+        Query embeddings for many queries: cached ones from the embed cache, all
+        others in one Ollama call (per BATCH_MAX_QUERIES). BM25-routed queries
+        get None, like everywhere else they never need a vector.
+        """
+        out: List[Optional[np.ndarray]] = [None] * len(queries)
+        todo: Dict[tuple, List[int]] = {}   # embed cache key → positions (duplicates embed once)
+        for i, q in enumerate(queries):
+            if self._route(q) == "bm25":
+                continue
+            key = (self.embed_model, normalize_query(q))
+            emb = self._embed_cache.get(key)
+            if emb is not None:
+                out[i] = np.asarray(emb, dtype=np.float32)
+            else:
+                todo.setdefault(key, []).append(i)
+
+        keys = list(todo)
+        for s in range(0, len(keys), BATCH_MAX_QUERIES):
+            part = keys[s:s + BATCH_MAX_QUERIES]
+            with stage("embed_query"):
+                vecs = self._embedder.embed_documents([queries[todo[key][0]] for key in part])
+            for key, vec in zip(part, vecs):
+                self._embed_cache.put(key, list(vec))
+                arr = np.asarray(vec, dtype=np.float32)
+                for i in todo[key]:
+                    out[i] = arr
+        return out
+
+    @timed("retrieve_batch")
+    def retrieve_batch(
+        self,
+        queries: List[str],
+        *,
+        k: Optional[int] = None,
+        force_rebuild: bool = False,
+        lambda_mult: Optional[float] = None,
+        fetch_k: Optional[int] = None,
+    ) -> List[List[Dict]]:
+        """
+        retrieve() for many queries at once, results in input order. Uncached
+        queries are embedded in one Ollama call and looked up with one Chroma
+        query carrying all their vectors; cached and repeated queries are free.
+        """
+        vs = self._ensure_vs(force_rebuild)
+        k = k or self.retrieve_k
+        mmr = self._mmr_params(lambda_mult, fetch_k, k)
+
+        results: List[Optional[List[Dict]]] = [None] * len(queries)
+        todo: Dict[tuple, Tuple[str, List[int]]] = {}   # retrieval key → (route, positions)
+        for i, q in enumerate(queries):
+            route = self._route(q)
+            key = self._retrieval_key(q, k, route, mmr)
+            chunks = self._retrieval_cache.get(key)
+            if chunks is not None:
+                results[i] = chunks
+            else:
+                todo.setdefault(key, (route, []))[1].append(i)
+
+        dense = []   # (key, route, first position)
+        for key, (route, pos) in todo.items():
+            if route == "bm25":
+                chunks = self._bm25_retrieve(queries[pos[0]], k)
+                self._retrieval_cache.put(key, chunks)
+                for i in pos:
+                    results[i] = chunks
+            else:
+                dense.append((key, route, pos[0]))
+
+        if dense:
+            qs = [queries[i] for _, _, i in dense]
+            q_embs = self._embed_batch(qs)
+            n = max(self._candidate_n(route, k, mmr[1]) for _, route, _ in dense)
+            cands = self._candidates_batch(vs, qs, q_embs, n)
+            for (key, route, i), q_emb, cand in zip(dense, q_embs, cands):
+                cand = _cand_prefix(cand, self._candidate_n(route, k, mmr[1]))
+                chunks = self._rank(vs, queries[i], q_emb, k, route, cand, mmr[0])
+                self._retrieval_cache.put(key, chunks)
+                for j in todo[key][1]:
+                    results[j] = chunks
+
+        # copies, as in retrieve()
+        return [[dict(c) for c in r] for r in results]
+
+    # ------- prompt assembly -------
+    @staticmethod
+    def _context_part(chunk: Dict) -> str:
+        src = chunk["source"]
+        year_info = ""
+        if "2025" in src: year_info = " (2025)"
+        elif "2024" in src: year_info = " (2024)"
+        elif "2023" in src: year_info = " (2023)"
+        full_content = chunk.get("_full_content", chunk["content"])
+        return f"[Quelle {chunk['chunk_id']} | {src}{year_info} | Seite {chunk['page']}]\n{full_content}"
+
+    @staticmethod
+    def _user_message(context_block: str, user_query: str) -> str:
+        return f"""## VERFÜGBARE INFORMATIONEN:
+{context_block}
+
+## BENUTZER FRAGT:
+{user_query}
+
+## ANTWORT:
+Bitte antworte vollständig und füge am ENDE eine Liste der verwendeten Quellen hinzu."""
+
+    @classmethod
+    def _render_prompt(cls, system_prompt: str, history_block: str, context_block: str, user_query: str) -> str:
+        return f"{system_prompt}\n\n{CITATION_RULE}\n\n{history_block}{cls._user_message(context_block, user_query)}"
+
+    def _pack(self, retrieved_chunks: List[Dict], history, fixed: int,
+              history_slack: int = 0, keep_turns: int = 0):
+        # Merge overlapping chunks, then fit history + context into the token budget
+        # (oldest history turns go first, then the lowest-ranked chunks)
+        if not retrieved_chunks:
+            print("WARNING: No relevant documents found!")
+        packed = pack_context(
+            retrieved_chunks, history,
+            fixed_tokens=fixed, format_chunk=self._context_part, budget=self.prompt_budget,
+            history_slack=history_slack, keep_turns=keep_turns,
+        )
+        note = ""
+        if packed.dropped_turns or packed.dropped_chunks or len(packed.chunks) < len(retrieved_chunks):
+            note = (f" ({len(retrieved_chunks)} chunks → {len(packed.chunks)}, "
+                    f"{packed.dropped_turns} history turns dropped)")
+        print(f"Prompt tokens: {packed.tokens} / budget {self.prompt_budget}{note}")
+        context_block = "\n\n".join(self._context_part(c) for c in packed.chunks)
+        return packed, context_block or "Keine relevanten Dokumente gefunden."
+
+    @timed("prompt_build")
+    def _build_prompt(
+        self,
+        user_query: str,
+        retrieved_chunks: List[Dict],
+        system_prompt: str,
+        history_prompt_str: str = "",
+    ) -> str:
+        """One flat prompt string for /api/generate (llm_api="generate")."""
+        fixed = count_tokens(self._render_prompt(system_prompt, "", "", user_query))
+        packed, context_block = self._pack(retrieved_chunks, history_prompt_str, fixed, keep_turns=2)
+        history_block = f"{packed.history}\n\n" if packed.history else ""
+        return self._render_prompt(system_prompt, history_block, context_block, user_query)
+
+    @timed("prompt_build")
+    def _build_messages(
+        self,
+        user_query: str,
+        retrieved_chunks: List[Dict],
+        system_prompt: str,
+        history_turns: List[Dict],
+    ) -> Tuple[List[Dict], int]:
+        """
+        /api/chat messages, most stable first: system prompt, then earlier
+        turns as plain question/answer text, then this turn's context +
+        question. Everything before the last exchange is a prefix of the
+        previous request, so Ollama only prefills the last exchange and the
+        new user message. The last exchange is never dropped. Returns
+        (messages, number of history messages kept).
+        """
+        system = f"{system_prompt}\n\n{CITATION_RULE}"
+        exchanges = _history_messages(history_turns)
+        fixed = count_tokens(system) + count_tokens(self._user_message("", user_query))
+        # cut history in one bigger step so the next few turns keep the same prefix
+        packed, context_block = self._pack(
+            retrieved_chunks, ["\n".join(m["content"] for m in ex) for ex in exchanges],
+            fixed, history_slack=self.prompt_budget // 4, keep_turns=1,
+        )
+        kept = [m for ex in exchanges[packed.dropped_turns:] for m in ex]
+        messages = [{"role": "system", "content": system}, *kept,
+                    {"role": "user", "content": self._user_message(context_block, user_query)}]
+        return messages, len(kept)
+
+    def _llm_prompt(
+        self,
+        user_query: str,
+        retrieved_chunks: List[Dict],
+        system_prompt: str,
+        history_prompt_str: str,
+        history_turns: Optional[List[Dict]],
+    ) -> Tuple[object, Dict]:
+        """
+        (prompt for ollama_client, extra result fields). In chat mode the extras
+        tell the caller what to store: "history_kept" is how many history
+        messages are still in the prompt.
+        """
+        if self.llm_api == "generate":
+            return self._build_prompt(user_query, retrieved_chunks, system_prompt, history_prompt_str), {}
+        if history_turns is None:
+            history_turns = _turns_from_str(history_prompt_str)
+        messages, kept = self._build_messages(user_query, retrieved_chunks, system_prompt, history_turns)
+        return messages, {"history_kept": kept}
+
+    @staticmethod
+    def _public_chunks(retrieved_chunks: List[Dict]) -> List[Dict]:
+        # Remove internal fields (_full_content, _start) before returning
+        return [
+            {k: v for k, v in chunk.items() if not k.startswith("_")}
+            for chunk in retrieved_chunks
+        ]
+
+    # ------- semantic answer cache -------
+    def _cache_lookup(
+        self, user_query: str, history_prompt_str: str, system_prompt: str,
+        mmr: Optional[Tuple[float, int]] = None,
+    ) -> Tuple[Optional[np.ndarray], Optional[tuple], Optional[Dict]]:
+        """
+        Returns (query embedding, scope, cached result). Follow-up turns bypass
+        the cache (their answer depends on the conversation), as do BM25-routed
+        queries, per-request MMR overrides and a disabled cache; then all three
+        are None.
+        """
+        if self.semantic_cache is None or history_prompt_str or self._route(user_query) == "bm25":
+            # lexical-only queries must not pay for an embedding call either
+            return None, None, None
+        if mmr is not None and mmr != self._mmr_params(None, None, self.retrieve_k):
+            # answers retrieved with other MMR settings must not be served for the
+            # defaults, and scopes of their own would evict the default scope (_MAX_SCOPES)
+            return None, None, None
+        q_emb = self._embed_query(user_query)
+        prompt_id = hashlib.sha1(system_prompt.encode("utf-8")).hexdigest()[:8]
+        scope = (self.index_version, self.chat_model, prompt_id)
+        with stage("semantic_cache"):
+            hit = self.semantic_cache.lookup(q_emb, scope)
+        if hit:
+            print(f"Semantic cache hit ({hit['similarity']:.3f}): {hit['query']!r}")
+        return q_emb, scope, hit
+
+    def _cache_store(self, q_emb, scope, user_query: str, response: str, chunks: List[Dict]) -> None:
+        if q_emb is not None and response:
+            self.semantic_cache.put(q_emb, scope, user_query, response, chunks)
 
     # ------- end-to-end -------
+    @timed("generate")
     def generate(
         self,
         user_query: str,
         *,
         history_prompt_str: str = "",
+        history_turns: Optional[List[Dict]] = None,
         system_prompt_str: Optional[str] = None,
         force_rebuild: bool = False,
+        lambda_mult: Optional[float] = None,
+        fetch_k: Optional[int] = None,
     ) -> Dict:
         system_prompt = system_prompt_str or load_system_prompt()
-        vs = self._ensure_vs(force_rebuild)
+        self._ensure_vs(force_rebuild)
+        mmr = self._mmr_params(lambda_mult, fetch_k, self.retrieve_k)
 
-      
+        q_emb, scope, hit = self._cache_lookup(user_query, history_prompt_str, system_prompt, mmr)
+        if hit:
+            return {"response": hit["response"], "chunks": hit["chunks"]}
 
-        
-        # 2) Retrieve formatted chunks (already has scores)
-        retrieved_chunks = self.retrieve(user_query, k=self.retrieve_k)
+        retrieved_chunks = self.retrieve(user_query, k=self.retrieve_k, q_emb=q_emb,
+                                         lambda_mult=lambda_mult, fetch_k=fetch_k)
+        prompt, extra = self._llm_prompt(user_query, retrieved_chunks, system_prompt,
+                                         history_prompt_str, history_turns)
 
-        # 3) Context block
-        if not retrieved_chunks:
-            print("WARNING: No relevant documents found!")
-            context_block = "Keine relevanten Dokumente gefunden."
-        else:
-            parts: List[str] = []
-            for chunk in retrieved_chunks:
-                src = chunk["source"]
-                page = chunk["page"]
-                full_content = chunk.get("_full_content", chunk["content"])
-                year_info = ""
-                if "2025" in src: year_info = " (2025)"
-                elif "2024" in src: year_info = " (2024)"
-                elif "2023" in src: year_info = " (2023)"
-                parts.append(f"[Quelle {chunk['chunk_id']} | {src}{year_info} | Seite {page}]\n{full_content}")
-            
-            context_block = "\n\n".join(parts)
-
-        history_block = f"{history_prompt_str}\n\n" if history_prompt_str else ""
-
-        final_prompt = f"""{system_prompt}
-
-WICHTIG: Zitiere Quellen am ENDE deiner Antwort im Format: [Dokumentname, Seite X]
-
-{history_block}## VERFÜGBARE INFORMATIONEN:
-{context_block}
+        llm_response = ask_ollama(prompt, model=self.chat_model)
+        chunks = self._public_chunks(retrieved_chunks)
+        self._cache_store(q_emb, scope, user_query, llm_response, chunks)
+        return {"response": llm_response, "chunks": chunks, **extra}
 
-## BENUTZER FRAGT:
-{user_query}
+    @timed("generate")
+    async def agenerate(
+        self,
+        user_query: str,
+        *,
+        history_prompt_str: str = "",
+        history_turns: Optional[List[Dict]] = None,
+        system_prompt_str: Optional[str] = None,
+        force_rebuild: bool = False,
+        lambda_mult: Optional[float] = None,
+        fetch_k: Optional[int] = None,
+    ) -> Dict:
+        """
+        Async generate(): Chroma/embedding work runs on the worker pool, the
+        LLM call goes through the pooled async client. Nothing blocks the loop.
+        """
+        system_prompt = system_prompt_str or load_system_prompt()
+        await run_in_pool(self._ensure_vs, force_rebuild)
+        mmr = self._mmr_params(lambda_mult, fetch_k, self.retrieve_k)
 
-## ANTWORT:
-Bitte antworte vollständig und füge am ENDE eine Liste der verwendeten Quellen hinzu."""
-        estimated_tokens = int(len(final_prompt.split()) * 1.3)
-        print(f"Estimated prompt tokens: {estimated_tokens}")
-
-        llm_response = ask_ollama(final_prompt, model=self.chat_model)
-    
-       # Remove internal field before returning
-        returned_chunks = [
-            {k: v for k, v in chunk.items() if k != "_full_content"}
-            for chunk in retrieved_chunks
-    ]
-    
-        return {"response": llm_response, "chunks": returned_chunks}
+        q_emb, scope, hit = await run_in_pool(self._cache_lookup, user_query, history_prompt_str, system_prompt, mmr)
+        if hit:
+            return {"response": hit["response"], "chunks": hit["chunks"]}
+
+        retrieved_chunks = await run_in_pool(self.retrieve, user_query, k=self.retrieve_k, q_emb=q_emb,
+                                             lambda_mult=lambda_mult, fetch_k=fetch_k)
+        prompt, extra = self._llm_prompt(user_query, retrieved_chunks, system_prompt,
+                                         history_prompt_str, history_turns)
+
+        llm_response = await ask_ollama_async(prompt, model=self.chat_model)
+        chunks = self._public_chunks(retrieved_chunks)
+        self._cache_store(q_emb, scope, user_query, llm_response, chunks)
+        return {"response": llm_response, "chunks": chunks, **extra}
+
+    def generate_stream(
+        self,
+        user_query: str,
+        *,
+        history_prompt_str: str = "",
+        history_turns: Optional[List[Dict]] = None,
+        system_prompt_str: Optional[str] = None,
+        force_rebuild: bool = False,
+        lambda_mult: Optional[float] = None,
+        fetch_k: Optional[int] = None,
+    ) -> Iterator[Dict]:
+        """
+        Streaming variant of generate(). Yields events in order:
+          {"type": "chunks", "chunks": [...]}      once, right after retrieval
+          {"type": "token",  "text": "..."}        per piece Ollama emits
+          {"type": "done",   "response": "..."}    full answer at the end
+                                                   (+ history_kept in chat mode)
+        """
+        system_prompt = system_prompt_str or load_system_prompt()
+        self._ensure_vs(force_rebuild)
+        mmr = self._mmr_params(lambda_mult, fetch_k, self.retrieve_k)
+
+        q_emb, scope, hit = self._cache_lookup(user_query, history_prompt_str, system_prompt, mmr)
+        if hit:
+            yield {"type": "chunks", "chunks": hit["chunks"]}
+            yield {"type": "token", "text": hit["response"]}
+            yield {"type": "done", "response": hit["response"]}
+            return
+
+        retrieved_chunks = self.retrieve(user_query, k=self.retrieve_k, q_emb=q_emb,
+                                         lambda_mult=lambda_mult, fetch_k=fetch_k)
+        chunks = self._public_chunks(retrieved_chunks)
+        yield {"type": "chunks", "chunks": chunks}
+
+        prompt, extra = self._llm_prompt(user_query, retrieved_chunks, system_prompt,
+                                         history_prompt_str, history_turns)
+        pieces: List[str] = []
+        for piece in stream_ollama(prompt, model=self.chat_model):
+            pieces.append(piece)
+            yield {"type": "token", "text": piece}
+
+        response = "".join(pieces).strip()
+        self._cache_store(q_emb, scope, user_query, response, chunks)
+        yield {"type": "done", "response": response, **extra}
+
+    # ------- batch generation -------
+    def _batch_plan(self, queries: List[str], system_prompt: str,
+                    lambda_mult: Optional[float] = None, fetch_k: Optional[int] = None,
+                    ) -> Tuple[List[Dict], List[Dict]]:
+        """
+        Blocking half of a batch: one embedding call, semantic-cache lookups,
+        one retrieval pass. Returns (finished items, jobs that still need the LLM).
+        """
+        mmr = self._mmr_params(lambda_mult, fetch_k, self.retrieve_k)
+        self._embed_batch(queries)   # fills the embed cache; _cache_lookup below hits it
+        done, jobs = [], []
+        for i, q in enumerate(queries):
+            q_emb, scope, hit = self._cache_lookup(q, "", system_prompt, mmr)
+            if hit:
+                done.append({"index": i, "query": q, "response": hit["response"], "chunks": hit["chunks"]})
+            else:
+                jobs.append({"index": i, "query": q, "q_emb": q_emb, "scope": scope})
+        for job, retrieved in zip(jobs, self.retrieve_batch([j["query"] for j in jobs],
+                                                                  lambda_mult=lambda_mult, fetch_k=fetch_k)):
+            job["prompt"], _ = self._llm_prompt(job["query"], retrieved, system_prompt, "", [])
+            job["chunks"] = self._public_chunks(retrieved)
+        return done, jobs
+
+    def _batch_item(self, job: Dict, response: Optional[str] = None, error: Optional[Exception] = None) -> Dict:
+        item = {"index": job["index"], "query": job["query"]}
+        if error is not None:
+            return {**item, "error": str(error)}
+        self._cache_store(job["q_emb"], job["scope"], job["query"], response, job["chunks"])
+        return {**item, "response": response, "chunks": job["chunks"]}
+
+    def generate_batch(
+        self,
+        queries: List[str],
+        *,
+        system_prompt_str: Optional[str] = None,
+        concurrency: int = BATCH_CONCURRENCY,
+        lambda_mult: Optional[float] = None,
+        fetch_k: Optional[int] = None,
+    ) -> Iterator[Dict]:
+        """
+        Answers for a list of independent questions (no history, e.g. claims to
+        fact-check), yielded as each finishes — match them up by "index":
+          {"index", "query", "response", "chunks"}   or   {"index", "query", "error"}
+        Embedding and retrieval run once for the whole list (see retrieve_batch),
+        then at most `concurrency` generations are in flight. One failing item
+        doesn't stop the others.
+        """
+        system_prompt = system_prompt_str or load_system_prompt()
+        self._ensure_vs()
+        done, jobs = self._batch_plan(list(queries), system_prompt, lambda_mult, fetch_k)
+        yield from done
+
+        def one(job):
+            try:
+                return self._batch_item(job, ask_ollama(job["prompt"], model=self.chat_model))
+            except Exception as e:
+                return self._batch_item(job, error=e)
+
+        with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="rag-batch") as ex:
+            futures = [ex.submit(contextvars.copy_context().run, one, job) for job in jobs]
+            try:
+                for fut in as_completed(futures):
+                    yield fut.result()
+            finally:
+                for fut in futures:   # consumer stopped early: don't start the rest
+                    fut.cancel()
+
+    async def agenerate_batch(
+        self,
+        queries: List[str],
+        *,
+        system_prompt_str: Optional[str] = None,
+        concurrency: int = BATCH_CONCURRENCY,
+        lambda_mult: Optional[float] = None,
+        fetch_k: Optional[int] = None,
+    ) -> AsyncIterator[Dict]:
+        """Async generate_batch(): same items, LLM calls on the pooled async client."""
+        system_prompt = system_prompt_str or load_system_prompt()
+        await run_in_pool(self._ensure_vs)
+        done, jobs = await run_in_pool(self._batch_plan, list(queries), system_prompt, lambda_mult, fetch_k)
+        for item in done:
+            yield item
+
+        sem = asyncio.Semaphore(max(1, concurrency))
+
+        async def one(job):
+            async with sem:
+                try:
+                    return self._batch_item(job, await ask_ollama_async(job["prompt"], model=self.chat_model))
+                except Exception as e:
+                    return self._batch_item(job, error=e)
+
+        tasks = [asyncio.ensure_future(one(job)) for job in jobs]
+        try:
+            for fut in asyncio.as_completed(tasks):
+                yield await fut
+        finally:
+            for t in tasks:   # client went away: drop what hasn't run yet
+                t.cancel()
 
 
 # --- Compatibility shim: keep old imports working ---
@@ -239,13 +962,62 @@ def run_rag_pipeline(
     *,
     force_rebuild: bool = False,
     history_prompt_str: str = "",
+    history_turns: Optional[List[Dict]] = None,
     system_prompt_str: str | None = None,
+    lambda_mult: Optional[float] = None,
+    fetch_k: Optional[int] = None,
 ):
     """Back-compat: delegate legacy function to the class API."""
     return _GLOBAL_PIPELINE.generate(
         user_query=user_query,
         force_rebuild=force_rebuild,
         history_prompt_str=history_prompt_str,
+        history_turns=history_turns,
+        system_prompt_str=system_prompt_str,
+        lambda_mult=lambda_mult,
+        fetch_k=fetch_k,
+    )
+
+async def arun_rag_pipeline(
+    user_query: str,
+    *,
+    force_rebuild: bool = False,
+    history_prompt_str: str = "",
+    history_turns: Optional[List[Dict]] = None,
+    system_prompt_str: str | None = None,
+    lambda_mult: Optional[float] = None,
+    fetch_k: Optional[int] = None,
+):
+    """Async counterpart of run_rag_pipeline (see RAGPipeline.agenerate)."""
+    return await _GLOBAL_PIPELINE.agenerate(
+        user_query=user_query,
+        force_rebuild=force_rebuild,
+        history_prompt_str=history_prompt_str,
+        history_turns=history_turns,
         system_prompt_str=system_prompt_str,
+        lambda_mult=lambda_mult,
+        fetch_k=fetch_k,
+    )
+
+def run_rag_pipeline_stream(
+    user_query: str,
+    *,
+    force_rebuild: bool = False,
+    history_prompt_str: str = "",
+    history_turns: Optional[List[Dict]] = None,
+    system_prompt_str: str | None = None,
+    lambda_mult: Optional[float] = None,
+    fetch_k: Optional[int] = None,
+):
+    """Streaming counterpart of run_rag_pipeline (see RAGPipeline.generate_stream)."""
+    return _GLOBAL_PIPELINE.generate_stream(
+        user_query=user_query,
+        force_rebuild=force_rebuild,
+        history_prompt_str=history_prompt_str,
+        history_turns=history_turns,
+        system_prompt_str=system_prompt_str,
+        lambda_mult=lambda_mult,
+        fetch_k=fetch_k,
     )
 # --- end shim ---
+
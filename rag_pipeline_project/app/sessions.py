@@ -0,0 +1,213 @@
+# app/sessions.py
+"""
+Chat history per session.
+
+RedisSessionStore
+  chat:{id}       list, one JSON turn per item ({"role", "text"})
+  chat:{id}:ctx   chat mode: how many trailing turns are still in the model's
+                  prompt (older ones come back from load() marked "dropped",
+                  see endpoints.append_turn)
+  chat:sessions   sorted set, session id → last activity (unix time)
+  Appending a turn is RPUSH + LTRIM + EXPIRE + SET + ZADD in one MULTI
+  pipeline, i.e. one round trip; load() is LRANGE + GET, also one. Counting
+  active sessions is a ZCOUNT on the sorted set, O(log n), instead of a SCAN
+  over every key.
+MemorySessionStore
+  Same interface in a dict, for tests and single-process runs without Redis.
+
+SESSION_STORE=redis (default) | memory.
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+SESSION_STORE = os.getenv("SESSION_STORE", "redis")
+REDIS_URL     = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+HISTORY_TTL   = int(os.getenv("SESSION_TTL", str(60 * 60 * 24)))   # seconds since last turn
+
+_PREFIX = "chat:"
+_INDEX  = "chat:sessions"
+
+
+def _mark_dropped(turns: List[Dict], active: Optional[int]) -> List[Dict]:
+    if active is not None and active < len(turns):
+        for t in turns[:len(turns) - active]:
+            t["dropped"] = True
+    return turns
+
+
+class RedisSessionStore:
+    def __init__(self, url: str = REDIS_URL, ttl: int = HISTORY_TTL):
+        self.url = url
+        self.ttl = ttl
+        self._r = None    # sync client, created on first use
+        self._ar = None   # async client used by the routes, created on first use
+
+    # ----- clients -----
+    def _redis(self):
+        if self._r is None:
+            import redis
+            self._r = redis.from_url(self.url)
+        return self._r
+
+    def _aredis(self):
+        if self._ar is None:
+            import redis.asyncio as aioredis
+            self._ar = aioredis.from_url(self.url)
+        return self._ar
+
+    async def aclose(self) -> None:
+        if self._ar is not None:
+            await self._ar.aclose()
+            self._ar = None
+
+    # ----- commands (same calls on sync and async pipelines) -----
+    @staticmethod
+    def _keys(session_id: str):
+        k = _PREFIX + session_id
+        return k, k + ":ctx"
+
+    def _queue_load(self, pipe, session_id: str):
+        key, ctx = self._keys(session_id)
+        pipe.lrange(key, 0, -1)
+        pipe.get(ctx)
+
+    @staticmethod
+    def _parse_load(raw, ctx) -> List[Dict]:
+        turns = [json.loads(x) for x in raw]
+        return _mark_dropped(turns, int(ctx) if ctx is not None else None)
+
+    def _queue_append(self, pipe, session_id: str, turns: List[Dict], active: Optional[int], max_items: int,
+                      replace: bool = False):
+        key, ctx = self._keys(session_id)
+        now = time.time()
+        if replace:
+            pipe.delete(key)
+        if turns:
+            pipe.rpush(key, *(json.dumps(t, ensure_ascii=False) for t in turns))
+        pipe.ltrim(key, -max_items, -1)
+        pipe.expire(key, self.ttl)
+        if active is not None:
+            pipe.set(ctx, active, ex=self.ttl)
+        else:
+            pipe.delete(ctx)
+        pipe.zadd(_INDEX, {session_id: now})
+        pipe.zremrangebyscore(_INDEX, "-inf", now - self.ttl)   # expired sessions, amortized
+
+    def _queue_clear(self, pipe, session_id: str):
+        pipe.delete(*self._keys(session_id))
+        pipe.zrem(_INDEX, session_id)
+
+    # ----- sync -----
+    def load(self, session_id: str) -> List[Dict]:
+        pipe = self._redis().pipeline(transaction=False)
+        self._queue_load(pipe, session_id)
+        return self._parse_load(*pipe.execute())
+
+    def append(self, session_id: str, turns: List[Dict], *, active: Optional[int] = None,
+               max_items: int = 10, replace: bool = False) -> None:
+        pipe = self._redis().pipeline(transaction=True)
+        self._queue_append(pipe, session_id, turns, active, max_items, replace)
+        pipe.execute()
+
+    def clear(self, session_id: str) -> None:
+        pipe = self._redis().pipeline(transaction=True)
+        self._queue_clear(pipe, session_id)
+        pipe.execute()
+
+    def count(self) -> int:
+        return int(self._redis().zcount(_INDEX, time.time() - self.ttl, "+inf"))
+
+    # ----- async -----
+    async def aload(self, session_id: str) -> List[Dict]:
+        pipe = self._aredis().pipeline(transaction=False)
+        self._queue_load(pipe, session_id)
+        return self._parse_load(*(await pipe.execute()))
+
+    async def aappend(self, session_id: str, turns: List[Dict], *, active: Optional[int] = None,
+                      max_items: int = 10, replace: bool = False) -> None:
+        pipe = self._aredis().pipeline(transaction=True)
+        self._queue_append(pipe, session_id, turns, active, max_items, replace)
+        await pipe.execute()
+
+    async def aclear(self, session_id: str) -> None:
+        pipe = self._aredis().pipeline(transaction=True)
+        self._queue_clear(pipe, session_id)
+        await pipe.execute()
+
+    async def acount(self) -> int:
+        return int(await self._aredis().zcount(_INDEX, time.time() - self.ttl, "+inf"))
+
+    async def aping(self) -> None:
+        await self._aredis().ping()
+
+
+class MemorySessionStore:
+    """In-process store; state is lost on restart and not shared between workers."""
+
+    def __init__(self, ttl: int = HISTORY_TTL):
+        self.ttl = ttl
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()   # id → (last activity, turns, active)
+        self._lock = threading.Lock()
+
+    def _expire(self, now: float) -> None:
+        # least recently active first, so expired sessions are always at the front
+        while self._data:
+            sid, (ts, _, _) = next(iter(self._data.items()))
+            if now - ts <= self.ttl:
+                break
+            del self._data[sid]
+
+    def load(self, session_id: str) -> List[Dict]:
+        with self._lock:
+            self._expire(time.time())
+            _, turns, active = self._data.get(session_id, (0, [], None))
+            return _mark_dropped([dict(t) for t in turns], active)
+
+    def append(self, session_id: str, turns: List[Dict], *, active: Optional[int] = None,
+               max_items: int = 10, replace: bool = False) -> None:
+        with self._lock:
+            now = time.time()
+            self._expire(now)
+            _, old, _ = self._data.pop(session_id, (0, [], None))
+            kept = [] if replace else old
+            self._data[session_id] = (now, (kept + [dict(t) for t in turns])[-max_items:], active)
+
+    def clear(self, session_id: str) -> None:
+        with self._lock:
+            self._data.pop(session_id, None)
+
+    def count(self) -> int:
+        with self._lock:
+            self._expire(time.time())
+            return len(self._data)
+
+    # async twins: nothing here blocks
+    async def aload(self, session_id: str) -> List[Dict]:
+        return self.load(session_id)
+
+    async def aappend(self, session_id: str, turns: List[Dict], **kwargs) -> None:
+        self.append(session_id, turns, **kwargs)
+
+    async def aclear(self, session_id: str) -> None:
+        self.clear(session_id)
+
+    async def acount(self) -> int:
+        return self.count()
+
+    async def aping(self) -> None:
+        pass
+
+    async def aclose(self) -> None:
+        pass
+
+
+def build_session_store(kind: str = SESSION_STORE):
+    if kind == "redis":
+        return RedisSessionStore()
+    if kind == "memory":
+        return MemorySessionStore()
+    raise ValueError(f"SESSION_STORE must be redis or memory, got {kind!r}")
@@ -0,0 +1,190 @@
+# app/singleflight.py
+"""
+Request coalescing ("single flight"): concurrent callers that need the same
+result share one in-flight computation instead of each doing it.
+
+Right after a news event many sessions ask the same question within seconds.
+Each of them would embed the query, query Chroma and run a full generation;
+the Redis answer cache in ollama_client only helps once the first generation
+has finished. With coalescing the first caller (the leader) does the work and
+everyone who asks for the same key meanwhile waits for its result.
+
+Used at three layers (label "layer" on the metrics):
+  embed      RAGPipeline._embed_query   key: (embed model, query)
+  retrieval  RAGPipeline.retrieve       key: _retrieval_key (index version, route, query, k, MMR knobs)
+  llm        ask_ollama / ask_ollama_async / stream_ollama
+             key: the answer-cache key (model + the exact prompt, which
+             already contains the retrieved context and the question)
+
+Only work that is *in flight* is shared: once the leader is done its key is
+gone and the next caller goes through the caches as before. Errors are shared
+too — a failing Ollama fails every waiter once instead of N times.
+
+  SingleFlight.do(key, fn, ...)      threads (WORKER_POOL, sync callers)
+  SingleFlight.ado(key, coro_fn, ...) asyncio; the work runs as its own task,
+                                     so a disconnecting leader doesn't cancel
+                                     it for the others
+  SingleFlight.stream(key, gen_fn, ...) token streams: one pump thread reads
+                                     the upstream generator, every subscriber
+                                     replays the pieces from the beginning
+
+RAG_COALESCE=0 turns it off.
+"""
+import asyncio
+import contextvars
+import os
+import threading
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Optional
+
+from .metrics import Counter
+
+COALESCE_ENABLED = os.getenv("RAG_COALESCE", "1") != "0"
+
+COALESCED = Counter("rag_coalesced_total", "Requests that joined an identical in-flight call", ("layer",))
+LEADERS   = Counter("rag_singleflight_calls_total", "Calls that actually ran (one per coalesced group)", ("layer",))
+
+
+def normalize_query(query: str) -> str:
+    """Whitespace-insensitive form of a query for coalescing/cache keys."""
+    return " ".join(query.split())
+
+
+class _Call:
+    __slots__ = ("done", "value", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class _Stream:
+    """Pieces of one upstream stream, replayable by any number of subscribers."""
+
+    def __init__(self):
+        self.pieces: List[Any] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.cond = threading.Condition()
+
+
+class SingleFlight:
+    def __init__(self, layer: str):
+        self.layer = layer
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+        self._streams: Dict[Hashable, _Stream] = {}
+
+    # ----- threads -----
+    def do(self, key: Hashable, fn: Callable, *args, **kwargs):
+        if not COALESCE_ENABLED:
+            return fn(*args, **kwargs)
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            COALESCED.inc(layer=self.layer)
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        LEADERS.inc(layer=self.layer)
+        try:
+            call.value = fn(*args, **kwargs)
+            return call.value
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    # ----- asyncio -----
+    async def ado(self, key: Hashable, coro_fn: Callable, *args, **kwargs):
+        if not COALESCE_ENABLED:
+            return await coro_fn(*args, **kwargs)
+        loop = asyncio.get_running_loop()
+        task = self._tasks.get(key)
+        if task is not None and task.get_loop() is loop:   # tasks can't be awaited across loops
+            COALESCED.inc(layer=self.layer)
+        else:
+            LEADERS.inc(layer=self.layer)
+            task = loop.create_task(coro_fn(*args, **kwargs))   # copies the leader's context (trace)
+            self._tasks[key] = task
+            task.add_done_callback(lambda t: self._task_done(key, t))
+        # shield: one cancelled waiter (client gone) must not cancel the shared call
+        return await asyncio.shield(task)
+
+    def _task_done(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled():
+            task.exception()   # retrieved: no "exception was never retrieved" if every waiter left
+
+    # ----- streams -----
+    def stream(self, key: Hashable, gen_fn: Callable[..., Iterator], *args, **kwargs) -> Iterator:
+        if not COALESCE_ENABLED:
+            yield from gen_fn(*args, **kwargs)
+            return
+        with self._lock:
+            st = self._streams.get(key)
+            leader = st is None
+            if leader:
+                st = self._streams[key] = _Stream()
+            st.subscribers += 1
+
+        if leader:
+            LEADERS.inc(layer=self.layer)
+            ctx = contextvars.copy_context()   # stage timings land in the leader's trace
+            threading.Thread(target=ctx.run, args=(self._pump, key, st, gen_fn(*args, **kwargs)),
+                             name=f"singleflight-{self.layer}", daemon=True).start()
+        else:
+            COALESCED.inc(layer=self.layer)
+
+        try:
+            i = 0
+            while True:
+                with st.cond:
+                    while i >= len(st.pieces) and not st.done:
+                        st.cond.wait()
+                    new, done, error = st.pieces[i:], st.done, st.error
+                i += len(new)
+                yield from new
+                if done:
+                    if error is not None:
+                        raise error
+                    return
+        finally:
+            with self._lock:
+                st.subscribers -= 1
+
+    def _pump(self, key: Hashable, st: _Stream, gen: Iterator) -> None:
+        try:
+            for piece in gen:
+                with self._lock:
+                    if st.subscribers == 0:
+                        # everyone left: stop reading (the truncated answer isn't cached);
+                        # unpublished first so nobody joins a stream that won't finish
+                        if self._streams.get(key) is st:
+                            del self._streams[key]
+                        break
+                with st.cond:
+                    st.pieces.append(piece)
+                    st.cond.notify_all()
+        except BaseException as e:
+            st.error = e
+        finally:
+            gen.close()
+            with self._lock:
+                if self._streams.get(key) is st:
+                    del self._streams[key]
+            with st.cond:
+                st.done = True
+                st.cond.notify_all()
@@ -0,0 +1,272 @@
+# app/stance.py
+"""
+User-stance classification for the MI graph (resistant | curious | ready | neutral).
+
+StanceClassifier needs no LLM call in the common case:
+  • prototype — cosine of the query embedding against labeled example
+                sentences, best match per class. The query embedding is the
+                one retrieve() computes anyway (shared LRU cache), so this is
+                just a dot product. BM25-routed queries have no embedding;
+                for them the query is embedded only if the keyword cues
+                alone are below MI_STANCE_MIN_CONFIDENCE.
+  • keyword   — regex cues ("Lügenpresse", "erklär mir", "danke, verstehe")
+                that push a class up.
+Both are combined into one softmax. Only when the winning class is below
+MI_STANCE_MIN_CONFIDENCE does it ask the fallback (LLMStanceClassifier, the
+old one-word llama prompt) — set MI_STANCE_LLM_FALLBACK=0 to never do that.
+
+Examples can be replaced with a JSON file {"resistant": [...], ...} via
+MI_STANCE_EXAMPLES.
+"""
+import json
+import os
+import re
+import threading
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+from .metrics import Counter
+
+STANCES = ("resistant", "curious", "ready", "neutral")
+
+STANCE_MODE           = os.getenv("MI_STANCE_CLASSIFIER", "prototype")   # prototype | keyword | llm
+STANCE_MIN_CONFIDENCE = float(os.getenv("MI_STANCE_MIN_CONFIDENCE", "0.5"))
+STANCE_LLM_FALLBACK   = os.getenv("MI_STANCE_LLM_FALLBACK", "1") != "0"
+STANCE_EXAMPLES_PATH  = os.getenv("MI_STANCE_EXAMPLES")
+
+_TEMPERATURE    = 0.05   # cosine gaps between classes are small; sharpen them
+_KEYWORD_WEIGHT = 1.5    # logit bonus per matched cue
+
+STANCE_TOTAL = Counter("rag_stance_total", "MI stance decisions", ("stance", "source"))
+
+DEFAULT_EXAMPLES: Dict[str, List[str]] = {
+    "resistant": [
+        "Das ist doch alles Lügenpresse, glaub ich nicht.",
+        "Ihr wollt mich nur umerziehen.",
+        "Die Grünen zerstören unser Land, da gibt es nichts zu diskutieren.",
+        "Quatsch, das stimmt einfach nicht!",
+        "Jeder weiß doch, dass die Regierung lügt.",
+        "Erzähl mir nichts, die Medien sind alle gekauft.",
+        "Das ist reine Propaganda.",
+        "Mir egal, was im Programm steht, die halten sich eh nie dran.",
+        "Hör auf, mich belehren zu wollen.",
+        "Die Altparteien haben uns doch alle verraten.",
+    ],
+    "curious": [
+        "Was sagt die AfD eigentlich zur Migration?",
+        "Wie genau will die SPD die Rente finanzieren?",
+        "Kannst du mir erklären, was sich beim Bürgergeld ändert?",
+        "Stimmt es, dass die Grünen Ölheizungen verbieten wollen?",
+        "Ich habe gehört, die FDP will die Schuldenbremse abschaffen – ist da was dran?",
+        "Welche Partei will den Mindestlohn erhöhen?",
+        "Woher kommt die Behauptung, dass Migranten mehr Sozialleistungen bekommen?",
+        "Was steht im Koalitionsvertrag zum Klimaschutz?",
+        "Warum wollen die Linken eine Vermögenssteuer?",
+        "Gibt es dafür eine Quelle?",
+    ],
+    "ready": [
+        "Okay, das ergibt Sinn. Was heißt das konkret für mich?",
+        "Danke, das wusste ich nicht. Zeig mir die genauen Zahlen.",
+        "Verstehe, dann habe ich das wohl falsch eingeschätzt.",
+        "Das klingt plausibel. Wo kann ich mehr darüber lesen?",
+        "Gut, ich möchte mir das genauer anschauen.",
+        "Überzeugt. Kannst du das noch einmal zusammenfassen?",
+        "Da hast du recht, ich hatte das anders im Kopf.",
+        "Alles klar, auf welcher Seite im Programm steht das?",
+    ],
+    "neutral": [
+        "Hallo",
+        "Ich weiß nicht.",
+        "Hm.",
+        "Politik.",
+        "Erzähl mal.",
+        "Wahlprogramm",
+        "Noch etwas?",
+        "Ok",
+    ],
+}
+
+_CUES: Dict[str, List[re.Pattern]] = {
+    "resistant": [re.compile(p) for p in (
+        r"lüg", r"propaganda", r"quatsch", r"unsinn", r"blödsinn", r"\bfake\b", r"gekauft",
+        r"systemmedien", r"altparteien", r"glaub\w* (ich |euch |dir )?(kein wort|nicht|nix)",
+        r"hör auf", r"belehr", r"!{2,}", r"interessiert mich nicht", r"ist mir egal",
+    )],
+    "curious": [re.compile(p) for p in (
+        r"^(was|wie|warum|wieso|weshalb|welche\w*|wer|wo|woher|wann|gibt es|stimmt es|ist es wahr|kannst du)\b",
+        r"erklär", r"\bquelle", r"ist da was dran",
+    )],
+    "ready": [re.compile(p) for p in (
+        r"\bdanke\b", r"\bverstehe\b", r"(ergibt|macht) sinn", r"(du hast|da hast du) recht",
+        r"überzeugt", r"einverstanden", r"guter punkt", r"^(okay|ok|gut|alles klar|stimmt)\b(?! es)[,.!]?\s*\S",
+    )],
+}
+
+
+class StanceResult(NamedTuple):
+    stance: str
+    confidence: float
+    source: str   # prototype | keyword | llm
+
+
+def _unit_rows(m: np.ndarray) -> np.ndarray:
+    n = np.linalg.norm(m, axis=-1, keepdims=True)
+    return m / np.where(n == 0, 1.0, n)
+
+
+def keyword_hits(query: str) -> np.ndarray:
+    q = query.strip().lower()
+    return np.array([sum(1 for p in _CUES.get(s, []) if p.search(q)) for s in STANCES], dtype=np.float32)
+
+
+def load_examples(path: Optional[str] = STANCE_EXAMPLES_PATH) -> Dict[str, List[str]]:
+    if not path:
+        return DEFAULT_EXAMPLES
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    unknown = set(data) - set(STANCES)
+    if unknown:
+        raise ValueError(f"unknown stance labels in {path}: {sorted(unknown)}")
+    return data
+
+
+class LLMStanceClassifier:
+    """The original one-word prompt; llm_invoke(prompt) -> str."""
+
+    PROMPT = """
+Klassifiziere die Haltung des Nutzers mit GENAU EINEM Wort.
+Nachricht: {query}
+
+Erlaubte Kategorien:
+- resistant  (defensiv, wütend, abweisend)
+- curious    (fragt nach, offen)
+- ready      (akzeptiert, will Infos)
+- neutral    (unklar)
+
+Gib NUR ein Wort zurück: resistant | curious | ready | neutral
+"""
+
+    def __init__(self, llm_invoke: Callable[[str], str]):
+        self.llm_invoke = llm_invoke
+
+    def classify(self, query: str, q_emb=None) -> StanceResult:
+        out = self.llm_invoke(self.PROMPT.format(query=query)).strip().lower()
+        stance = next((s for s in STANCES if s in out), "neutral")
+        return StanceResult(stance, 1.0 if stance in out else 0.0, "llm")
+
+
+class StanceClassifier:
+    """
+    Keyword + embedding-prototype classifier.
+      embed_query:     str -> vector (pass RAGPipeline._embed_query to share its cache)
+      embed_documents: list[str] -> vectors, used once to embed the examples
+      fallback:        another classifier for low-confidence cases (usually LLMStanceClassifier)
+    Without embedders it runs keyword-only.
+    """
+
+    def __init__(
+        self,
+        embed_query: Optional[Callable[[str], np.ndarray]] = None,
+        embed_documents: Optional[Callable[[List[str]], List[List[float]]]] = None,
+        *,
+        examples: Optional[Dict[str, List[str]]] = None,
+        min_confidence: float = STANCE_MIN_CONFIDENCE,
+        fallback=None,
+    ):
+        self.embed_query = embed_query
+        self.embed_documents = embed_documents
+        self.examples = examples or load_examples()
+        self.min_confidence = min_confidence
+        self.fallback = fallback
+        self._protos: Optional[np.ndarray] = None   # (n_examples, dim), unit rows
+        self._labels: Optional[np.ndarray] = None   # class index per row
+        self._lock = threading.Lock()
+
+    def _prototypes(self):
+        with self._lock:
+            if self._protos is None:
+                texts, labels = [], []
+                for i, s in enumerate(STANCES):
+                    for t in self.examples.get(s, []):
+                        texts.append(t)
+                        labels.append(i)
+                self._protos = _unit_rows(np.asarray(self.embed_documents(texts), dtype=np.float32))
+                self._labels = np.asarray(labels)
+            return self._protos, self._labels
+
+    def warm_up(self) -> None:
+        """Embed the examples now instead of on the first MI turn."""
+        if self.embed_documents is not None:
+            self._prototypes()
+
+    @staticmethod
+    def _softmax(logits: np.ndarray) -> np.ndarray:
+        logits = logits.copy()
+        logits[STANCES.index("neutral")] += 1e-3   # ties go to neutral
+        e = np.exp(logits - logits.max())
+        return e / e.sum()
+
+    def _scores(self, query: str, q_emb=None):
+        """(per-class probabilities, "prototype" | "keyword")."""
+        logits = _KEYWORD_WEIGHT * keyword_hits(query)
+        if self.embed_documents is None:
+            return self._softmax(logits), "keyword"
+        if q_emb is None:
+            # no free embedding (BM25-routed query): embed only if the cues can't decide
+            if self.embed_query is None or self._softmax(logits).max() >= self.min_confidence:
+                return self._softmax(logits), "keyword"
+            q_emb = self.embed_query(query)
+        protos, labels = self._prototypes()
+        sims = protos @ _unit_rows(np.asarray(q_emb, dtype=np.float32))
+        best = np.array([sims[labels == i].max() if np.any(labels == i) else -1.0
+                         for i in range(len(STANCES))], dtype=np.float32)
+        return self._softmax(logits + best / _TEMPERATURE), "prototype"
+
+    def scores(self, query: str, q_emb=None) -> np.ndarray:
+        """Per-class probabilities, in STANCES order."""
+        return self._scores(query, q_emb)[0]
+
+    def classify(self, query: str, q_emb=None) -> StanceResult:
+        p, source = self._scores(query, q_emb)
+        i = int(np.argmax(p))
+        res = StanceResult(STANCES[i], float(p[i]), source)
+        if res.confidence < self.min_confidence and self.fallback is not None:
+            try:
+                res = self.fallback.classify(query, q_emb)
+            except Exception as e:   # fallback is best effort; keep the local guess
+                print(f"Stance fallback failed: {e}")
+        STANCE_TOTAL.inc(stance=res.stance, source=res.source)
+        return res
+
+
+def build_stance_classifier(
+    embed_query=None,
+    embed_documents=None,
+    llm_invoke: Optional[Callable[[str], str]] = None,
+    mode: str = STANCE_MODE,
+):
+    """Classifier per MI_STANCE_CLASSIFIER (prototype | keyword | llm)."""
+    llm = LLMStanceClassifier(llm_invoke) if llm_invoke is not None else None
+    if mode == "llm":
+        if llm is None:
+            raise ValueError("MI_STANCE_CLASSIFIER=llm needs an llm_invoke callable")
+        return _Counted(llm)
+    if mode == "keyword":
+        embed_query = embed_documents = None
+    elif mode != "prototype":
+        raise ValueError(f"MI_STANCE_CLASSIFIER must be prototype, keyword or llm, got {mode!r}")
+    return StanceClassifier(embed_query, embed_documents,
+                            fallback=llm if STANCE_LLM_FALLBACK else None)
+
+
+class _Counted:
+    """Adds the rag_stance_total counter to a bare classifier."""
+
+    def __init__(self, inner):
+        self.inner = inner
+
+    def classify(self, query: str, q_emb=None) -> StanceResult:
+        res = self.inner.classify(query, q_emb)
+        STANCE_TOTAL.inc(stance=res.stance, source=res.source)
+        return res
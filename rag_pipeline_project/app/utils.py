@@ -38,11 +38,13 @@ Use [1], [2] for citations when referencing party documents."""
 # -----------------------------------------------------------------------------
 def is_chroma_cache_present(folder: str = "embeddings/chromadb") -> bool:
     """
-    Return True if the Chroma persistent-index folder exists and is non-empty,
-    regardless of the current working directory.
+    Return True if the Chroma persistent-index folder holds an index *and* the
+    ingestion manifest describing it (see app/ingest.py), regardless of the
+    current working directory. Whether that index is still current for the
+    PDFs/config is decided by ingest.sync_index.
     """
     cache_dir = _abs(folder)
-    return cache_dir.exists() and any(cache_dir.iterdir())
+    return cache_dir.exists() and any(cache_dir.iterdir()) and (cache_dir / "manifest.json").exists()
 
 
 def clear_cache(folder: str = "embeddings/chromadb") -> None:
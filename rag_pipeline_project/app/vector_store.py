@@ -0,0 +1,442 @@
+# app/vector_store.py
+"""
+Vector backends behind RAGPipeline. Each one exposes the small subset of the
+Chroma collection API that ingest, BM25 and retrieval use:
+
+  count()                                   number of stored chunks
+  upsert(ids, embeddings, documents, metadatas)
+  delete(ids=None, where=None)              where: {"source": name} equality only
+  get(ids=None, include=[...])              {"ids", "documents", "metadatas", "embeddings"}
+  query(query_embeddings, n_results, include)  same, one list per query, nearest first
+  flush()                                   make written chunks durable/visible
+  embeddings                                the embedder (OllamaEmbedder)
+
+ChromaBackend (RAG_VECTOR_BACKEND=chroma, default)
+  The LangChain Chroma store as before (cosine HNSW index), on the same
+  persist directory — existing indexes keep working. flush() is a no-op,
+  Chroma persists every upsert.
+
+MmapBackend (RAG_VECTOR_BACKEND=mmap)
+  A plain NumPy matrix on disk, opened with mmap:
+    <persist_dir>/mmap/<collection>/CURRENT       name of the live generation
+    <persist_dir>/mmap/<collection>/g<ts>/
+      vectors.npy      unit-normalized rows, float32 | float16 | int8 (MMAP_DTYPE)
+      scales.npy       int8 only: per-row scale (row ≈ int8 * scale)
+      docs.bin         chunk texts, UTF-8, back to back
+      doc_offsets.npy  row i = docs.bin[off[i]:off[i+1]]
+      meta.json        dim, dtype, ids, metadatas, IVF layout
+      ivf_centroids.npy / ivf_offsets.npy   with MMAP_IVF_LISTS > 0
+  Search is exact (blocked matrix products over the mapped rows, top-n with
+  argpartition) or, with MMAP_IVF_LISTS > 0, over the MMAP_NPROBE lists whose
+  centroids are closest to the query (rows are stored sorted by list, so a
+  list is one contiguous slice). Vectors are mapped read-only, so several
+  uvicorn workers on one host share a single copy through the OS page cache
+  instead of each holding the index on its heap. float16 halves the
+  footprint of float32 at no measurable recall cost for bge-m3; int8
+  quarters it.
+  Writes are staged in memory and published by flush(): a new generation
+  directory is written next to the live one and CURRENT is switched
+  atomically, so readers never see a half-written index. Before each
+  query/get a backend stats CURRENT and maps the new generation if another
+  process (a worker's startup sync, the embed_documents CLI) published one.
+  A flush rewrites the whole index, so ingest flushes every
+  INGEST_FLUSH_S seconds and at the end of a sync, not per document.
+"""
+import json
+import mmap
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+VECTOR_BACKEND = os.getenv("RAG_VECTOR_BACKEND", "chroma")
+VECTOR_BACKENDS = ("chroma", "mmap")
+
+MMAP_DTYPE     = os.getenv("MMAP_DTYPE", "float16")        # float32 | float16 | int8
+MMAP_DTYPES    = ("float32", "float16", "int8")
+MMAP_IVF_LISTS = int(os.getenv("MMAP_IVF_LISTS", "0"))     # 0 = exact search
+MMAP_NPROBE    = int(os.getenv("MMAP_NPROBE", "8"))        # IVF lists scanned per query
+MMAP_BLOCK     = int(os.getenv("MMAP_BLOCK_ROWS", "8192"))  # rows dequantized at a time
+
+_KMEANS_ITERS = 10
+_KMEANS_SAMPLE = 50_000
+
+
+def backend_config(kind: str = VECTOR_BACKEND) -> Dict:
+    """Index-config entries of a backend (ingest rebuilds when they change); {} for Chroma."""
+    if kind == "mmap":
+        return {"vector_backend": "mmap", "mmap_dtype": MMAP_DTYPE}
+    return {}
+
+
+def _unit_rows(m: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(m, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return m / norms
+
+
+def _matches(meta: Dict, where: Dict) -> bool:
+    return all((meta or {}).get(k) == v for k, v in where.items())
+
+
+# ─── Chroma ──────────────────────────────────────────────────
+class ChromaBackend:
+    name = "chroma"
+    durable_upserts = True   # every upsert is on disk: ingest can checkpoint per batch
+
+    def __init__(self, persist_dir: Path, collection_name: str, embeddings):
+        from langchain_community.vectorstores import Chroma
+        self.store = Chroma(
+            persist_directory=str(persist_dir),
+            embedding_function=embeddings,
+            collection_name=collection_name,
+            collection_metadata={"hnsw:space": "cosine"},
+        )
+        self._collection = self.store._collection
+        self.embeddings = embeddings
+
+    def count(self) -> int:
+        return self._collection.count()
+
+    def upsert(self, ids, embeddings, documents, metadatas) -> None:
+        self._collection.upsert(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+
+    def delete(self, ids: Optional[List[str]] = None, where: Optional[Dict] = None) -> None:
+        self._collection.delete(ids=ids, where=where)
+
+    def get(self, ids: Optional[List[str]] = None, include: Iterable[str] = ("documents", "metadatas")) -> Dict:
+        return self._collection.get(ids=ids, include=list(include))
+
+    def query(self, query_embeddings, n_results: int, include: Iterable[str] = ("documents", "metadatas")) -> Dict:
+        return self._collection.query(
+            query_embeddings=[np.asarray(q, dtype=np.float32).tolist() for q in query_embeddings],
+            n_results=n_results,
+            include=list(include),
+        )
+
+    def flush(self) -> None:
+        pass
+
+
+# ─── memory-mapped ───────────────────────────────────────────
+class _Generation:
+    """One published, read-only version of the mmap index."""
+
+    def __init__(self, path: Optional[Path] = None):
+        self.path = path
+        self.ids: List[str] = []
+        self.metadatas: List[Dict] = []
+        self.row_of: Dict[str, int] = {}
+        self.vectors: Optional[np.ndarray] = None
+        self.scales: Optional[np.ndarray] = None
+        self.doc_offsets: Optional[np.ndarray] = None
+        self.centroids: Optional[np.ndarray] = None
+        self.ivf_offsets: Optional[np.ndarray] = None
+        self._docs: Optional[mmap.mmap] = None
+        if path is None:
+            return
+        meta = json.loads((path / "meta.json").read_text(encoding="utf-8"))
+        self.ids = meta["ids"]
+        self.metadatas = meta["metadatas"]
+        self.row_of = {cid: i for i, cid in enumerate(self.ids)}
+        if not self.ids:
+            return
+        self.vectors = np.load(path / "vectors.npy", mmap_mode="r")
+        if meta["dtype"] == "int8":
+            self.scales = np.load(path / "scales.npy")
+        self.doc_offsets = np.load(path / "doc_offsets.npy")
+        if meta.get("ivf_lists"):
+            self.centroids = np.load(path / "ivf_centroids.npy")
+            self.ivf_offsets = np.load(path / "ivf_offsets.npy")
+        if self.doc_offsets[-1] > 0:
+            with open(path / "docs.bin", "rb") as f:
+                self._docs = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def document(self, i: int) -> str:
+        a, b = int(self.doc_offsets[i]), int(self.doc_offsets[i + 1])
+        return self._docs[a:b].decode("utf-8") if b > a else ""
+
+    def rows(self, idx) -> np.ndarray:
+        """Dequantized float32 rows (unit length up to quantization error)."""
+        m = np.asarray(self.vectors[idx], dtype=np.float32)
+        if self.scales is not None:
+            m *= self.scales[idx][:, None]
+        return m
+
+
+class MmapBackend:
+    name = "mmap"
+    durable_upserts = False  # only flush() persists
+
+    def __init__(self, root: Path, embeddings, dtype: str = MMAP_DTYPE,
+                 ivf_lists: int = MMAP_IVF_LISTS, nprobe: int = MMAP_NPROBE):
+        if dtype not in MMAP_DTYPES:
+            raise ValueError(f"MMAP_DTYPE must be one of {MMAP_DTYPES}, got {dtype!r}")
+        self.root = Path(root)
+        self.embeddings = embeddings
+        self.dtype = dtype
+        self.ivf_lists = ivf_lists
+        self.nprobe = nprobe
+        self._lock = threading.Lock()
+        # id → (document, metadata, float32 vector); only while writes are pending
+        self._staged: Optional["OrderedDict[str, tuple]"] = None
+        self._current_stamp = None   # (inode, mtime) of CURRENT when _gen was opened
+        self._gen = self._open()
+        have = len(self._gen.centroids) if self._gen.centroids is not None else 0
+        if len(self._gen) and have != max(0, min(ivf_lists, len(self._gen))):
+            # MMAP_IVF_LISTS changed: re-cluster the stored vectors, no re-embedding needed
+            self._stage()
+            self.flush()
+
+    # ----- generations -----
+    def _stamp(self):
+        try:
+            st = (self.root / "CURRENT").stat()
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_mtime_ns   # replace() gives CURRENT a new inode
+
+    def _current_name(self) -> Optional[str]:
+        try:
+            return (self.root / "CURRENT").read_text(encoding="utf-8").strip()
+        except FileNotFoundError:
+            return None
+
+    def _open(self) -> _Generation:
+        for _ in range(3):   # the generation may be pruned between reading CURRENT and opening it
+            self._current_stamp = self._stamp()
+            name = self._current_name()
+            if name is None:
+                return _Generation()
+            try:
+                return _Generation(self.root / name)
+            except FileNotFoundError:
+                continue
+        raise FileNotFoundError(f"{self.root}: CURRENT keeps pointing at a missing generation")
+
+    def _refresh(self) -> None:
+        # caller holds _lock; a writer mid-sync keeps the generation it staged from
+        if self._staged is None and self._stamp() != self._current_stamp:
+            gen = self._open()
+            if gen.path != self._gen.path:
+                self._gen = gen
+
+    def _live(self) -> _Generation:
+        """The published generation, reopened if another process switched CURRENT."""
+        with self._lock:
+            self._refresh()
+            return self._gen
+
+    def _stage(self) -> "OrderedDict[str, tuple]":
+        """Copy the live generation into the write buffer (first write after a flush)."""
+        if self._staged is None:
+            self._refresh()
+            g = self._gen
+            vecs = g.rows(slice(None)) if len(g) else []
+            self._staged = OrderedDict(
+                (cid, (g.document(i), g.metadatas[i], vecs[i])) for i, cid in enumerate(g.ids)
+            )
+        return self._staged
+
+    def flush(self) -> None:
+        """Publish staged writes as a new generation and switch CURRENT to it."""
+        with self._lock:
+            if self._staged is None:
+                return
+            staged = self._staged
+            gen_dir = self.root / f"g{time.time_ns()}"
+            _write_generation(gen_dir, staged, self.dtype, self.ivf_lists)
+            prev = self._current_name()
+            tmp = self.root / f"CURRENT.{os.getpid()}.tmp"
+            tmp.write_text(gen_dir.name, encoding="utf-8")
+            tmp.replace(self.root / "CURRENT")   # atomic switch
+            self._current_stamp = self._stamp()
+            self._gen = _Generation(gen_dir)
+            self._staged = None
+        # generations older than the one we replaced: nobody can switch to
+        # those any more (a newer writer's directory is never older than the
+        # generation it was staged from). The replaced one stays until the
+        # next flush; workers that still map an unlinked one keep it valid (POSIX).
+        prev_ts = _gen_ts(prev) if prev else None
+        if prev_ts is None:
+            return
+        for old in self.root.glob("g*"):
+            ts = _gen_ts(old.name)
+            if old.is_dir() and ts is not None and ts < prev_ts and old != gen_dir:
+                shutil.rmtree(old, ignore_errors=True)
+
+    # ----- collection API -----
+    def count(self) -> int:
+        with self._lock:
+            self._refresh()
+            return len(self._staged) if self._staged is not None else len(self._gen)
+
+    def upsert(self, ids, embeddings, documents, metadatas) -> None:
+        vecs = np.asarray(embeddings, dtype=np.float32)
+        with self._lock:
+            staged = self._stage()
+            for cid, vec, doc, meta in zip(ids, vecs, documents, metadatas):
+                staged[cid] = (doc, dict(meta or {}), vec)
+
+    def delete(self, ids: Optional[List[str]] = None, where: Optional[Dict] = None) -> None:
+        with self._lock:
+            staged = self._stage()
+            for cid in ids or []:
+                staged.pop(cid, None)
+            if where:
+                for cid in [c for c, (_, meta, _) in staged.items() if _matches(meta, where)]:
+                    del staged[cid]
+
+    def get(self, ids: Optional[List[str]] = None, include: Iterable[str] = ("documents", "metadatas")) -> Dict:
+        include = set(include)
+        g = self._live()
+        with self._lock:
+            staged = self._staged
+        if staged is not None:   # mid-sync: the writer reads its own writes
+            keep = [cid for cid in (staged if ids is None else ids) if cid in staged]
+            out = {"ids": keep}
+            if "documents" in include:
+                out["documents"] = [staged[c][0] for c in keep]
+            if "metadatas" in include:
+                out["metadatas"] = [staged[c][1] for c in keep]
+            if "embeddings" in include:
+                out["embeddings"] = [staged[c][2] for c in keep]
+            return out
+        rows = list(range(len(g))) if ids is None else [g.row_of[c] for c in ids if c in g.row_of]
+        return self._result(g, np.asarray(rows, dtype=np.int64), include)
+
+    def query(self, query_embeddings, n_results: int, include: Iterable[str] = ("documents", "metadatas")) -> Dict:
+        include = set(include)
+        g = self._live()   # readers always see the last published generation
+        q = _unit_rows(np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32)))
+        n = min(n_results, len(g))
+        out = {"ids": [], "documents": [], "metadatas": [], "embeddings": [], "distances": []}
+        if n <= 0:
+            for key in out:
+                out[key] = [[] for _ in q]
+            return out
+        if g.centroids is not None:
+            hits = [self._search_ivf(g, qi, n) for qi in q]
+        else:
+            hits = self._search_exact(g, q, n)
+        for rows, scores in hits:
+            res = self._result(g, rows, include)
+            for key in ("ids", "documents", "metadatas", "embeddings"):
+                out[key].append(res.get(key))
+            out["distances"].append((1.0 - scores).tolist())   # cosine distance, like Chroma
+        return {k: v for k, v in out.items() if k in include or k in ("ids", "distances")}
+
+    # ----- search -----
+    @staticmethod
+    def _top(scores: np.ndarray, rows: np.ndarray, n: int):
+        if len(scores) > n:
+            part = np.argpartition(-scores, n - 1)[:n]
+            scores, rows = scores[part], rows[part]
+        order = np.argsort(-scores, kind="stable")
+        return rows[order], scores[order]
+
+    def _search_exact(self, g: _Generation, q: np.ndarray, n: int):
+        """Blocked scan: only MMAP_BLOCK rows are dequantized at a time."""
+        best_s = np.empty((len(q), 0), dtype=np.float32)
+        best_r = np.empty((len(q), 0), dtype=np.int64)
+        for a in range(0, len(g), MMAP_BLOCK):
+            b = min(a + MMAP_BLOCK, len(g))
+            s = q @ g.rows(slice(a, b)).T                       # (queries, block)
+            cat_s = np.concatenate([best_s, s], axis=1)
+            cat_r = np.concatenate([best_r, np.broadcast_to(np.arange(a, b), s.shape)], axis=1)
+            if cat_s.shape[1] > n:
+                part = np.argpartition(-cat_s, n - 1, axis=1)[:, :n]
+                cat_s = np.take_along_axis(cat_s, part, axis=1)
+                cat_r = np.take_along_axis(cat_r, part, axis=1)
+            best_s, best_r = cat_s, cat_r
+        return [self._top(s, r, n) for s, r in zip(best_s, best_r)]
+
+    def _search_ivf(self, g: _Generation, q: np.ndarray, n: int):
+        probe = np.argsort(-(g.centroids @ q))[:max(1, self.nprobe)]
+        rows = np.concatenate([np.arange(g.ivf_offsets[l], g.ivf_offsets[l + 1]) for l in probe])
+        if len(rows) < n:   # sparse lists: fall back to the exact scan for this query
+            return self._search_exact(g, q[None, :], n)[0]
+        return self._top(g.rows(rows) @ q, rows, n)
+
+    @staticmethod
+    def _result(g: _Generation, rows: np.ndarray, include: set) -> Dict:
+        out = {"ids": [g.ids[i] for i in rows]}
+        if "documents" in include:
+            out["documents"] = [g.document(i) for i in rows]
+        if "metadatas" in include:
+            out["metadatas"] = [g.metadatas[i] for i in rows]
+        if "embeddings" in include:
+            out["embeddings"] = g.rows(rows) if len(rows) else np.zeros((0, 0), dtype=np.float32)
+        return out
+
+
+def _gen_ts(name: str) -> Optional[int]:
+    return int(name[1:]) if name.startswith("g") and name[1:].isdigit() else None
+
+
+def _kmeans(m: np.ndarray, k: int, seed: int = 0) -> np.ndarray:
+    """Spherical k-means (cosine) on a sample of the rows; returns unit centroids."""
+    rng = np.random.default_rng(seed)
+    sample = m[rng.choice(len(m), min(len(m), _KMEANS_SAMPLE), replace=False)]
+    cent = sample[rng.choice(len(sample), k, replace=False)].copy()
+    for _ in range(_KMEANS_ITERS):
+        assign = np.argmax(sample @ cent.T, axis=1)
+        for j in range(k):
+            members = sample[assign == j]
+            if len(members):
+                cent[j] = members.sum(axis=0)
+        cent = _unit_rows(cent)
+    return cent
+
+
+def _write_generation(gen_dir: Path, staged: "OrderedDict[str, tuple]", dtype: str, ivf_lists: int) -> None:
+    gen_dir.mkdir(parents=True, exist_ok=True)
+    ids = list(staged)
+    docs = [staged[c][0] for c in ids]
+    metas = [staged[c][1] for c in ids]
+    vecs = _unit_rows(np.stack([staged[c][2] for c in ids])) if ids else np.zeros((0, 0), dtype=np.float32)
+
+    meta: Dict = {"dim": int(vecs.shape[1]) if ids else 0, "dtype": dtype, "ivf_lists": 0}
+    lists = min(ivf_lists, len(ids))
+    if lists > 0:
+        cent = _kmeans(vecs, lists)
+        assign = np.argmax(vecs @ cent.T, axis=1)
+        order = np.argsort(assign, kind="stable")   # one contiguous slice per list
+        ids, docs, metas = [ids[i] for i in order], [docs[i] for i in order], [metas[i] for i in order]
+        vecs = vecs[order]
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=lists))]).astype(np.int64)
+        np.save(gen_dir / "ivf_centroids.npy", cent.astype(np.float32))
+        np.save(gen_dir / "ivf_offsets.npy", offsets)
+        meta["ivf_lists"] = lists
+
+    if dtype == "int8":
+        scales = np.abs(vecs).max(axis=1) / 127.0 if ids else np.zeros(0, dtype=np.float32)
+        scales[scales == 0] = 1.0
+        np.save(gen_dir / "scales.npy", scales.astype(np.float32))
+        np.save(gen_dir / "vectors.npy", np.round(vecs / scales[:, None]).astype(np.int8))
+    else:
+        np.save(gen_dir / "vectors.npy", vecs.astype(dtype))
+
+    encoded = [d.encode("utf-8") for d in docs]
+    np.save(gen_dir / "doc_offsets.npy", np.concatenate([[0], np.cumsum([len(b) for b in encoded])]).astype(np.int64))
+    with open(gen_dir / "docs.bin", "wb") as f:
+        for b in encoded:
+            f.write(b)
+    meta.update(ids=ids, metadatas=metas)
+    (gen_dir / "meta.json").write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+
+
+def build_vector_backend(kind: str, persist_dir: Path, collection_name: str, embeddings):
+    if kind == "chroma":
+        return ChromaBackend(persist_dir, collection_name, embeddings)
+    if kind == "mmap":
+        return MmapBackend(Path(persist_dir) / "mmap" / collection_name, embeddings)
+    raise ValueError(f"RAG_VECTOR_BACKEND must be one of {VECTOR_BACKENDS}, got {kind!r}")
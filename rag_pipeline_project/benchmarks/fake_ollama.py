@@ -0,0 +1,313 @@
+# benchmarks/fake_ollama.py
+"""
+Local stand-in for the Ollama HTTP API, for benchmarks and offline runs.
+
+Serves /api/embed, /api/embeddings, /api/generate and /api/chat (streaming
+and not) and /api/tags. Embeddings are deterministic hashed bag-of-words
+vectors, so texts that share words are close and results are reproducible
+across runs. Every endpoint can be slowed down to look like a real GPU host.
+
+Generation mimics the runner's KV cache: a few slots (OLLAMA_NUM_PARALLEL)
+each remember their last sequence (templated prompt + answer); a request
+takes the slot with the longest common prefix and only the rest counts as
+prompt_eval_count / costs prefill time. The counts are word-based, so
+absolute numbers are approximate, the ratios between layouts are not.
+
+Run standalone (then point OLLAMA_BASE_URL at it):
+    python -m benchmarks.fake_ollama --port 11435 --gen-tokens-per-s 40
+"""
+import argparse
+import hashlib
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+class FakeOllamaConfig:
+    def __init__(
+        self,
+        dim: int = 1024,                 # bge-m3 size
+        embed_delay: float = 0.0,        # seconds per embedding request
+        embed_item_delay: float = 0.0,   # extra seconds per input text
+        gen_first_token_delay: float = 0.0,
+        gen_tokens_per_s: float = 0.0,   # 0 = instant
+        gen_tokens: int = 64,            # tokens per answer
+        prefill_tokens_per_s: float = 0.0,   # prompt evaluation speed, 0 = instant
+        kv_slots: int = 4,               # cached sequences, 0 = no prefix cache
+    ):
+        self.dim = dim
+        self.embed_delay = embed_delay
+        self.embed_item_delay = embed_item_delay
+        self.gen_first_token_delay = gen_first_token_delay
+        self.gen_tokens_per_s = gen_tokens_per_s
+        self.gen_tokens = gen_tokens
+        self.prefill_tokens_per_s = prefill_tokens_per_s
+        self.kv_slots = kv_slots
+
+
+def fake_embedding(text: str, dim: int) -> list:
+    v = np.zeros(dim, dtype=np.float32)
+    for w in _WORD_RE.findall(text.lower()):
+        h = int.from_bytes(hashlib.blake2b(w.encode("utf-8"), digest_size=8).digest(), "little")
+        v[h % dim] += 1.0 if (h >> 32) & 1 else -1.0
+    n = np.linalg.norm(v)
+    return (v / n if n else v).tolist()
+
+
+def _approx_tokens(text: str) -> int:
+    return max(1, int(len(text.split()) * 1.3))
+
+
+# ─── prompt templating + KV slots ────────────────────────────
+def _template(body: dict, chat: bool) -> list:
+    """Roughly what the llama3 template turns a request into, one entry per word."""
+    if not chat:
+        msgs = [{"role": "user", "content": body.get("prompt", "")}]
+    else:
+        msgs = body.get("messages") or []
+    seq = []
+    for m in msgs:
+        seq.append(f"<|{m.get('role', 'user')}|>")
+        seq.extend(str(m.get("content", "")).split())
+        seq.append("<|eot|>")
+    seq.append("<|assistant|>")
+    return seq
+
+
+def _common_prefix(a: list, b: list) -> int:
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+class KVSlots:
+    def __init__(self, n: int):
+        self.n = n
+        self.slots: list = []   # [model, sequence], most recently used last
+        self.lock = threading.Lock()
+
+    def take(self, model: str, seq: list) -> tuple:
+        """(slot, cached prefix length); the slot is reserved until put()."""
+        with self.lock:
+            best, hit = None, 0
+            for s in self.slots:
+                if s[0] == model:
+                    n = _common_prefix(s[1], seq)
+                    if n > hit:
+                        best, hit = s, n
+            if best is None and self.slots and len(self.slots) >= self.n:
+                best = self.slots[0]   # least recently used
+            if best is not None:
+                self.slots.remove(best)
+            return best or [model, []], hit
+
+    def put(self, slot: list, model: str, seq: list) -> None:
+        with self.lock:
+            slot[0], slot[1] = model, seq
+            self.slots.append(slot)
+            del self.slots[:-self.n]
+
+    def reset(self) -> None:
+        with self.lock:
+            self.slots.clear()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive, like the real server
+    cfg: FakeOllamaConfig
+    stats: dict
+    totals: dict
+    lock: threading.Lock
+    kv: KVSlots
+
+    def log_message(self, *args):
+        pass
+
+    def _count(self, key: str, n: int = 1):
+        with self.lock:
+            self.stats[key] = self.stats.get(key, 0) + n
+
+    def _json(self, obj, status: int = 200):
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            return self._json({"models": [{"name": "bge-m3"}, {"name": "llama3.1:8b"}]})
+        self._json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        cfg = self.cfg
+
+        if self.path == "/fake/reset":
+            # benchmark hook: cold KV cache and fresh counters; returns the counters since the last
+            # reset, which are folded into totals so FakeOllama.summary() still covers the whole run
+            self.kv.reset()
+            with self.lock:
+                since = dict(self.stats)
+                for k, v in since.items():
+                    self.totals[k] = self.totals.get(k, 0) + v
+                self.stats.clear()
+            return self._json(since)
+
+        if self.path in ("/api/embed", "/api/embeddings"):
+            texts = body.get("input", body.get("prompt", ""))
+            texts = [texts] if isinstance(texts, str) else list(texts)
+            time.sleep(cfg.embed_delay + cfg.embed_item_delay * len(texts))
+            self._count("embed_requests")
+            self._count("embed_inputs", len(texts))
+            vecs = [fake_embedding(t, cfg.dim) for t in texts]
+            if self.path == "/api/embeddings":
+                return self._json({"embedding": vecs[0]})
+            return self._json({"model": body.get("model"), "embeddings": vecs})
+
+        if self.path in ("/api/generate", "/api/chat"):
+            chat = self.path == "/api/chat"
+            self._count("chat_requests" if chat else "generate_requests")
+            seq = _template(body, chat)
+            if cfg.kv_slots:
+                slot, hit = self.kv.take(body.get("model"), seq)
+            else:
+                slot, hit = None, 0
+            try:
+                answer = self._generate(body, prompt_tokens=_approx_tokens(" ".join(seq)), chat=chat,
+                                        prompt_eval=_approx_tokens(" ".join(seq[hit:])))
+                seq = seq + answer.split() + ["<|eot|>"]
+            finally:
+                if slot is not None:
+                    self.kv.put(slot, body.get("model"), seq)
+            return
+
+        self._json({"error": "not found"}, 404)
+
+    # ----- generation -----
+    def _answer_tokens(self):
+        return [f"Token{i} " for i in range(self.cfg.gen_tokens)]
+
+    def _generate(self, body, prompt_tokens: int, chat: bool = False, prompt_eval: int | None = None):
+        cfg = self.cfg
+        tokens = self._answer_tokens()
+        prompt_eval = prompt_tokens if prompt_eval is None else prompt_eval
+        self._count("prompt_tokens", prompt_tokens)
+        self._count("prompt_eval_tokens", prompt_eval)
+        per_tok = 1.0 / cfg.gen_tokens_per_s if cfg.gen_tokens_per_s else 0.0
+        prefill_s = prompt_eval / cfg.prefill_tokens_per_s if cfg.prefill_tokens_per_s else 0.0
+        meta = {"done": True, "prompt_eval_count": prompt_eval, "eval_count": len(tokens),
+                "total_duration": 0, "prompt_eval_duration": int(prefill_s * 1e9), "eval_duration": 0}
+
+        def piece(text: str) -> dict:
+            if chat:
+                return {"model": body.get("model"), "message": {"role": "assistant", "content": text}, "done": False}
+            return {"model": body.get("model"), "response": text, "done": False}
+
+        answer = "".join(tokens).strip()
+        time.sleep(cfg.gen_first_token_delay + prefill_s)
+        if not body.get("stream", True):
+            time.sleep(per_tok * len(tokens))
+            out = piece(answer)
+            out.update(meta)
+            self._json(out)
+            return answer
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def write(obj):
+            data = (json.dumps(obj) + "\n").encode("utf-8")
+            self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        for t in tokens:
+            time.sleep(per_tok)
+            write(piece(t))
+        last = piece("")
+        last.update(meta)
+        write(last)
+        self.wfile.write(b"0\r\n\r\n")
+        return answer
+
+
+class FakeOllama:
+    """Threaded fake server; use as a context manager or call start()/stop()."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, config: FakeOllamaConfig | None = None):
+        self.config = config or FakeOllamaConfig()
+        self.stats: dict = {}    # since the last /fake/reset
+        self.totals: dict = {}   # everything before that
+        handler = type("Handler", (_Handler,), {"cfg": self.config, "stats": self.stats, "totals": self.totals,
+                                                "lock": threading.Lock(), "kv": KVSlots(self.config.kv_slots)})
+        self._lock = handler.lock
+        self._server = ThreadingHTTPServer((host, port), handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def summary(self) -> dict:
+        """Counters for the whole run, across /fake/reset calls."""
+        with self._lock:
+            out = dict(self.totals)
+            for k, v in self.stats.items():
+                out[k] = out.get(k, 0) + v
+        return out
+
+    def start(self) -> "FakeOllama":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Fake Ollama server")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=11435)
+    ap.add_argument("--dim", type=int, default=1024)
+    ap.add_argument("--embed-delay", type=float, default=0.0)
+    ap.add_argument("--embed-item-delay", type=float, default=0.0)
+    ap.add_argument("--gen-first-token-delay", type=float, default=0.0)
+    ap.add_argument("--gen-tokens-per-s", type=float, default=0.0)
+    ap.add_argument("--gen-tokens", type=int, default=64)
+    ap.add_argument("--prefill-tokens-per-s", type=float, default=0.0)
+    ap.add_argument("--kv-slots", type=int, default=4)
+    a = ap.parse_args()
+    cfg = FakeOllamaConfig(a.dim, a.embed_delay, a.embed_item_delay,
+                           a.gen_first_token_delay, a.gen_tokens_per_s, a.gen_tokens,
+                           a.prefill_tokens_per_s, a.kv_slots)
+    srv = FakeOllama(a.host, a.port, cfg)
+    print(f"Fake Ollama listening on {srv.url}")
+    try:
+        srv._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
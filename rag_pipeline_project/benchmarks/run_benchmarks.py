@@ -0,0 +1,556 @@
+# benchmarks/run_benchmarks.py
+"""
+End-to-end benchmarks against a local fake Ollama (benchmarks/fake_ollama.py).
+
+Per corpus size (the first N PDFs of documents/sources) it measures, each in a
+fresh subprocess so memory numbers are not polluted by the previous size:
+  • ingestion  — wall time, pages/s, chunks/s
+  • retrieve   — RAGPipeline.retrieve latency percentiles, cold (caches
+                 cleared) and warm (repeat query)
+  • generate   — POST /generate throughput and latency under N concurrent
+                 sessions (falls back to RAGPipeline.agenerate if Redis is down)
+  • conversation — multi-turn sessions with the "generate" (flat prompt) and
+                 "chat" (stable message prefix) layouts: prompt tokens Ollama
+                 had to evaluate (prompt_eval_count, after its KV-cache reuse)
+                 and latency — set --prefill-tokens-per-s to make prefill cost time
+  • burst      — N sessions sending the same question at once, with request
+                 coalescing off and on: Ollama calls and latency
+  • batch      — a list of claims answered one request at a time vs. with
+                 agenerate_batch (one embedding call, one Chroma query,
+                 bounded parallel generation): items/s
+  • mmr        — MMR selection alone (candidates already fetched) for growing
+                 fetch_k: in-process NumPy vs. langchain's maximal_marginal_relevance
+  • memory     — peak RSS of the API process and of the PDF parser processes
+
+Results are written as JSON (one file per run, named after the git commit) so
+two runs can be compared.
+
+Usage (from rag_pipeline_project/):
+    python -m benchmarks.run_benchmarks
+    python -m benchmarks.run_benchmarks --sizes 1 3 --concurrency 1 4 8 --gen-tokens-per-s 50
+    python -m benchmarks.run_benchmarks --compare results/old.json results/new.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+BENCH_DIR = Path(__file__).resolve().parent
+PROJECT_ROOT = BENCH_DIR.parent
+DEFAULT_SOURCES = PROJECT_ROOT / "documents" / "sources"
+RESULTS_DIR = BENCH_DIR / "results"
+
+QUERIES = [
+    "Was sagt die AfD zur Migration?",
+    "Wie will die Regierung die Verwaltung digitalisieren?",
+    "Welche Position hat die FDP zur Schuldenbremse?",
+    "Was plant die Linke beim Mindestlohn?",
+    "Was steht im Koalitionsvertrag zum Bürgergeld?",
+    "Wie stehen die Parteien zur Rente mit 63?",
+    "Was wird zum Klimaschutz und zur Energiewende gesagt?",
+    "Welche Maßnahmen gibt es gegen Desinformation?",
+    "Wie soll die Bundeswehr finanziert werden?",
+    "Was sagen die Programme zur Wohnungsnot und Mietpreisbremse?",
+    "Wie wird das Thema Steuerentlastung behandelt?",
+    "Was ist zur Digitalisierung der Schulen geplant?",
+]
+
+
+def percentiles(samples_s):
+    if not samples_s:
+        return {}
+    a = np.asarray(samples_s) * 1000.0
+    return {
+        "n": len(a),
+        "mean_ms": round(float(a.mean()), 3),
+        "p50_ms": round(float(np.percentile(a, 50)), 3),
+        "p90_ms": round(float(np.percentile(a, 90)), 3),
+        "p99_ms": round(float(np.percentile(a, 99)), 3),
+        "max_ms": round(float(a.max()), 3),
+    }
+
+
+def _rss_mb(who=resource.RUSAGE_SELF) -> float:
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    r = resource.getrusage(who).ru_maxrss
+    return round(r / (1024 * 1024) if sys.platform == "darwin" else r / 1024, 1)
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_ROOT,
+                                       text=True, stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return "unknown"
+
+
+# ─────────────────────────────────────────────────────────────
+# child: one corpus size
+# ─────────────────────────────────────────────────────────────
+def _bench_generate_http(pipeline, levels, per_level):
+    import httpx
+    from app import rag_pipeline, endpoints
+    from app.main import app
+
+    rag_pipeline._GLOBAL_PIPELINE = pipeline
+    endpoints._GLOBAL_PIPELINE = pipeline
+
+    async def run(conc):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=600) as client:
+            sem = asyncio.Semaphore(conc)
+            lat = []
+
+            async def one(i):
+                async with sem:
+                    q = f"{QUERIES[i % len(QUERIES)]} (Sitzung {conc}-{i})"
+                    t0 = time.perf_counter()
+                    r = await client.post("/generate", json={"session_id": f"bench-{conc}-{i}", "query": q})
+                    r.raise_for_status()
+                    lat.append(time.perf_counter() - t0)
+
+            t0 = time.perf_counter()
+            await asyncio.gather(*(one(i) for i in range(per_level * conc)))
+            wall = time.perf_counter() - t0
+            return lat, wall
+
+    out = {}
+    for conc in levels:
+        lat, wall = asyncio.run(run(conc))
+        out[str(conc)] = {"requests": len(lat), "wall_s": round(wall, 3),
+                          "req_per_s": round(len(lat) / wall, 3), "latency": percentiles(lat)}
+    return out
+
+
+def _bench_generate_pipeline(pipeline, levels, per_level):
+    async def run(conc):
+        sem = asyncio.Semaphore(conc)
+        lat = []
+
+        async def one(i):
+            async with sem:
+                q = f"{QUERIES[i % len(QUERIES)]} (Sitzung {conc}-{i})"
+                t0 = time.perf_counter()
+                await pipeline.agenerate(q)
+                lat.append(time.perf_counter() - t0)
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(per_level * conc)))
+        return lat, time.perf_counter() - t0
+
+    out = {}
+    for conc in levels:
+        lat, wall = asyncio.run(run(conc))
+        out[str(conc)] = {"requests": len(lat), "wall_s": round(wall, 3),
+                          "req_per_s": round(len(lat) / wall, 3), "latency": percentiles(lat)}
+    return out
+
+
+def _reset_fake_ollama() -> dict:
+    """Cold KV cache and fresh counters on the fake server; returns its counters since the last reset."""
+    import httpx
+    from app.ollama_http import OLLAMA_BASE
+
+    r = httpx.post(f"{OLLAMA_BASE}/fake/reset", timeout=10)
+    r.raise_for_status()
+    return r.json()
+
+
+def _saved_pct(base, other):
+    return round(100 * (1 - other / base), 1) if base else 0.0
+
+
+def _bench_conversation(pipeline, sessions, turns):
+    """S sessions talking in parallel, T turns each, once per prompt layout.
+
+    Each layout starts from the same server state: the fake's KV slots are emptied, then every
+    session sends one history-free warm-up question (not counted), so neither layout inherits
+    the other's cached prefixes.
+    """
+    from app.endpoints import append_turn, chat_turns, format_history
+    from app.metrics import LLM_TOKENS
+
+    async def warm_up():
+        await asyncio.gather(*(pipeline.agenerate(f"{QUERIES[s % len(QUERIES)]} (Aufwärmen {s})")
+                               for s in range(sessions)))
+
+    async def run():
+        histories = [[] for _ in range(sessions)]
+        per_turn = []   # prompt_eval tokens per turn index
+        lat = []
+
+        async def one(s, t):
+            q = f"{QUERIES[(s + t) % len(QUERIES)]} (Sitzung {s}, Frage {t})"
+            t0 = time.perf_counter()
+            res = await pipeline.agenerate(q, history_prompt_str=format_history(histories[s]),
+                                           history_turns=chat_turns(histories[s]))
+            lat.append(time.perf_counter() - t0)
+            histories[s] = append_turn(histories[s], q, res["response"], res)
+
+        for t in range(turns):
+            before = LLM_TOKENS.value(model=pipeline.chat_model, kind="prompt")
+            await asyncio.gather(*(one(s, t) for s in range(sessions)))
+            per_turn.append(int(LLM_TOKENS.value(model=pipeline.chat_model, kind="prompt") - before))
+        return per_turn, lat
+
+    out = {}
+    for api in ("generate", "chat"):
+        pipeline.llm_api = api
+        pipeline._retrieval_cache.clear()
+        _reset_fake_ollama()
+        asyncio.run(warm_up())
+        per_turn, lat = asyncio.run(run())
+        out[api] = {"prompt_eval_tokens": sum(per_turn), "prompt_eval_by_turn": per_turn,
+                    "latency": percentiles(lat)}
+    _reset_fake_ollama()
+    g, c = out["generate"]["prompt_eval_by_turn"], out["chat"]["prompt_eval_by_turn"]
+    out["chat"]["prompt_eval_saved_pct"] = _saved_pct(sum(g), sum(c))
+    out["chat"]["prompt_eval_saved_pct_after_first"] = _saved_pct(sum(g[1:]), sum(c[1:]))
+    return out
+
+
+def _bench_burst(pipeline, n):
+    """n identical questions at the same moment (news-event burst), coalescing off vs on."""
+    from app import singleflight
+    from app.singleflight import COALESCED
+
+    async def run(q):
+        lat = []
+
+        async def one():
+            t0 = time.perf_counter()
+            await pipeline.agenerate(q)
+            lat.append(time.perf_counter() - t0)
+
+        await asyncio.gather(*(one() for _ in range(n)))
+        return lat
+
+    out = {}
+    enabled = singleflight.COALESCE_ENABLED
+    try:
+        for mode, on in (("off", False), ("on", True)):
+            singleflight.COALESCE_ENABLED = on
+            before = COALESCED.value(layer="llm")
+            lat = asyncio.run(run(f"{QUERIES[0]} (Eilmeldung, coalescing {mode})"))
+            out[mode] = {"requests": n, "llm_calls": n - int(COALESCED.value(layer="llm") - before),
+                         "latency": percentiles(lat)}
+    finally:
+        singleflight.COALESCE_ENABLED = enabled
+    return out
+
+
+def _bench_batch(pipeline, n):
+    """n claims: one agenerate per claim (the old HTTP loop) vs. one agenerate_batch."""
+    from app.rag_pipeline import BATCH_CONCURRENCY
+
+    def claims(tag):
+        return [f"{QUERIES[i % len(QUERIES)]} (Behauptung {tag}-{i})" for i in range(n)]
+
+    async def loop(qs):
+        for q in qs:
+            await pipeline.agenerate(q)
+
+    async def batch(qs):
+        return [item async for item in pipeline.agenerate_batch(qs)]
+
+    out = {}
+    for mode, fn in (("loop", loop), ("batch", batch)):
+        pipeline._retrieval_cache.clear()
+        pipeline._embed_cache.clear()
+        pipeline._candidate_cache.clear()
+        t0 = time.perf_counter()
+        asyncio.run(fn(claims(mode)))
+        wall = time.perf_counter() - t0
+        out[mode] = {"items": n, "wall_s": round(wall, 3), "items_per_s": round(n / wall, 3)}
+    out["batch"]["concurrency"] = BATCH_CONCURRENCY
+    return out
+
+
+def _mmr_gains(unit, scores, picks, lambda_mult):
+    # MMR score of each pick at the moment it was picked
+    gains = []
+    for i, j in enumerate(picks):
+        redundancy = max((float(unit[j] @ unit[p]) for p in picks[:i]), default=0.0)
+        gains.append(lambda_mult * float(scores[j]) - (1.0 - lambda_mult) * redundancy)
+    return gains
+
+
+def _bench_mmr(pipeline, fetch_ks, k=4, rounds=5):
+    """
+    MMR over the same candidate pools: native (_mmr_select) vs. langchain, per
+    fetch_k. Picks that differ only on float ties (duplicate chunks, same MMR
+    scores within 1e-5) count as "tied"; real differences are reported as
+    "mismatches", they don't stop the run.
+    """
+    from app.rag_pipeline import _mmr_select, _unit_rows
+    from langchain_community.vectorstores.utils import maximal_marginal_relevance
+
+    vs = pipeline._ensure_vs()
+    q_embs = pipeline._embed_batch(QUERIES)
+    out = {}
+    for fk in fetch_ks:
+        native, lc = [], []
+        same, tied, mismatches = 0, 0, []
+        for cand, q in zip(pipeline._query_candidates_batch(vs, q_embs, fk), q_embs):
+            scores = cand["unit"] @ _unit_rows(q[None, :])[0]
+            for _ in range(rounds):
+                t0 = time.perf_counter()
+                a = _mmr_select(cand["unit"], scores, k, pipeline.lambda_mult)
+                native.append(time.perf_counter() - t0)
+                t0 = time.perf_counter()
+                b = maximal_marginal_relevance(q, cand["unit"], lambda_mult=pipeline.lambda_mult, k=k)
+                lc.append(time.perf_counter() - t0)
+            b = [int(i) for i in b]
+            if a == b:
+                same += 1
+            elif np.allclose(_mmr_gains(cand["unit"], scores, a, pipeline.lambda_mult),
+                             _mmr_gains(cand["unit"], scores, b, pipeline.lambda_mult), atol=1e-5):
+                tied += 1
+            else:
+                mismatches.append({"native": a, "langchain": b})
+        if mismatches:
+            print(f"WARNING: MMR picks differ from langchain at fetch_k={fk}: {mismatches}")
+        out[str(fk)] = {"native": percentiles(native), "langchain": percentiles(lc),
+                        "same_picks": same, "tied_picks": tied, "mismatches": mismatches}
+    return out
+
+
+def _redis_up() -> bool:
+    try:
+        import redis
+        return bool(redis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0"),
+                                   socket_connect_timeout=0.5).ping())
+    except Exception:
+        return False
+
+
+def child(args) -> dict:
+    from pypdf import PdfReader
+    from app.rag_pipeline import RAGPipeline
+
+    work = Path(args.workdir)
+    src = work / "src"
+    src.mkdir(parents=True, exist_ok=True)
+    pdfs = sorted(Path(args.sources).glob("*.pdf"))[: args.size]
+    for p in pdfs:
+        (src / p.name).symlink_to(p.resolve())
+    pages = sum(len(PdfReader(str(p)).pages) for p in pdfs)
+
+    pipeline = RAGPipeline(source_dir=str(src), persist_dir=str(work / "db"),
+                           retrieval_mode=args.retrieval_mode)
+    pipeline.semantic_cache = None   # measure real work, not cache hits
+
+    # ingestion (cold build)
+    t0 = time.perf_counter()
+    manifest = pipeline.ingest()
+    ingest_s = time.perf_counter() - t0
+    chunks = sum(f.get("chunks", 0) for f in manifest["files"].values())
+    rss_after_ingest = _rss_mb()
+
+    # retrieval latency
+    cold, warm = [], []
+    for _ in range(args.retrieve_rounds):
+        for q in QUERIES:
+            pipeline._retrieval_cache.clear()
+            pipeline._embed_cache.clear()
+            pipeline._candidate_cache.clear()
+            t0 = time.perf_counter()
+            pipeline.retrieve(q)
+            cold.append(time.perf_counter() - t0)
+            t0 = time.perf_counter()
+            pipeline.retrieve(q)
+            warm.append(time.perf_counter() - t0)
+
+    # generation throughput
+    if _redis_up():
+        gen_path, gen = "http", _bench_generate_http(pipeline, args.concurrency, args.per_level)
+    else:
+        gen_path, gen = "pipeline", _bench_generate_pipeline(pipeline, args.concurrency, args.per_level)
+
+    mmr = _bench_mmr(pipeline, args.mmr_fetch_k)
+    conversation = _bench_conversation(pipeline, args.conv_sessions, args.conv_turns)
+    pipeline.llm_api = "chat"
+    burst = _bench_burst(pipeline, args.burst)
+    batch = _bench_batch(pipeline, args.batch)
+
+    return {
+        "corpus": {"pdfs": len(pdfs), "pages": pages, "chunks": chunks,
+                   "bytes": sum(p.stat().st_size for p in pdfs)},
+        "ingest": {"wall_s": round(ingest_s, 3),
+                   "pages_per_s": round(pages / ingest_s, 2),
+                   "chunks_per_s": round(chunks / ingest_s, 2)},
+        "retrieve": {"cold": percentiles(cold), "warm": percentiles(warm)},
+        "generate": {"path": gen_path, "by_concurrency": gen},
+        "mmr": mmr,
+        "conversation": conversation,
+        "burst": burst,
+        "batch": batch,
+        "memory": {"rss_after_ingest_mb": rss_after_ingest, "rss_peak_mb": _rss_mb(),
+                   "parser_rss_peak_mb": _rss_mb(resource.RUSAGE_CHILDREN)},
+    }
+
+
+# ─────────────────────────────────────────────────────────────
+# parent
+# ─────────────────────────────────────────────────────────────
+def run_all(args) -> dict:
+    sys.path.insert(0, str(PROJECT_ROOT))
+    from benchmarks.fake_ollama import FakeOllama, FakeOllamaConfig
+
+    n_pdfs = len(list(Path(args.sources).glob("*.pdf")))
+    sizes = sorted({min(s, n_pdfs) for s in (args.sizes or [1, max(1, n_pdfs // 2), n_pdfs])})
+    cfg = FakeOllamaConfig(dim=args.dim, embed_delay=args.embed_delay, embed_item_delay=args.embed_item_delay,
+                           gen_first_token_delay=args.gen_first_token_delay,
+                           gen_tokens_per_s=args.gen_tokens_per_s, gen_tokens=args.gen_tokens,
+                           prefill_tokens_per_s=args.prefill_tokens_per_s, kv_slots=args.kv_slots)
+
+    results = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "fake_ollama": vars(cfg),
+            "retrieval_mode": args.retrieval_mode,
+            "concurrency_levels": args.concurrency,
+        },
+        "sizes": {},
+    }
+
+    with FakeOllama(config=cfg) as fake:
+        env = {**os.environ, "OLLAMA_BASE_URL": fake.url, "OLLAMA_HOST": fake.url}
+        for size in sizes:
+            work = tempfile.mkdtemp(prefix=f"ragbench-{size}-")
+            try:
+                cmd = [sys.executable, "-m", "benchmarks.run_benchmarks", "--child",
+                       "--size", str(size), "--workdir", work, "--sources", str(args.sources),
+                       "--retrieve-rounds", str(args.retrieve_rounds), "--per-level", str(args.per_level),
+                       "--retrieval-mode", args.retrieval_mode,
+                       "--conv-sessions", str(args.conv_sessions), "--conv-turns", str(args.conv_turns),
+                       "--burst", str(args.burst), "--batch", str(args.batch),
+                       "--mmr-fetch-k", *map(str, args.mmr_fetch_k),
+                       "--concurrency", *map(str, args.concurrency)]
+                print(f"▶ corpus size {size} …", flush=True)
+                proc = subprocess.run(cmd, cwd=PROJECT_ROOT, env=env, capture_output=True, text=True)
+                if proc.returncode != 0:
+                    print(proc.stdout[-2000:], proc.stderr[-4000:], file=sys.stderr)
+                    raise SystemExit(f"benchmark child for size {size} failed")
+                results["sizes"][str(size)] = json.loads(proc.stdout.strip().splitlines()[-1])
+            finally:
+                shutil.rmtree(work, ignore_errors=True)
+        results["meta"]["fake_ollama_requests"] = fake.summary()
+    return results
+
+
+def print_summary(results: dict) -> None:
+    print(f"\ncommit {results['meta']['commit']}  ({results['meta']['timestamp']})")
+    for size, r in results["sizes"].items():
+        c, ing, ret = r["corpus"], r["ingest"], r["retrieve"]
+        print(f"\n[{size} PDFs] {c['pages']} pages, {c['chunks']} chunks")
+        print(f"  ingest    {ing['wall_s']:.2f}s  ({ing['pages_per_s']} pages/s, {ing['chunks_per_s']} chunks/s)")
+        print(f"  retrieve  cold p50 {ret['cold']['p50_ms']} ms  p99 {ret['cold']['p99_ms']} ms | "
+              f"warm p50 {ret['warm']['p50_ms']} ms")
+        for conc, g in r["generate"]["by_concurrency"].items():
+            print(f"  generate  c={conc:<3} {g['req_per_s']} req/s  p50 {g['latency']['p50_ms']} ms  "
+                  f"p99 {g['latency']['p99_ms']} ms  [{r['generate']['path']}]")
+        for fk, mm in r.get("mmr", {}).items():
+            print(f"  mmr       fetch_k={fk:<4} native p50 {mm['native']['p50_ms']} ms | "
+                  f"langchain p50 {mm['langchain']['p50_ms']} ms | picks same {mm.get('same_picks', '-')}, "
+                  f"tied {mm.get('tied_picks', '-')}, differ {len(mm.get('mismatches', []))}")
+        conv = r.get("conversation")
+        if conv:
+            g, c = conv["generate"], conv["chat"]
+            print(f"  convers.  prompt_eval tokens generate {g['prompt_eval_tokens']} → chat {c['prompt_eval_tokens']} "
+                  f"({c['prompt_eval_saved_pct']}% saved, {c['prompt_eval_saved_pct_after_first']}% after turn 1), p50 {g['latency']['p50_ms']} → {c['latency']['p50_ms']} ms")
+        b = r.get("burst")
+        if b:
+            print(f"  burst     {b['on']['requests']} identical requests: Ollama calls {b['off']['llm_calls']} → "
+                  f"{b['on']['llm_calls']}, p50 {b['off']['latency']['p50_ms']} → {b['on']['latency']['p50_ms']} ms")
+        bt = r.get("batch")
+        if bt:
+            print(f"  batch     {bt['batch']['items']} claims: one by one {bt['loop']['items_per_s']} items/s → "
+                  f"batch {bt['batch']['items_per_s']} items/s (concurrency {bt['batch']['concurrency']})")
+        m = r["memory"]
+        print(f"  memory    peak RSS {m['rss_peak_mb']} MB (after ingest {m['rss_after_ingest_mb']} MB), "
+              f"parser processes {m['parser_rss_peak_mb']} MB")
+
+
+def _flatten(d, prefix=""):
+    out = {}
+    for k, v in d.items():
+        key = f"{prefix}.{k}" if prefix else k
+        if isinstance(v, dict):
+            out.update(_flatten(v, key))
+        elif isinstance(v, (int, float)) and not isinstance(v, bool):
+            out[key] = v
+    return out
+
+
+def compare(old_path: str, new_path: str) -> None:
+    old = json.loads(Path(old_path).read_text())
+    new = json.loads(Path(new_path).read_text())
+    a, b = _flatten(old["sizes"]), _flatten(new["sizes"])
+    print(f"{'metric':<60} {old['meta']['commit']:>12} {new['meta']['commit']:>12} {'Δ%':>8}")
+    for k in sorted(set(a) & set(b)):
+        delta = (b[k] - a[k]) / a[k] * 100 if a[k] else 0.0
+        print(f"{k:<60} {a[k]:>12} {b[k]:>12} {delta:>+7.1f}%")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sizes", type=int, nargs="*", help="corpus sizes (number of PDFs)")
+    ap.add_argument("--sources", default=str(DEFAULT_SOURCES))
+    ap.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    ap.add_argument("--per-level", type=int, default=3, help="requests per concurrent session")
+    ap.add_argument("--retrieve-rounds", type=int, default=3)
+    ap.add_argument("--retrieval-mode", default="vector", choices=["vector", "bm25", "hybrid"])
+    ap.add_argument("--dim", type=int, default=1024)
+    ap.add_argument("--embed-delay", type=float, default=0.0)
+    ap.add_argument("--embed-item-delay", type=float, default=0.0)
+    ap.add_argument("--gen-first-token-delay", type=float, default=0.0)
+    ap.add_argument("--gen-tokens-per-s", type=float, default=0.0)
+    ap.add_argument("--gen-tokens", type=int, default=64)
+    ap.add_argument("--prefill-tokens-per-s", type=float, default=0.0)
+    ap.add_argument("--kv-slots", type=int, default=4, help="fake Ollama KV cache slots (OLLAMA_NUM_PARALLEL)")
+    ap.add_argument("--conv-sessions", type=int, default=4, help="parallel sessions in the conversation benchmark")
+    ap.add_argument("--conv-turns", type=int, default=6, help="turns per session")
+    ap.add_argument("--burst", type=int, default=16, help="identical concurrent requests in the burst benchmark")
+    ap.add_argument("--batch", type=int, default=24, help="claims in the batch benchmark")
+    ap.add_argument("--mmr-fetch-k", type=int, nargs="+", default=[40, 100, 200])
+    ap.add_argument("--out", help="result file (default: benchmarks/results/<timestamp>-<commit>.json)")
+    ap.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    # internal
+    ap.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    ap.add_argument("--size", type=int, help=argparse.SUPPRESS)
+    ap.add_argument("--workdir", help=argparse.SUPPRESS)
+    args = ap.parse_args(argv)
+
+    if args.compare:
+        return compare(*args.compare)
+
+    if args.child:
+        res = child(args)
+        print(json.dumps(res))
+        return
+
+    results = run_all(args)
+    out = Path(args.out) if args.out else RESULTS_DIR / f"{time.strftime('%Y%m%d-%H%M%S')}-{results['meta']['commit']}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(results, indent=2))
+    print_summary(results)
+    print(f"\nResults written to {out}")
+
+
+if __name__ == "__main__":
+    main()
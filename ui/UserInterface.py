@@ -6,39 +6,65 @@ Run from the *repo root* (the folder that contains `rag_pipeline_project/` and `
     streamlit run ui/UserInterface.py
 """
 
+import json
 import os
-import sys
 import uuid
 from pathlib import Path
+from urllib.parse import quote
 
 import requests
 import streamlit as st
-from pdf2image import convert_from_path  # requires poppler installed (brew install poppler)
-
-# ─────────────────────────────────────────────────────────────
-# Make the `app` package resolvable *from the repo root* and
-# use app.utils._abs so all paths are rooted at rag_pipeline_project/
-# ─────────────────────────────────────────────────────────────
-REPO_ROOT = Path(__file__).resolve().parents[1]          # …/Langchain-RAG-Practical
-APP_ROOT = REPO_ROOT / "rag_pipeline_project"            # …/Langchain-RAG-Practical/rag_pipeline_project
-if str(APP_ROOT) not in sys.path:
-    sys.path.insert(0, str(APP_ROOT))
-
-try:
-    from rag_pipeline_project.app.utils import _abs  # anchored at rag_pipeline_project/
-except Exception:
-    # Fallback: still anchor at rag_pipeline_project if import fails
-    def _abs(p: str | Path) -> Path:
-        return (APP_ROOT / p).resolve()
-
-# Allow overriding documents dir via env var (useful for Docker)
-DOCS_DIR = Path(os.getenv("DOCS_DIR", str(_abs("documents/sources"))))
 
 # ─────────────────────────────────────────────────────────────
 # Backend config
 # ─────────────────────────────────────────────────────────────
 BACKEND = os.getenv("RAG_API_URL", "http://127.0.0.1:8000")
 TIMEOUT = 300  # seconds
+STREAM = os.getenv("RAG_STREAM", "1") != "0"  # use /generate/stream (token-by-token)
+PAGE_DPI = 150
+PAGE_CACHE_ITEMS = 32  # page images kept per browser session
+
+
+def fetch_page(source: str, page: int) -> bytes:
+    """
+    Rendered PDF page from the backend (GET /pages/…), which renders once and
+    caches on disk. Images are also kept in the session, and a rerun only
+    revalidates them with If-None-Match (→ 304, no body).
+    """
+    url = f"{BACKEND}/pages/{quote(source)}/{page}?dpi={PAGE_DPI}"
+    cache = st.session_state.setdefault("page_cache", {})   # url → (etag, bytes)
+    cached = cache.get(url)
+    headers = {"If-None-Match": cached[0]} if cached else {}
+    r = requests.get(url, headers=headers, timeout=(5, 60))
+    if r.status_code == 304 and cached:
+        cache[url] = cache.pop(url)   # most recently used last
+        return cached[1]
+    if r.status_code >= 400:
+        try:
+            detail = r.json().get("detail", r.text)
+        except ValueError:
+            detail = r.text
+        raise RuntimeError(f"{r.status_code}: {detail}")
+    cache[url] = (r.headers.get("ETag", ""), r.content)
+    while len(cache) > PAGE_CACHE_ITEMS:
+        cache.pop(next(iter(cache)))
+    return r.content
+
+
+def iter_sse(resp):
+    """Yield (event, data) pairs from a text/event-stream response."""
+    event, data = "message", []
+    for line in resp.iter_lines(decode_unicode=True):
+        if line is None:
+            continue
+        if line == "":
+            if data:
+                yield event, json.loads("\n".join(data))
+            event, data = "message", []
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data.append(line[len("data:"):].strip())
 
 # ─────────────────────────────────────────────────────────────
 # Streamlit page setup
@@ -99,9 +125,8 @@ else:
 
     chosen = latest_chunks[int(idx)]
 
-    # Always resolve to your host docs dir using just the filename
+    # the backend looks the file up by bare filename in its source dir
     src_name = Path(str(chosen.get("source", ""))).name
-    pdf_path = Path(DOCS_DIR) / src_name
 
     # Page number (safe fallback)
     try:
@@ -109,18 +134,11 @@ else:
     except Exception:
         page_num = 1
 
-    if not pdf_path.exists():
-        st.error(f"PDF nicht gefunden: {pdf_path}")
-        st.caption(f"(Hinweis: DOCS_DIR = {DOCS_DIR})")
-    else:
-        try:
-            pages = convert_from_path(
-                str(pdf_path), dpi=150, first_page=page_num, last_page=page_num
-            )
-            st.image(pages[0], use_column_width=True, caption=f"{pdf_path.name} - Seite {page_num}")
-        except Exception as e:
-            st.warning(f"Konnte die PDF-Seite nicht rendern (zeige nur Pfad). Grund: {e}")
-            st.code(str(pdf_path))
+    try:
+        st.image(fetch_page(src_name, page_num), use_column_width=True, caption=f"{src_name} - Seite {page_num}")
+    except (requests.RequestException, RuntimeError) as e:
+        st.warning(f"Konnte die PDF-Seite nicht laden. Grund: {e}")
+        st.code(src_name)
 
 
 # ─────────────────────────────────────────────────────────────
@@ -149,22 +167,57 @@ if user_msg:
     st.chat_message("user").write(user_msg)
     payload = {"session_id": st.session_state.session_id, "query": user_msg}
 
-    with st.spinner("Antwort wird erstellt…"):
-        try:
-            r = requests.post(f"{BACKEND}/generate", json=payload, timeout=TIMEOUT)
-            r.raise_for_status()
-            data = r.json()
-        except requests.RequestException as e:
-            st.error(f"Request fehlgeschlagen: {e}")
-        else:
-            answer = data.get("response", "")
-            chunks = data.get ("chunks") if False else data.get("chunks", [])  # keep key robust
-            with st.chat_message("assistant"):
-                st.write(answer)  # no raw chunk dump
-
-            # persist for viewer + chat log
-            st.session_state["chunks_history"].append(chunks or [])
+    if STREAM:
+        data, stream_chunks = None, []
+        with st.chat_message("assistant"):
+            placeholder = st.empty()
+            placeholder.markdown("_Quellen werden gesucht…_")
+            answer = ""
+            try:
+                with requests.post(
+                    f"{BACKEND}/generate/stream", json=payload, stream=True, timeout=(10, TIMEOUT)
+                ) as r:
+                    r.raise_for_status()
+                    for event, ev in iter_sse(r):
+                        if event == "chunks":
+                            stream_chunks = ev.get("chunks") or []
+                            placeholder.markdown("_Antwort wird erstellt…_")
+                        elif event == "token":
+                            answer += ev.get("text", "")
+                            placeholder.markdown(answer + "▌")
+                        elif event == "done":
+                            data = ev
+                        elif event == "error":
+                            st.error(f"Request fehlgeschlagen: {ev.get('detail')}")
+                            break
+                if data is not None:
+                    placeholder.markdown(data.get("response", answer))
+            except requests.RequestException as e:
+                st.error(f"Request fehlgeschlagen: {e}")
+
+        if data is not None:
+            # persist for viewer + chat log (chunks arrive in their own event)
+            st.session_state["chunks_history"].append(stream_chunks)
             hist = data.get("history") or []
             st.session_state["history"] = [(m.get("role","assistant"), m.get("text","")) for m in hist]
-
             st.rerun()
+    else:
+        with st.spinner("Antwort wird erstellt…"):
+            try:
+                r = requests.post(f"{BACKEND}/generate", json=payload, timeout=TIMEOUT)
+                r.raise_for_status()
+                data = r.json()
+            except requests.RequestException as e:
+                st.error(f"Request fehlgeschlagen: {e}")
+            else:
+                answer = data.get("response", "")
+                chunks = data.get ("chunks") if False else data.get("chunks", [])  # keep key robust
+                with st.chat_message("assistant"):
+                    st.write(answer)  # no raw chunk dump
+
+                # persist for viewer + chat log
+                st.session_state["chunks_history"].append(chunks or [])
+                hist = data.get("history") or []
+                st.session_state["history"] = [(m.get("role","assistant"), m.get("text","")) for m in hist]
+
+                st.rerun()